@@ -0,0 +1,147 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Flow-rate and delivered-volume analytics over the position history.
+
+All functions take columns of telemetry samples (syringe_pump.telemetry), e.g.
+views returned by Telemetry.last_seconds() or Archive.read(), and are
+vectorized: one pass of numpy operations over the window, no Python loop over
+the samples.
+
+Sign convention: the position is the volume in the syringe (uL), so the flow
+rate is -d(position)/dt. It is positive while the pump dispenses (plunger
+moves towards 0) and negative while it aspirates.
+
+- flow_rates: rate between consecutive samples
+- windowed_rate: least-squares slope of the position over the window
+- delivered_volume: dispensed and aspirated volume (sums of the decreases and the increases of the position)
+- speed_deviation: mean relative difference between the measured and the commanded speed while the pump is busy
+- stalls: intervals during which the pump is busy, the position does not change and the commanded speed should have
+  moved the plunger
+- summarize: all of the above as one dictionary, used for the PVs
+
+Examples
+--------
+>>> from syringe_pump.analytics import summarize
+>>> samples = device.telemetry.last_seconds(10.0)
+>>> summarize(samples['time'], samples['position'], samples['busy'], samples['speed'])
+{'flow_rate': 0.1, 'flow_rate_window': 0.1, 'dispensed': 1.0, 'aspirated': 0.0, 'speed_deviation': 0.002,
+ 'stalls': 0, 'stalled': False}
+"""
+
+from numpy import diff, nan, isfinite, flatnonzero, r_, abs, cumsum, empty, errstate
+
+
+def flow_rates(t, position):
+    """
+    returns flow rate between consecutive samples, uL/s; len(t) - 1 values, nan where the time does not increase or
+    the position is unknown
+
+    Examples
+    --------
+    >>> flow_rates(array([0.0, 1.0, 2.0]), array([10.0, 9.5, 9.5]))
+    array([0.5, 0. ])
+    """
+    dt = diff(t)
+    with errstate(divide = 'ignore', invalid = 'ignore'):
+        rate = -diff(position)/dt
+    rate[~(dt > 0)] = nan
+    return rate
+
+def windowed_rate(t, position):
+    """
+    returns flow rate over the samples as the least-squares slope of the position, uL/s; nan if fewer than two
+    valid samples
+    """
+    valid = isfinite(t) & isfinite(position)
+    if valid.sum() < 2:
+        return nan
+    t = t[valid]
+    position = position[valid]
+    tc = t - t.mean()
+    denominator = (tc*tc).sum()
+    if denominator == 0:
+        return nan
+    return float(-(tc*(position - position.mean())).sum()/denominator)
+
+def delivered_volume(position):
+    """
+    returns (dispensed, aspirated) volume in uL: sums of the decreases and of the increases of the position between
+    consecutive samples. Unknown positions are skipped.
+
+    Examples
+    --------
+    >>> delivered_volume(array([10.0, 8.0, 9.0, 5.0]))
+    (6.0, 1.0)
+    """
+    position = position[isfinite(position)]
+    change = diff(position)
+    dispensed = -change[change < 0].sum()
+    aspirated = change[change > 0].sum()
+    return float(dispensed), float(aspirated)
+
+def speed_deviation(t, position, busy, speed):
+    """
+    returns mean relative deviation |measured rate| / commanded speed - 1 over the intervals during which the pump
+    was busy and moving (position changed); nan if there are none. A value of -0.1 means the plunger moves 10%
+    slower than commanded.
+    """
+    rate = abs(flow_rates(t, position))
+    commanded = speed[1:]
+    moving = (busy[1:] == 1) & (busy[:-1] == 1) & (rate > 0) & isfinite(rate) & (commanded > 0)
+    if not moving.any():
+        return nan
+    dt = diff(t)[moving]
+    return float(((rate[moving]/commanded[moving] - 1.0)*dt).sum()/dt.sum())
+
+def stalls(t, position, busy, speed, tolerance = 0.002, min_duration = 2.0, min_travel = 0.05):
+    """
+    returns intervals during which the pump was busy with a non-zero commanded speed but the position did not
+    change by more than tolerance, lasting at least min_duration seconds (longer than a valve move) with the
+    commanded speed adding up to at least min_travel uL over the interval.
+
+    Returns
+    -------
+    intervals: numpy array
+        shape (n, 2), columns start and end time
+
+    Examples
+    --------
+    >>> stalls(t, position, busy, speed)
+    array([[120.5, 131.0]])
+    """
+    if len(t) < 2:
+        return empty((0, 2))
+    dt = diff(t)
+    still = (busy[1:] == 1) & (busy[:-1] == 1) & (abs(diff(position)) <= tolerance) & (speed[1:] > 0) & (dt > 0)
+    if not still.any():
+        return empty((0, 2))
+    edges = diff(r_[0, still.astype('i1'), 0])
+    starts = flatnonzero(edges == 1)
+    ends = flatnonzero(edges == -1) #interval index after the last still one
+    travel = r_[0.0, cumsum(speed[1:]*dt*still)]
+    expected = travel[ends] - travel[starts]
+    duration = t[ends] - t[starts]
+    total = abs(position[ends] - position[starts])
+    selected = (duration >= min_duration) & (expected >= min_travel) & (total <= tolerance)
+    intervals = empty((selected.sum(), 2))
+    intervals[:, 0] = t[starts[selected]]
+    intervals[:, 1] = t[ends[selected]]
+    return intervals
+
+def summarize(t, position, busy, speed, tolerance = 0.002, min_duration = 2.0, min_travel = 0.05):
+    """
+    returns analytics of the samples as a dictionary: flow_rate (last interval, uL/s), flow_rate_window (uL/s),
+    dispensed and aspirated (uL), speed_deviation, stalls (number of stall intervals) and stalled (the last stall
+    lasts until the last sample)
+    """
+    rate = flow_rates(t[-2:], position[-2:])
+    dispensed, aspirated = delivered_volume(position)
+    intervals = stalls(t, position, busy, speed, tolerance, min_duration, min_travel)
+    return {'flow_rate': float(rate[0]) if len(rate) else nan,
+            'flow_rate_window': windowed_rate(t, position),
+            'dispensed': dispensed,
+            'aspirated': aspirated,
+            'speed_deviation': speed_deviation(t, position, busy, speed),
+            'stalls': len(intervals),
+            'stalled': bool(len(intervals) and intervals[-1, 1] == t[-1])}
@@ -0,0 +1,293 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Persistent telemetry archive.
+
+The telemetry ring of the device (syringe_pump.telemetry) holds the last two
+hours in memory. ArchiveWriter copies new samples from the ring to an Archive
+in a background thread every period seconds, so the poll loop never waits for
+the disk. The archive is a directory of segments, one per segment_duration
+seconds (named by the start time). A segment stores every telemetry field
+(time, position, busy, valve, speed, error_code, latency) in its own
+append-only binary file. Range reads memory-map the column files and return
+views, so reading a day of history copies nothing. Segments older than the
+retention period are deleted as a whole.
+
+After a crash the columns of the last segment can have different lengths; the
+shortest column defines the number of complete samples.
+
+Examples
+--------
+>>> from syringe_pump.archive import Archive, ArchiveWriter
+>>> archive = Archive('/data/syringe_pump/NIH_syringe_pump_1', retention = 7*86400)
+>>> writer = ArchiveWriter(device.telemetry, archive)
+>>> chunks = archive.chunks(start = time() - 86400, end = time())
+>>> chunks[0]['position']
+memmap([25., 25., 24.998, ...])
+>>> archive.read(start = time() - 3600, fields = ('time', 'position'))['position'].shape
+(3600,)
+"""
+
+import os
+from threading import Thread, Event, Lock
+from logging import debug,info,warning,error
+import traceback
+
+from numpy import memmap, searchsorted, concatenate, empty, floor
+
+from syringe_pump.telemetry import TELEMETRY_DTYPE
+
+FIELDS = TELEMETRY_DTYPE.names
+
+
+class Segment(object):
+
+    def __init__(self, path):
+        """
+        Parameters
+        ----------
+        path: string
+            segment directory, its name is the start time in seconds
+        """
+        self.path = path
+        self.start = float(os.path.basename(path))
+        self.files = None #open append-mode files, only for the segment being written
+
+    def filename(self, field):
+        return os.path.join(self.path, field + '.bin')
+
+    def __len__(self):
+        lengths = []
+        for field in FIELDS:
+            try:
+                size = os.path.getsize(self.filename(field))
+            except OSError:
+                size = 0
+            lengths.append(size//TELEMETRY_DTYPE[field].itemsize)
+        return min(lengths)
+
+    def append(self, samples):
+        """
+        appends samples (structured array with TELEMETRY_DTYPE) to the column files
+        """
+        if self.files is None:
+            os.makedirs(self.path, exist_ok = True)
+            self.files = {field: open(self.filename(field), 'ab') for field in FIELDS}
+        for field in FIELDS:
+            self.files[field].write(samples[field].tobytes())
+        for field in FIELDS:
+            self.files[field].flush()
+
+    def close(self):
+        if self.files is not None:
+            for f in self.files.values():
+                f.close()
+            self.files = None
+
+    def columns(self, fields = FIELDS):
+        """
+        returns dictionary field -> read-only memory-mapped column, None if the segment is empty
+        """
+        n = len(self)
+        if n == 0:
+            return None
+        return {field: memmap(self.filename(field), dtype = TELEMETRY_DTYPE[field], mode = 'r', shape = (n,))
+                for field in fields}
+
+    def last_time(self):
+        columns = self.columns(('time',))
+        if columns is None:
+            return self.start
+        return float(columns['time'][-1])
+
+
+class Archive(object):
+
+    def __init__(self, directory, segment_duration = 3600.0, retention = 7*86400.0):
+        """
+        Parameters
+        ----------
+        directory: string
+            archive directory, created if it does not exist
+        segment_duration: float
+            time span of one segment, seconds
+        retention: float
+            segments with all samples older than retention seconds (relative to the last archived sample) are
+            deleted, None - keep everything
+        """
+        self.directory = directory
+        self.segment_duration = segment_duration
+        self.retention = retention
+        self.lock = Lock()
+        os.makedirs(directory, exist_ok = True)
+        self.segments = sorted((Segment(os.path.join(directory, name)) for name in os.listdir(directory)
+                                if self.is_segment(name)), key = lambda segment: segment.start)
+        self.current = None
+
+    @staticmethod
+    def is_segment(name):
+        try:
+            float(name)
+        except ValueError:
+            return False
+        return True
+
+    def append(self, samples):
+        """
+        appends samples (structured array with TELEMETRY_DTYPE, sorted by time) to the archive. A new segment is
+        started when the first sample is segment_duration past the start of the current one.
+        """
+        if len(samples) == 0:
+            return
+        with self.lock:
+            t = samples['time']
+            i = 0
+            while i < len(samples):
+                if self.current is None or t[i] >= self.current.start + self.segment_duration:
+                    self.new_segment(t[i])
+                j = searchsorted(t, self.current.start + self.segment_duration, side = 'left')
+                if j <= i:
+                    j = len(samples)
+                self.current.append(samples[i:j])
+                i = j
+            self.apply_retention(float(t[-1]))
+
+    def new_segment(self, t):
+        if self.current is not None:
+            self.current.close()
+        name = '{:d}'.format(int(floor(t)))
+        if self.segments and os.path.basename(self.segments[-1].path) == name:
+            self.current = self.segments[-1]
+            return
+        self.current = Segment(os.path.join(self.directory, name))
+        self.segments.append(self.current)
+
+    def apply_retention(self, now):
+        """
+        deletes segments that end more than retention seconds before now
+        """
+        if self.retention is None:
+            return
+        while len(self.segments) > 1 and self.segments[1].start <= now - self.retention - self.segment_duration:
+            self.delete(self.segments[0])
+        while len(self.segments) > 1 and self.segments[0].last_time() < now - self.retention:
+            self.delete(self.segments[0])
+
+    def delete(self, segment):
+        segment.close()
+        for field in FIELDS:
+            try:
+                os.remove(segment.filename(field))
+            except OSError:
+                pass
+        try:
+            os.rmdir(segment.path)
+        except OSError:
+            warning('could not remove archive segment {}'.format(segment.path))
+        self.segments.remove(segment)
+        info('archive segment {} deleted by the retention policy'.format(segment.path))
+
+    def chunks(self, start = None, end = None, fields = FIELDS):
+        """
+        returns samples with start <= time < end as a list of dictionaries field -> memory-mapped view, one per
+        segment. Nothing is copied.
+
+        Parameters
+        ----------
+        start: float
+            None - from the first sample
+        end: float
+            None - to the last sample
+        fields: list
+
+        Returns
+        -------
+        chunks: list
+        """
+        with self.lock:
+            segments = list(self.segments)
+        result = []
+        for k, segment in enumerate(segments):
+            if end is not None and segment.start >= end:
+                break
+            if start is not None and k + 1 < len(segments) and segments[k + 1].start <= start:
+                continue
+            columns = segment.columns(set(fields) | {'time'})
+            if columns is None:
+                continue
+            t = columns['time']
+            i = 0 if start is None else searchsorted(t, start, side = 'left')
+            j = len(t) if end is None else searchsorted(t, end, side = 'left')
+            if j > i:
+                result.append({field: columns[field][i:j] for field in fields})
+        return result
+
+    def read(self, start = None, end = None, fields = FIELDS):
+        """
+        returns samples with start <= time < end as a dictionary field -> array. A single segment is returned as
+        views, several segments are concatenated (copied).
+        """
+        chunks = self.chunks(start, end, fields)
+        if len(chunks) == 1:
+            return chunks[0]
+        if len(chunks) == 0:
+            return {field: empty(0, dtype = TELEMETRY_DTYPE[field]) for field in fields}
+        return {field: concatenate([chunk[field] for chunk in chunks]) for field in fields}
+
+    def close(self):
+        with self.lock:
+            if self.current is not None:
+                self.current.close()
+                self.current = None
+
+
+class ArchiveWriter(object):
+
+    def __init__(self, telemetry, archive, period = 1.0):
+        """
+        Parameters
+        ----------
+        telemetry: Telemetry
+            ring of the device
+        archive: Archive
+        period: float
+            seconds between two writes
+        """
+        self.telemetry = telemetry
+        self.archive = archive
+        self.period = period
+        self.archived = telemetry.g_pointer #global number of the last archived sample
+        self.written = 0
+        self.lost = 0
+        self.stopped = Event()
+        self.thread = Thread(target = self.run, name = 'ArchiveWriter', daemon = True)
+        self.thread.start()
+
+    def flush(self):
+        """
+        writes all samples recorded since the last flush. Samples overwritten in the ring before they were written
+        are counted in self.lost.
+        """
+        samples, last = self.telemetry.since(self.archived)
+        if last - self.archived > len(samples):
+            self.lost += last - self.archived - len(samples)
+        if len(samples):
+            self.archive.append(samples)
+            self.written += len(samples)
+        self.archived = last
+
+    def run(self):
+        while not self.stopped.wait(self.period):
+            try:
+                self.flush()
+            except Exception:
+                error(f'archive write failed: {traceback.format_exc()}')
+        self.flush()
+        self.archive.close()
+
+    def stop(self):
+        """
+        writes the remaining samples and stops the thread
+        """
+        self.stopped.set()
+        self.thread.join()
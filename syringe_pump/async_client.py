@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+Asyncio client for coordinated multi-pump sequences.
+
+AsyncPump wraps the PVs of one pump IOC. The RBV, DMOV, VALVE, ACK and STATUS
+PVs are monitored, so the latest values are always in memory and wait_done()
+returns as soon as the IOC reports the end of the motion, without polling or
+fixed sleeps. AsyncPumps fans the same call out to many pumps concurrently.
+
+Examples
+--------
+>>> from syringe_pump.async_client import AsyncPumps
+>>> pumps = AsyncPumps({'a': 'NIH:SYRINGE3.', 'f': 'NIH:SYRINGE1.'})
+>>> await pumps.connect()
+>>> await pumps.flow({'f': (0, 0.02), 'a': (0, 0.01)})
+>>> await pumps['a'].move_abs(250, speed = 1.0)
+>>> await pumps['a'].wait_done()
+>>> await pumps.abort()
+"""
+
+import asyncio
+from logging import debug,info,warning,error
+
+from syringe_pump.device_client import response_value
+
+PV_NAMES = ('RBV', 'VAL', 'VELO', 'VALVE', 'DMOV', 'CMD', 'ACK', 'STATUS')
+MONITORED = ('RBV', 'DMOV', 'VALVE', 'ACK', 'STATUS')
+
+
+class AsyncPump(object):
+
+    def __init__(self, prefix, ctx = None):
+        """
+        Parameters
+        ----------
+        prefix: string
+            PV prefix of the pump, e.g. 'NIH:SYRINGE1.'
+        ctx: caproto.asyncio.client.Context
+            shared context, created on connect() if None
+        """
+        self.prefix = prefix
+        self.ctx = ctx
+        self.pvs = {}
+        self.names = {}
+        self.values = {}
+        self.target = None #position of the last move
+        self.tolerance = 0.002 #position tolerance of wait_done, uL
+        self.changed = None
+
+    async def connect(self, timeout = 2.0):
+        """
+        connects PVs and subscribes to RBV, DMOV, VALVE, ACK and STATUS
+        """
+        if self.ctx is None:
+            from caproto.asyncio.client import Context
+            self.ctx = Context()
+        self.changed = asyncio.Condition()
+        pvs = await self.ctx.get_pvs(*[self.prefix + name for name in PV_NAMES], timeout = timeout)
+        await asyncio.gather(*[pv.wait_for_connection(timeout = timeout) for pv in pvs])
+        self.pvs = dict(zip(PV_NAMES, pvs))
+        self.names = {pv.name: name for name, pv in self.pvs.items()}
+        for name in MONITORED:
+            subscription = self.pvs[name].subscribe(data_type = 'time')
+            subscription.add_callback(self._on_update)
+        await self.wait_for(lambda: all(name in self.values for name in MONITORED), timeout = timeout)
+
+    async def _on_update(self, subscription, response):
+        self.values[self.names[subscription.pv.name]] = response_value(response)
+        async with self.changed:
+            self.changed.notify_all()
+
+    async def wait_for(self, predicate, timeout = None):
+        """
+        waits until predicate() is True, predicate is evaluated on every monitor update
+        """
+        async def wait():
+            async with self.changed:
+                await self.changed.wait_for(predicate)
+        await asyncio.wait_for(wait(), timeout)
+
+    async def put(self, name, value):
+        """
+        writes value into PV name and waits for the IOC to accept it
+        """
+        await self.pvs[name].write(value, wait = True)
+
+    @property
+    def position(self):
+        return self.values.get('RBV')
+
+    def done(self):
+        """
+        returns True if the IOC reports the end of the motion (DMOV) and the readback is at the target of the last
+        move
+        """
+        if not self.values.get('DMOV'):
+            return False
+        if self.target is None:
+            return True
+        position = self.values.get('RBV')
+        return position is not None and abs(position - self.target) <= self.tolerance
+
+    async def wait_done(self, timeout = None):
+        """
+        waits for the end of the motion, see done()
+        """
+        await self.wait_for(self.done, timeout = timeout)
+
+    async def move_abs(self, position, speed = None):
+        """
+        sets speed (if given) and moves to position
+        """
+        if speed is not None:
+            await self.put('VELO', speed)
+        self.target = position
+        await self.put('VAL', position)
+
+    async def flow(self, position = 0, speed = 0.1):
+        """
+        safe flow towards position with speed, see Device.flow
+        """
+        self.target = position
+        await self.put('CMD', 'flow {} {}'.format(position, speed))
+
+    async def set_speed_on_the_fly(self, speed):
+        await self.put('VELO', speed)
+
+    async def set_valve(self, valve):
+        await self.put('VALVE', valve)
+        await self.wait_for(lambda: self.values.get('VALVE') == valve)
+
+    async def abort(self):
+        """
+        aborts the motion, the pump is done at the current position
+        """
+        self.target = None
+        await self.put('CMD', 'abort')
+
+
+class AsyncPumps(object):
+
+    def __init__(self, prefixes):
+        """
+        Parameters
+        ----------
+        prefixes: dictionary or list
+            name -> PV prefix, or list of prefixes (the prefixes are used as names)
+        """
+        if not isinstance(prefixes, dict):
+            prefixes = {prefix: prefix for prefix in prefixes}
+        self.prefixes = prefixes
+        self.pumps = {}
+
+    def __getitem__(self, name):
+        return self.pumps[name]
+
+    async def connect(self, timeout = 2.0):
+        """
+        connects all pumps with one shared context
+        """
+        from caproto.asyncio.client import Context
+        ctx = Context()
+        self.pumps = {name: AsyncPump(prefix, ctx) for name, prefix in self.prefixes.items()}
+        await asyncio.gather(*[pump.connect(timeout) for pump in self.pumps.values()])
+
+    async def gather(self, method, arguments):
+        """
+        calls AsyncPump method on several pumps concurrently.
+
+        Parameters
+        ----------
+        method: string
+            AsyncPump method name
+        arguments: dictionary
+            pump name -> argument tuple (or single argument)
+
+        Returns
+        -------
+        results: dictionary
+            pump name -> result
+        """
+        names = list(arguments)
+        calls = []
+        for name in names:
+            args = arguments[name]
+            if not isinstance(args, tuple):
+                args = (args,)
+            calls.append(getattr(self.pumps[name], method)(*args))
+        return dict(zip(names, await asyncio.gather(*calls)))
+
+    async def flow(self, flows):
+        """
+        starts flows on several pumps: {name: (position, speed)}
+        """
+        return await self.gather('flow', flows)
+
+    async def move_abs(self, moves):
+        """
+        starts moves on several pumps: {name: (position, speed)}
+        """
+        return await self.gather('move_abs', moves)
+
+    async def set_speed_on_the_fly(self, speeds):
+        """
+        changes speeds on several pumps: {name: speed}
+        """
+        return await self.gather('set_speed_on_the_fly', speeds)
+
+    async def abort(self, names = None):
+        """
+        aborts all pumps or the pumps in names
+        """
+        return await self.gather('abort', {name: () for name in (names or self.pumps)})
+
+    async def wait_done(self, names = None, timeout = None):
+        """
+        waits until all pumps (or the pumps in names) are done
+        """
+        return await self.gather('wait_done', {name: (timeout,) for name in (names or self.pumps)})
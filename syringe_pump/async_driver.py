@@ -0,0 +1,440 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Asyncio-native driver for the Cavro Centris syringe pump.
+
+The serial port is opened with a non-blocking file descriptor which is
+registered with the event loop (loop.add_reader). Replies are collected by the
+reader callback and every command is an awaitable, so one event loop can drive
+many pumps (and serve PVs) without a thread per pump. The pacing between
+commands is done by the same Pacer as in the threaded Driver, but the waiting is
+done with asyncio.sleep.
+
+The reader callbacks require a selectable file descriptor, which is available
+for serial ports on Linux and macOS.
+
+Examples
+--------
+>>> from syringe_pump.async_driver import AsyncDriver
+>>> driver = AsyncDriver()
+>>> await driver.init(pump_id = 1, speed = 25, backlash = 100, orientation = 'Y', volume = 250)
+>>> await driver._get_position()
+{'value': b'0.000', 'error_code': b'`', 'busy': False, 'error': 'No Error'}
+"""
+
+import asyncio
+import os
+from time import time
+from logging import debug,info,warning,error
+
+from numpy import nan, isnan
+
+from syringe_pump.driver import Driver
+from syringe_pump.pacing import Pacer
+from syringe_pump.reply import ErrorCode, Status
+from syringe_pump import commands
+
+
+class AsyncDriver(object):
+
+    # reply parsing and port listing do not touch the port and are shared with the threaded driver
+    parse_reply = Driver.parse_reply
+    convert_error_code = Driver.convert_error_code
+    available_ports = Driver.available_ports
+    header = Driver.header
+    invalid_operand = Driver.invalid_operand
+
+    def __init__(self):
+        self._orientation = ''
+        self.serial_communication_dt = 0.1 #minimum distance between two commands while the pump is busy.
+        self.timeout = 2.0
+        self.pump_id = None
+        self.address = b'1'
+        self.port = None
+        self.fd = None
+        self.loop = None
+        self._backlash = nan
+        self.volume = 250.0
+        self.lock = None
+        self.pacer = Pacer(busy_gap = self.serial_communication_dt)
+        self._buffer = bytearray()
+        self._waiter = None
+
+#  ############################################################################
+#  Non-blocking Serial Communication
+#  ############################################################################
+
+    def open(self, port_name, baudrate = 9600):
+        """
+        opens serial port with non-blocking file descriptor and registers it with the running event loop.
+
+        Parameters
+        ----------
+        port_name: string
+            serial device name, e.g. '/dev/ttyUSB0'
+        baudrate: integer
+            baudrate, default 9600
+
+        Returns
+        -------
+
+        Examples
+        --------
+        >>> driver.open('/dev/ttyUSB0')
+        """
+        from serial import Serial
+        self.close()
+        self.port = Serial(port_name, baudrate = baudrate, timeout = 0)
+        self.fd = self.port.fileno()
+        os.set_blocking(self.fd, False)
+        self.loop = asyncio.get_running_loop()
+        self.lock = asyncio.Lock()
+        self.loop.add_reader(self.fd, self._on_readable)
+
+    def close(self):
+        """
+        unregisters the file descriptor from the event loop and closes serial port
+
+        Parameters
+        ----------
+
+        Returns
+        -------
+
+        Examples
+        --------
+        >>> driver.close()
+        """
+        if self.fd is not None and self.loop is not None:
+            self.loop.remove_reader(self.fd)
+        if self.port is not None:
+            self.port.close()
+        self.port = None
+        self.fd = None
+
+    def _on_readable(self):
+        """
+        reader callback: appends all available bytes to the receive buffer and resolves the pending reply once the
+        terminator arrives.
+        """
+        try:
+            data = os.read(self.fd, 4096)
+        except BlockingIOError:
+            return
+        except OSError as exception:
+            self._disconnected(exception)
+            return
+        if len(data) == 0:
+            port_name = getattr(self.port, 'port', None)
+            self._disconnected(ConnectionError('serial port {} was closed'.format(port_name)))
+            return
+        self._buffer += data
+        waiter = self._waiter
+        if waiter is not None and not waiter.done():
+            end = self._buffer.find(b'\x03\r\n')
+            if end >= 0:
+                reply = bytes(self._buffer[:end+3])
+                del self._buffer[:end+3]
+                waiter.set_result(reply)
+
+    def _disconnected(self, exception):
+        """
+        called by the reader when the device went away (EOF or e.g. EIO after a USB unplug): unregisters the
+        reader, so the event loop does not spin on the dead descriptor, fails the pending reply with exception and
+        closes the driver.
+        """
+        warning('pump {}: serial port lost: {!r}'.format(self.pump_id, exception))
+        waiter = self._waiter
+        if waiter is not None and not waiter.done():
+            waiter.set_exception(exception)
+        try:
+            self.close()
+        except OSError:
+            self.port = None
+            self.fd = None
+
+    async def _write(self, command):
+        """
+        writes all bytes of command into the non-blocking file descriptor
+        """
+        view = memoryview(command)
+        while len(view) > 0:
+            try:
+                n = os.write(self.fd, view)
+                view = view[n:]
+            except BlockingIOError:
+                writable = self.loop.create_future()
+                self.loop.add_writer(self.fd, writable.set_result, None)
+                try:
+                    await writable
+                finally:
+                    self.loop.remove_writer(self.fd)
+
+    async def query(self, command):
+        """
+        awaitable write-read command with the same pacing rules as Driver.query. The read is resolved by the event
+        loop reader callback; if no reply arrives within self.timeout the reply is treated as empty. If the device
+        goes away during the query, the OSError is raised and the driver is closed (later queries return the empty
+        reply).
+
+        Parameters
+        ----------
+        command: bytes
+            command to be written into serial port
+
+        Returns
+        -------
+        reply: dictionary
+            parsed reply
+
+        Examples
+        --------
+        >>> await driver.query(command = b'/1?29R\\r')
+        {'value': b'0', 'error_code': b'`', 'busy': False, 'error': 'No Error'}
+        """
+        if isinstance(command, str):
+            warning('Depreciation warning: expecting type bytes in query but received %r' % command)
+            command = command.encode('Latin-1')
+        if self.port is None:
+            return self.parse_reply(None)
+        command_class = self.pacer.classify(command)
+        async with self.lock:
+            dt = self.pacer.delay(time())
+            if dt > 0:
+                await asyncio.sleep(dt)
+            self._buffer.clear()
+            self._waiter = self.loop.create_future()
+            t1 = time()
+            await self._write(command)
+            self.last_command = command
+            try:
+                reply = await asyncio.wait_for(self._waiter, self.timeout)
+            except asyncio.TimeoutError:
+                reply = b''
+            finally:
+                self._waiter = None
+            t2 = time()
+            self.last_reply = reply
+            result = self.parse_reply(reply)
+            self.pacer.record(command_class, t1, t2, replied = len(reply) != 0, busy = result['busy'])
+        debug('query(): pid %r, command = %r, reply = %r', self.pump_id, command, reply)
+        return result
+
+    async def discover(self, pump_id = None):
+        """
+        finds the serial port of the pump with given pump_id (default self.pump_id), probed at self.address. The
+        scan is done by Driver.discover in the default executor, after that the port is reopened in non-blocking
+        mode.
+
+        Parameters
+        ----------
+        pump_id: integer
+
+        Returns
+        -------
+        port_name: string
+
+        Examples
+        --------
+        >>> await driver.discover(pump_id = 1)
+        '/dev/ttyUSB0'
+        """
+        if pump_id is None:
+            pump_id = self.pump_id
+        loop = asyncio.get_running_loop()
+        driver = Driver()
+        driver.address = self.address
+        driver.pump_id = pump_id
+        port = await loop.run_in_executor(None, driver.discover, pump_id)
+        if port is None:
+            return None
+        port_name = port.port
+        port.close()
+        self.open(port_name)
+        return port_name
+
+####################################################################################################
+### Syringe pumps commands
+####################################################################################################
+
+    async def _get_position(self):
+        """
+        queries position as an atomic command: "/1?18\\r"
+        """
+        return await self.query(command = self.header+b'?18\r')
+
+    async def _set_position(self, position):
+        """
+        move to absolute position with current speed: "/1A100.0,1R\\r"
+        """
+        try:
+            command = commands.encode_set_position(self.address, position, self.volume)
+        except ValueError as exception:
+            return self.invalid_operand(str(exception))
+        return await self.query(command = command)
+
+    async def _get_speed(self):
+        """
+        get speed as an atomic command: "/1?37\\r"
+        """
+        return await self.query(command = self.header+b'?37\r')
+
+    async def _set_speed(self, speed):
+        """
+        set speed as an atomic command: "/1V25.0,1R\\r"
+        """
+        try:
+            command = commands.encode_set_speed(self.address, speed, False, self.volume)
+        except ValueError as exception:
+            return self.invalid_operand(str(exception))
+        return await self.query(command = command)
+
+    async def _set_speed_on_the_fly(self, speed):
+        """
+        set speed on the fly: "/1V25.0,1F\\r"
+        """
+        try:
+            command = commands.encode_set_speed(self.address, speed, True, self.volume)
+        except ValueError as exception:
+            return self.invalid_operand(str(exception))
+        return await self.query(command = command)
+
+    async def get_speed(self):
+        return await self._get_speed()
+
+    async def set_speed(self, speed, on_the_fly = True):
+        """
+        set speed. If on_the_fly is False, the current move is aborted first.
+        """
+        spd = round(speed,3)
+        if on_the_fly:
+            reply = await self._set_speed_on_the_fly(speed = spd)
+        else:
+            await self.abort()
+            reply = await self._set_speed(speed = spd)
+        return reply
+
+    async def assign_volume(self, volume = 250):
+        """
+        specifies the syringe volume: 50, 100, 250 or 500 uL. See Driver.assign_volume.
+        """
+        volumes = commands.VOLUME_CODES
+        if volume in volumes.keys():
+            reply = await self.query(self.header+volumes[volume]+b"R\r")
+            self.volume = float(volume)
+        else:
+            reply = self.invalid_operand("volume of {} uL is not supported. Choose from {}".format(
+                volume,list(volumes.keys())))
+        return reply
+
+    async def initialize(self, orientation = ''):
+        """
+        initialization command: Y for left pumps and Z for right pumps. See Driver.initialize.
+        """
+        if orientation in commands.ORIENTATIONS:
+            reply = await self.query(command = self.header+commands.ORIENTATIONS[orientation]+b"R\r")
+        else:
+            reply = self.invalid_operand('unknown orientation "{}"'.format(orientation),
+                                         error = ErrorCode.INVALID_COMMAND)
+        self._orientation = orientation
+        return reply
+
+    async def init(self, pump_id, speed = 25, backlash = 100, orientation = None, volume = None):
+        """
+        orderly initialization of the syringe pump: discovery of the pump, setting up and homing. See Driver.init.
+        """
+        self.pump_id = pump_id
+        await self.discover()
+        if volume is not None:
+            await self.assign_volume(volume = volume)
+        if backlash is not None:
+            await self.set_backlash(backlash)
+        if speed is not None:
+            await self.set_speed(speed)
+        if orientation is not None:
+            await self.initialize(orientation = orientation)
+
+    async def abort(self):
+        """
+        terminates plunger moves: "/1TR\\r"
+        """
+        return await self.query(command = self.header+b'TR\r')
+
+    async def busy(self):
+        """
+        queries if pump is busy or not: "/1?29R\\r"
+        """
+        return await self.query(command = self.header+b'?29R\r')
+
+    async def status(self, valve = True, speed = True):
+        """
+        returns Status snapshot: position, busy flag and error code from one "?18" transaction, valve ("?20") and
+        speed ("?37") only if requested. See Driver.status.
+        """
+        status = Status()
+        reply = await self._get_position()
+        status.time = time()
+        status.busy = reply['busy']
+        status.error = reply['error']
+        status.error_code = reply['error_code']
+        status.position = Driver.to_float(reply['value'])
+        if valve:
+            value = (await self.get_valve())['value']
+            if value:
+                status.valve = value.decode('Latin-1').lower()
+        if speed:
+            status.speed = Driver.to_float((await self._get_speed())['value'])
+        return status
+
+    async def get_valve(self):
+        return await self.query(command = self.header+b'?20R\r')
+
+    async def set_valve(self, value):
+        """
+        sets valve position 'i', 'o' or 'b'
+        """
+        try:
+            command = commands.encode_valve(self.address, value)
+        except ValueError as exception:
+            return self.invalid_operand(str(exception))
+        return await self.query(command = command)
+
+    def get_backlash(self):
+        return self._backlash
+
+    async def set_backlash(self, value):
+        try:
+            command = commands.encode_backlash(self.address, value)
+        except ValueError as exception:
+            return self.invalid_operand(str(exception))
+        reply = await self.query(command = command)
+        self._backlash = value
+        return reply
+
+    async def reset(self):
+        """Performs a soft reset on pumps"""
+        return await self.query(self.header+b"!R\r")
+
+    async def home(self):
+        """
+        homes the syringe pump. Y orientation for pumps 1 and 3, Z for pumps 2 and 4. See Driver.home.
+        """
+        orientation = {1: 'Y', 2: 'Z', 3: 'Y', 4: 'Z'}.get(self.pump_id, self._orientation or 'Y')
+        backlash = None if isnan(self._backlash) else self._backlash
+        try:
+            command = commands.encode_home(self.address, orientation, backlash, 25.0, self.volume)
+        except ValueError as exception:
+            return self.invalid_operand(str(exception))
+        reply = await self.query(command)
+        self.cmd_position = 0.0
+        return reply
+
+    async def move_abs(self, position, speed):
+        """
+        Move plunger to absolute position with the given speed: "/1V25.0,1A100.0,1R\\r"
+        """
+        try:
+            command = commands.encode_move_abs(self.address, position, speed, self.volume)
+        except ValueError as exception:
+            return self.invalid_operand(str(exception))
+        return await self.query(command = command)
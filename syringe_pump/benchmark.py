@@ -0,0 +1,362 @@
+#!/usr/bin/env python3
+"""
+Benchmarks of the serial transactions, the scan loop and the IOC against the
+pty simulator in syringe_pump.mock_driver.
+
+- query: Driver.query round-trip latency per command type
+- throughput: transactions per second on one port shared by 1 and 4 pumps
+- run_once: Device.run_once cycle time
+- put_to_rbv: PV put of VAL -> serial write of the move -> first RBV update,
+  through device_io.Server (requires caproto)
+
+The results are one JSON document: latency distributions in seconds (n, mean,
+min, median, p95, p99, max), rates in transactions per second and the settings
+of the run. compare() lists the metrics that got worse than a baseline by more
+than a tolerance, so the results of two releases can be checked automatically.
+
+Examples
+--------
+$ python -m syringe_pump.benchmark --output benchmark.json
+$ python -m syringe_pump.benchmark --output new.json --baseline benchmark.json
+
+>>> from syringe_pump.benchmark import run_benchmarks, compare
+>>> results = run_benchmarks(N = 100, duration = 1.0)
+>>> results['query']['position']['median']
+0.0152
+>>> compare(baseline, results)
+['query.position.p95: 0.0161 -> 0.0213 (+32%)']
+"""
+
+import json
+import os
+import sys
+import platform
+from time import time, sleep
+from threading import Thread, Event
+from logging import debug,info,warning,error
+
+from numpy import asarray, percentile
+
+from syringe_pump.mock_driver import Simulator, Driver
+
+#command type -> raw command body; none of them moves the plunger, so the pump stays idle and the pacer never waits
+#for busy_gap
+QUERY_COMMANDS = {
+    'position': b'?18',
+    'valve': b'?20',
+    'busy': b'?29',
+    'speed': b'?37',
+    'status': b'Q',
+    'set_speed': b'V25.0,1R',
+    'speed_on_the_fly': b'V25.0,1F',
+    'move': b'A0.0,1R',
+}
+#minimum number of moves of the put -> RBV benchmark; p95 and p99 of fewer samples are just the slowest ones
+PUT_TO_RBV_MIN = 20
+
+
+def summarize(samples):
+    """
+    returns distribution of samples (seconds) as a dictionary with keys n, mean, min, median, p95, p99 and max
+    """
+    samples = asarray(samples, dtype = float)
+    if len(samples) == 0:
+        return {'n': 0}
+    p50, p95, p99 = percentile(samples, [50, 95, 99])
+    return {'n': len(samples),
+            'mean': float(samples.mean()),
+            'min': float(samples.min()),
+            'median': float(p50),
+            'p95': float(p95),
+            'p99': float(p99),
+            'max': float(samples.max())}
+
+def simulator(pumps = 1, latency = 0.005, baudrate = 9600):
+    """
+    opens Simulator with pumps 1..pumps at addresses b'1', b'2', ... with fast valves and homing
+    """
+    addresses = {pump_id: str(pump_id).encode() for pump_id in range(1, pumps + 1)}
+    sim = Simulator(pumps = addresses, latency = latency, baudrate = baudrate)
+    sim.open()
+    for model in sim.pumps.values():
+        model.valve_time = 0.01
+        model.init_stroke_time = 0.01
+    return sim
+
+def init_driver(driver, pump_id = 1):
+    driver.init(pump_id, speed = 25, backlash = 100, orientation = 'Y', volume = 250)
+    while driver.busy()['busy']:
+        sleep(0.01)
+    return driver
+
+def bench_query(sim, N = 200):
+    """
+    measures Driver.query round trip (pacing included) of every command type in QUERY_COMMANDS
+
+    Returns
+    -------
+    results: dictionary
+        command type -> summarize() of N round trips
+    """
+    driver = init_driver(Driver(sim))
+    results = {}
+    for name, body in QUERY_COMMANDS.items():
+        command = driver.header + body + b'\r'
+        samples = []
+        for i in range(N):
+            t = time()
+            driver.query(command)
+            samples.append(time() - t)
+        results[name] = summarize(samples)
+    driver.port.close()
+    return results
+
+def bench_throughput(sim, duration = 2.0):
+    """
+    measures transactions per second on the simulator port: every pump on the port is polled with ?18 from its own
+    thread as fast as the bus lock and the pacer allow
+
+    Returns
+    -------
+    result: dictionary
+        pumps, transactions, duration (s) and rate (transactions/s)
+    """
+    from syringe_pump.bus import Bus
+    bus = Bus()
+    bus.open(sim.port_name)
+    drivers = [init_driver(bus.driver(address), model.pump_id) for address, model in sim.pumps.items()]
+    stop = Event()
+    counts = [0]*len(drivers)
+
+    def poll(i):
+        while not stop.is_set():
+            drivers[i]._get_position()
+            counts[i] += 1
+    threads = [Thread(target = poll, args = (i,), daemon = True) for i in range(len(drivers))]
+    t = time()
+    for thread in threads:
+        thread.start()
+    sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time() - t
+    bus.close()
+    return {'pumps': len(drivers), 'transactions': sum(counts), 'duration': elapsed, 'rate': sum(counts)/elapsed}
+
+def init_device(sim):
+    from syringe_pump.device import Device
+    device = Device()
+    device.init(pump_id = 1, speed = 25, backlash = 100, orientation = 'Y', volume = 250, driver = Driver(sim))
+    device.wait(dt = 0.01)
+    return device
+
+def bench_run_once(sim, N = 200):
+    """
+    measures Device.run_once cycle time of an idle pump (status poll, telemetry record and PV publish)
+    """
+    device = init_device(sim)
+    samples = []
+    for i in range(N):
+        t = time()
+        device.run_once()
+        samples.append(time() - t)
+    device.driver.port.close()
+    return summarize(samples)
+
+def bench_put_to_rbv(sim, N = 20, prefix = 'BENCH:', timeout = 5.0):
+    """
+    measures end-to-end latency through device_io.Server: a client writes VAL, the worker sends the move to the
+    serial port, the scan loop reads the new position and the server publishes RBV. The moves alternate between 10
+    and 11 uL at 50 uL/s.
+
+    Returns
+    -------
+    results: dictionary
+        'put_to_write' (VAL put -> move command received by the simulator) and 'put_to_rbv' (VAL put -> first RBV
+        monitor with a new value), summarize() of N moves
+    """
+    import asyncio
+    os.environ.setdefault('EPICS_CAS_INTF_ADDR_LIST', '127.0.0.1')
+    os.environ.setdefault('EPICS_CA_ADDR_LIST', '127.0.0.1')
+    os.environ.setdefault('EPICS_CA_AUTO_ADDR_LIST', 'NO')
+    from caproto.asyncio.server import start_server
+    from caproto.threading.client import Context
+    from syringe_pump.device_io import build_pvdb
+
+    device = init_device(sim)
+    device.set_speed(50.0)
+    device.start()
+    writes = []
+    reply = sim.reply
+
+    def record_reply(frame):
+        if b'A' in frame[2:] and not frame[2:].startswith(b'?'):
+            writes.append(time())
+        return reply(frame)
+    sim.reply = record_reply
+
+    pvdb, servers = build_pvdb({1: device}, prefix = prefix)
+    loop = asyncio.new_event_loop()
+    task = loop.create_task(start_server(pvdb, interfaces = ['127.0.0.1']))
+    server_thread = Thread(target = loop.run_until_complete, args = (task,), daemon = True)
+    server_thread.start()
+
+    ctx = Context()
+    name = prefix + 'SYRINGE1.'
+    val, rbv, dmov = ctx.get_pvs(name + 'VAL', name + 'RBV', name + 'DMOV')
+    for pv in (val, rbv, dmov):
+        pv.wait_for_connection(timeout = timeout)
+    updates = []
+    changed = Event()
+
+    def on_rbv(subscription, response):
+        updates.append((time(), float(response.data[0])))
+        changed.set()
+    subscription = rbv.subscribe()
+    subscription.add_callback(on_rbv)
+    changed.wait(timeout)
+
+    put_to_write = []
+    put_to_rbv = []
+    for i in range(N):
+        target = 10.0 + i % 2
+        start = updates[-1][1]
+        del writes[:]
+        changed.clear()
+        t = time()
+        val.write(target, wait = True, timeout = timeout)
+        deadline = t + timeout
+        first = None
+        while time() < deadline:
+            changed.wait(0.01)
+            changed.clear()
+            new = [u for u in updates if u[0] >= t and abs(u[1] - start) > 0.0005]
+            if first is None and new:
+                first = new[0][0]
+            if first is not None and abs(updates[-1][1] - target) < 0.0005 and dmov.read().data[0]:
+                break
+        if writes:
+            put_to_write.append(writes[0] - t)
+        if first is not None:
+            put_to_rbv.append(first - t)
+
+    subscription.remove_callback(on_rbv)
+    ctx.disconnect()
+    device.running = False
+    device.wake()
+    for server in servers:
+        if server.worker is not None:
+            server.worker.stop()
+    loop.call_soon_threadsafe(task.cancel)
+    server_thread.join(timeout)
+    device.driver.port.close()
+    sim.reply = reply
+    return {'put_to_write': summarize(put_to_write), 'put_to_rbv': summarize(put_to_rbv)}
+
+def run_benchmarks(N = 200, duration = 2.0, latency = 0.005, baudrate = 9600, ioc = True):
+    """
+    runs all benchmarks and returns the results dictionary, see module docstring
+
+    Parameters
+    ----------
+    N: integer
+        number of samples per latency distribution (the IOC benchmark uses N//10 moves, at least PUT_TO_RBV_MIN, so
+        that its percentiles are meaningful)
+    duration: float
+        duration of each throughput run, seconds
+    latency: float
+        firmware response time of the simulator, seconds
+    baudrate: integer
+        simulated baud rate, 0 - no transmission time
+    ioc: boolean
+        run the put -> RBV benchmark through the IOC
+    """
+    from syringe_pump import __version__
+    results = {'meta': {'version': __version__,
+                        'python': platform.python_version(),
+                        'platform': platform.platform(),
+                        'time': time(),
+                        'N': N,
+                        'duration': duration,
+                        'latency': latency,
+                        'baudrate': baudrate}}
+    sim = simulator(pumps = 1, latency = latency, baudrate = baudrate)
+    try:
+        results['query'] = bench_query(sim, N = N)
+        results['run_once'] = bench_run_once(sim, N = N)
+    finally:
+        sim.close()
+    results['throughput'] = {}
+    for pumps in (1, 4):
+        sim = simulator(pumps = pumps, latency = latency, baudrate = baudrate)
+        try:
+            results['throughput'][str(pumps)] = bench_throughput(sim, duration)
+        finally:
+            sim.close()
+    if ioc:
+        sim = simulator(pumps = 1, latency = latency, baudrate = baudrate)
+        try:
+            results['put_to_rbv'] = bench_put_to_rbv(sim, N = max(N//10, PUT_TO_RBV_MIN))
+        except ImportError as exception:
+            warning('put_to_rbv benchmark skipped: {}'.format(exception))
+        finally:
+            sim.close()
+    return results
+
+def compare(baseline, results, tolerance = 0.2):
+    """
+    returns list of regressions: latencies (mean, median, p95) that grew and rates that dropped by more than
+    tolerance relative to the baseline
+
+    Examples
+    --------
+    >>> compare({'run_once': {'median': 0.010}}, {'run_once': {'median': 0.015}})
+    ['run_once.median: 0.01 -> 0.015 (+50%)']
+    """
+    regressions = []
+
+    def walk(old, new, path):
+        for key, value in old.items():
+            if key == 'meta' or key not in new:
+                continue
+            name = path + (key,)
+            if isinstance(value, dict):
+                walk(value, new[key], name)
+            elif key in ('mean', 'median', 'p95', 'rate') and value:
+                change = (new[key] - value)/value
+                worse = change < -tolerance if key == 'rate' else change > tolerance
+                if worse:
+                    regressions.append('{}: {:.4g} -> {:.4g} ({:+.0%})'.format('.'.join(name), value, new[key],
+                                                                              change))
+    walk(baseline, results, ())
+    return regressions
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+    parser = ArgumentParser(description = 'Syringe pump serial and IOC benchmarks against the pty simulator.')
+    parser.add_argument('--output', default = None, help = 'JSON file for the results, default is stdout')
+    parser.add_argument('--baseline', default = None,
+                        help = 'JSON results of an earlier run, exit status 1 if there are regressions')
+    parser.add_argument('--tolerance', type = float, default = 0.2)
+    parser.add_argument('-N', type = int, default = 200)
+    parser.add_argument('--duration', type = float, default = 2.0)
+    parser.add_argument('--latency', type = float, default = 0.005)
+    parser.add_argument('--baudrate', type = int, default = 9600)
+    parser.add_argument('--no-ioc', action = 'store_true')
+    args = parser.parse_args()
+    results = run_benchmarks(N = args.N, duration = args.duration, latency = args.latency,
+                             baudrate = args.baudrate, ioc = not args.no_ioc)
+    text = json.dumps(results, indent = 2, sort_keys = True)
+    if args.output is None:
+        print(text)
+    else:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            regressions = compare(json.load(f), results, args.tolerance)
+        for line in regressions:
+            print('regression: ' + line, file = sys.stderr)
+        sys.exit(1 if regressions else 0)
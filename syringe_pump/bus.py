@@ -0,0 +1,206 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+RS-485 multi-drop bus: several Centris pumps daisy-chained on one serial line.
+
+The Bus owns one Serial handle and one lock. Addressed Driver views are created
+with Bus.driver(address): they share the port and the bus-level lock, so all
+transactions on the line are serialized, while each view keeps its own pacer
+because the busy/idle timing is a property of the individual pump.
+
+The address switch positions 0 to E of the pump correspond to the ASCII address
+characters '1' to '?' (hex 31-3F), see Table 3-2 of the Centris manual. The
+address '@' (position F) is the self-test position.
+
+Examples
+--------
+>>> from syringe_pump.bus import Bus
+>>> bus = Bus()
+>>> bus.open('/dev/ttyUSB0')
+>>> bus.scan()
+{1: b'1', 3: b'2'}
+>>> pump1 = bus.get_driver(pump_id = 1)
+>>> pump3 = bus.driver(2)
+"""
+
+from logging import debug,info,warning,error
+from threading import RLock as Lock
+
+from syringe_pump.driver import Driver
+from syringe_pump.instrumentation import Instrumentation
+
+
+def address_char(address):
+    """
+    converts address switch position (0-15) or address character into the address byte used in the commands
+
+    Parameters
+    ----------
+    address: integer, string or bytes
+        switch position 0-15 or address character '1'...'@'
+
+    Returns
+    -------
+    address: bytes
+
+    Examples
+    --------
+    >>> address_char(0)
+    b'1'
+    >>> address_char(10)
+    b';'
+    """
+    if isinstance(address, int):
+        if not 0 <= address <= 15:
+            raise ValueError('address switch position {} is not in the range 0-15'.format(address))
+        return bytes([0x31 + address])
+    if isinstance(address, str):
+        address = address.encode('Latin-1')
+    if len(address) != 1 or not 0x31 <= address[0] <= 0x40:
+        raise ValueError('address {!r} is not a valid single device address'.format(address))
+    return address
+
+
+class Bus(object):
+
+    def __init__(self, port = None):
+        self.port = port
+        self.lock = Lock()
+        self.drivers = {}
+        self.pump_ids = {}
+        self.instrumentation = Instrumentation() #shared by all drivers on the bus
+
+    def open(self, port_name, baudrate = 9600, timeout = 2):
+        """
+        opens serial port shared by all pumps on the bus
+
+        Parameters
+        ----------
+        port_name: string
+            serial device name
+        baudrate: integer
+        timeout: float
+            read timeout in seconds
+
+        Returns
+        -------
+
+        Examples
+        --------
+        >>> bus.open('/dev/ttyUSB0')
+        """
+        from serial import Serial
+        self.port = Serial(port_name, baudrate = baudrate, timeout = timeout)
+        for driver in self.drivers.values():
+            driver.port = self.port
+
+    def close(self):
+        """
+        closes the shared serial port
+
+        Parameters
+        ----------
+
+        Returns
+        -------
+
+        Examples
+        --------
+        >>> bus.close()
+        """
+        if self.port is not None:
+            self.port.close()
+
+    def driver(self, address):
+        """
+        returns addressed Driver view. Views are cached, the same address always returns the same Driver.
+
+        Parameters
+        ----------
+        address: integer, string or bytes
+            switch position 0-15 or address character
+
+        Returns
+        -------
+        driver: Driver
+
+        Examples
+        --------
+        >>> bus.driver(0).header
+        b'/1'
+        """
+        address = address_char(address)
+        with self.lock:
+            if address not in self.drivers:
+                driver = Driver()
+                driver.address = address
+                driver.port = self.port
+                driver.lock = self.lock
+                driver.instrumentation = self.instrumentation
+                self.drivers[address] = driver
+            return self.drivers[address]
+
+    def scan(self, addresses = range(15), timeout = 0.2):
+        """
+        queries pump ids of all pumps on the bus. The pumps that do not reply are skipped.
+
+        Parameters
+        ----------
+        addresses: iterable
+            switch positions or address characters to probe
+        timeout: float
+            read timeout used while probing, the pump answers within a few ms
+
+        Returns
+        -------
+        pump_ids: dictionary
+            pump_id -> address
+
+        Examples
+        --------
+        >>> bus.scan()
+        {1: b'1', 3: b'2'}
+        """
+        pump_ids = {}
+        with self.lock:
+            port_timeout = self.port.timeout
+            self.port.timeout = timeout
+            try:
+                for address in addresses:
+                    driver = self.driver(address)
+                    pump_id = driver.get_pump_id()
+                    debug('bus scan: address %r, pump_id %r', driver.address, pump_id)
+                    if pump_id is not None:
+                        driver.pump_id = pump_id
+                        pump_ids[pump_id] = driver.address
+                    else:
+                        del self.drivers[driver.address]
+            finally:
+                self.port.timeout = port_timeout
+        self.pump_ids = pump_ids
+        return pump_ids
+
+    def get_driver(self, pump_id):
+        """
+        returns Driver view for the pump with given pump id. Scans the bus if pump id is not known yet.
+
+        Parameters
+        ----------
+        pump_id: integer
+
+        Returns
+        -------
+        driver: Driver
+            or None if there is no such pump on the bus
+
+        Examples
+        --------
+        >>> bus.get_driver(pump_id = 1)
+        """
+        if pump_id not in self.pump_ids:
+            self.scan()
+        if pump_id in self.pump_ids:
+            return self.driver(self.pump_ids[pump_id])
+        else:
+            warning('pump id {} is not found on the bus {}'.format(pump_id, self.port))
+            return None
@@ -0,0 +1,88 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Clocks for the driver, the device loops and the simulator.
+
+Everything that reads the time or waits goes through a clock object with three
+methods: time(), sleep(dt) and wait(condition, timeout). RealClock uses the
+system time. VirtualClock keeps its own time that only advances when somebody
+sleeps or waits on it, so sleeps return immediately. With the simulator in
+syringe_pump.mock_driver sharing the same VirtualClock, compound protocols such
+as prime or fill that take minutes of wall time run in milliseconds, while the
+plunger kinematics, the pacing and the telemetry see consistent times.
+
+Examples
+--------
+>>> from syringe_pump.clock import VirtualClock
+>>> from syringe_pump.mock_driver import Simulator, Driver
+>>> from syringe_pump.device import Device
+>>> clock = VirtualClock()
+>>> simulator = Simulator(clock = clock)
+>>> simulator.open()
+>>> device = Device(clock = clock)
+>>> device.init(pump_id = 1, speed = 25, backlash = 100, orientation = 'Y', volume = 250,
+...             driver = Driver(simulator))
+>>> device.prime(N = 5)
+"""
+
+from threading import Lock
+from time import time, sleep
+
+
+class RealClock(object):
+    """
+    system time and real sleeps
+    """
+
+    def time(self):
+        return time()
+
+    def sleep(self, dt):
+        if dt > 0:
+            sleep(dt)
+
+    def wait(self, condition, timeout = None):
+        """
+        waits on condition (which must be acquired) for notify or timeout seconds, returns False on timeout
+        """
+        return condition.wait(timeout = timeout)
+
+
+class VirtualClock(object):
+
+    def __init__(self, start = None):
+        """
+        Parameters
+        ----------
+        start: float
+            initial time in seconds, default is the current system time
+        """
+        self.now = time() if start is None else start
+        self.lock = Lock()
+
+    def time(self):
+        return self.now
+
+    def sleep(self, dt):
+        """
+        advances the time by dt seconds and returns immediately
+        """
+        if dt > 0:
+            with self.lock:
+                self.now += dt
+
+    def wait(self, condition, timeout = None):
+        """
+        advances the time by timeout seconds and returns after giving other threads the chance to acquire
+        condition. Returns False if the condition was not notified.
+
+        The time is shared by all threads and every sleeping or waiting thread advances it, so a thread may find
+        that more time has passed than it slept. Loops that poll the state (wait until not busy, scan every
+        scan_period) are not affected by this.
+        """
+        if timeout is not None:
+            self.sleep(timeout)
+        return condition.wait(timeout = 0)
+
+
+real_clock = RealClock()
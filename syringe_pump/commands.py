@@ -0,0 +1,320 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Command encoder for the Cavro Centris DT protocol.
+
+Commands are built from typed arguments with CommandBuilder, which validates
+every operand against the ranges in the Centris manual before anything is sent
+to the pump:
+
+- V<speed>,1 : top speed in uL/s, 1 to 200,000 increments/s
+- A<position>,1 : absolute position in uL, 0 - syringe volume
+- P<volume>,1 / D<volume>,1 : relative pickup / dispense in uL
+- K<n> : backlash increments, 0 - 4000
+- I / O / B : valve to input / output / bypass
+- g ... G<n> : repeat the enclosed commands n times (1 - 30,000, up to 20
+  nested loops)
+
+A command string of several steps is a program that runs on the pump without
+host round trips (encode_prime, encode_fill, encode_empty). The command buffer
+of the pump holds 255 characters.
+
+The frames used by the driver over and over again (moves, speed changes,
+queries) are produced by the encode_* functions, which keep an LRU cache of the
+encoded frames, so a repeated setpoint costs a dictionary lookup.
+
+Examples
+--------
+>>> from syringe_pump.commands import CommandBuilder, encode_move_abs
+>>> CommandBuilder(b'1').valve('i').speed(25).absolute(100).frame()
+b'/1IV25.0,1A100.0,1R\\r'
+>>> encode_move_abs(b'1', position = 100, speed = 25)
+b'/1V25.0,1A100.0,1R\\r'
+>>> encode_move_abs(b'1', position = 300, speed = 25)
+Traceback (most recent call last):
+ValueError: position 300 is out of range 0.0 - 250.0 uL
+"""
+
+from functools import lru_cache
+from math import isfinite
+
+#usable plunger travel of 30 mm in increments
+FULL_STROKE = 181490
+MIN_SPEED_INCREMENTS = 1.0
+MAX_SPEED_INCREMENTS = 200000.0
+MAX_BACKLASH = 4000
+VALVES = {b'I': b'I', b'O': b'O', b'B': b'B'}
+VOLUME_CODES = {50: b'U93', 100: b'U94', 250: b'U90', 500: b'U95'}
+ORIENTATIONS = {'Y': b'Y7,0,0', 'Z': b'Z7,0,0'}
+CACHE_SIZE = 1024
+MAX_REPEAT = 30000
+MAX_LOOP_DEPTH = 20
+BUFFER_SIZE = 255 #characters of the pump command buffer
+
+
+def format_number(value):
+    """
+    formats number with up to 3 decimal places as accepted by the pump, e.g. 25 -> b'25.0', 0.1234 -> b'0.123'
+
+    Parameters
+    ----------
+    value: float
+
+    Returns
+    -------
+    text: bytes
+
+    Examples
+    --------
+    >>> format_number(100.1254)
+    b'100.125'
+    """
+    text = '{:.3f}'.format(round(value, 3)).rstrip('0')
+    if text.endswith('.'):
+        text += '0'
+    if text == '-0.0':
+        text = '0.0'
+    return text.encode('Latin-1')
+
+
+def _number(name, value, low, high):
+    """
+    validates operand and returns it as float
+    """
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise ValueError('{} {!r} is not a number'.format(name, value))
+    if not isfinite(number) or not low <= round(number, 3) <= high:
+        raise ValueError('{} {} is out of range {} - {} uL'.format(name, value, low, high))
+    return number
+
+
+def speed_range(volume):
+    """
+    returns (lowest, highest) top speed in uL/s for the syringe volume
+    """
+    return (round(MIN_SPEED_INCREMENTS*volume/FULL_STROKE, 3) or 0.001,
+            round(MAX_SPEED_INCREMENTS*volume/FULL_STROKE, 3))
+
+
+class CommandBuilder(object):
+
+    def __init__(self, address = b'1', volume = 250.0):
+        """
+        Parameters
+        ----------
+        address: bytes
+            pump address character
+        volume: float
+            syringe volume in uL used to validate positions and speeds
+        """
+        self.address = address
+        self.volume = float(volume)
+        self.parts = []
+        self.depth = 0 #open loops
+
+    def speed(self, value):
+        """top speed in uL/s: V<value>,1"""
+        low, high = speed_range(self.volume)
+        value = _number('speed', value, low, high)
+        self.parts.append(b'V' + format_number(value) + b',1')
+        return self
+
+    def absolute(self, value):
+        """move to absolute position in uL: A<value>,1"""
+        value = _number('position', value, 0.0, self.volume)
+        self.parts.append(b'A' + format_number(value) + b',1')
+        return self
+
+    def pickup(self, value):
+        """relative pickup (aspirate) in uL: P<value>,1"""
+        value = _number('pickup volume', value, 0.0, self.volume)
+        self.parts.append(b'P' + format_number(value) + b',1')
+        return self
+
+    def dispense(self, value):
+        """relative dispense in uL: D<value>,1"""
+        value = _number('dispense volume', value, 0.0, self.volume)
+        self.parts.append(b'D' + format_number(value) + b',1')
+        return self
+
+    def backlash(self, value):
+        """backlash compensation in increments: K<value>"""
+        try:
+            number = int(value)
+        except (TypeError, ValueError):
+            raise ValueError('backlash {!r} is not an integer'.format(value))
+        if number != value or not 0 <= number <= MAX_BACKLASH:
+            raise ValueError('backlash {!r} is out of range 0 - {} increments'.format(value, MAX_BACKLASH))
+        self.parts.append(b'K' + str(number).encode('Latin-1'))
+        return self
+
+    def valve(self, value):
+        """valve position 'i', 'o' or 'b': I, O or B"""
+        if isinstance(value, str):
+            value = value.encode('Latin-1')
+        key = bytes(value).upper()
+        if key not in VALVES:
+            raise ValueError('valve position {!r} is not one of i, o, b'.format(value))
+        self.parts.append(VALVES[key])
+        return self
+
+    def initialize(self, orientation):
+        """plunger and valve initialization: Y7,0,0 (left pump) or Z7,0,0 (right pump)"""
+        if orientation not in ORIENTATIONS:
+            raise ValueError('unknown orientation {!r}, choose Y or Z'.format(orientation))
+        self.parts.append(ORIENTATIONS[orientation])
+        return self
+
+    def loop(self):
+        """start of a repeated sequence: g"""
+        if self.depth == MAX_LOOP_DEPTH:
+            raise ValueError('more than {} nested loops'.format(MAX_LOOP_DEPTH))
+        self.depth += 1
+        self.parts.append(b'g')
+        return self
+
+    def repeat(self, n):
+        """end of a repeated sequence, the commands since the matching loop() run n times: G<n>"""
+        if self.depth == 0:
+            raise ValueError('repeat without loop')
+        if int(n) != n or not 1 <= n <= MAX_REPEAT:
+            raise ValueError('repeat count {!r} is out of range 1 - {}'.format(n, MAX_REPEAT))
+        self.depth -= 1
+        self.parts.append(b'G' + str(int(n)).encode('Latin-1'))
+        return self
+
+    def raw(self, text):
+        """appends command text without validation"""
+        if isinstance(text, str):
+            text = text.encode('Latin-1')
+        self.parts.append(text)
+        return self
+
+    def frame(self, execute = b'R'):
+        """
+        returns complete command: '/' + address + commands + execute + CR. Use execute = b'F' for on-the-fly
+        commands and b'' to load a command without executing it. Raises ValueError if a loop is not closed or the
+        command does not fit into the command buffer of the pump.
+        """
+        if self.depth:
+            raise ValueError('{} loop(s) not closed with repeat()'.format(self.depth))
+        body = b''.join(self.parts) + execute
+        if len(body) > BUFFER_SIZE:
+            raise ValueError('command of {} characters does not fit into the {} character buffer'.format(
+                len(body), BUFFER_SIZE))
+        return b'/' + self.address + body + b'\r'
+
+
+@lru_cache(maxsize = CACHE_SIZE)
+def encode_query(address, n):
+    """report command ?<n>, e.g. ?18 position"""
+    return b'/' + address + b'?' + str(int(n)).encode('Latin-1') + b'\r'
+
+
+@lru_cache(maxsize = CACHE_SIZE)
+def encode_move_abs(address, position, speed, volume = 250.0):
+    """move to position with speed: V<speed>,1A<position>,1R"""
+    return CommandBuilder(address, volume).speed(speed).absolute(position).frame()
+
+
+@lru_cache(maxsize = CACHE_SIZE)
+def encode_load_move_abs(address, position, speed, volume = 250.0):
+    """
+    load move to position with speed without executing it: V<speed>,1A<position>,1 (started later by
+    encode_execute)
+    """
+    return CommandBuilder(address, volume).speed(speed).absolute(position).frame(execute = b'')
+
+
+@lru_cache(maxsize = CACHE_SIZE)
+def encode_execute(address):
+    """execute the loaded command string: R"""
+    return b'/' + address + b'R\r'
+
+
+@lru_cache(maxsize = CACHE_SIZE)
+def encode_set_position(address, position, volume = 250.0):
+    """move to position with current speed: A<position>,1R"""
+    return CommandBuilder(address, volume).absolute(position).frame()
+
+
+@lru_cache(maxsize = CACHE_SIZE)
+def encode_set_speed(address, speed, on_the_fly = False, volume = 250.0):
+    """set top speed: V<speed>,1R or V<speed>,1F on the fly"""
+    return CommandBuilder(address, volume).speed(speed).frame(execute = b'F' if on_the_fly else b'R')
+
+
+@lru_cache(maxsize = CACHE_SIZE)
+def encode_valve(address, valve):
+    """valve position: I, O or B"""
+    return CommandBuilder(address).valve(valve).frame()
+
+
+@lru_cache(maxsize = CACHE_SIZE)
+def encode_backlash(address, backlash):
+    """backlash increments: K<n>R"""
+    return CommandBuilder(address).backlash(backlash).frame()
+
+
+@lru_cache(maxsize = CACHE_SIZE)
+def encode_home(address, orientation, backlash = None, speed = 25.0, volume = 250.0):
+    """homing: initialization, valve to input, speed, backlash (if known) and move to 0"""
+    builder = CommandBuilder(address, volume).initialize(orientation).valve('i').speed(speed)
+    if backlash is not None:
+        builder.backlash(backlash)
+    return builder.absolute(0).frame()
+
+
+def _restore(builder, speed, valve = 'o'):
+    """
+    final speed (if given) and valve of the compound programs
+    """
+    if speed is not None:
+        builder.speed(speed)
+    return builder.valve(valve)
+
+
+@lru_cache(maxsize = CACHE_SIZE)
+def encode_prime(address, N, speed = 68.0, restore_speed = None, full = 250.0, volume = 250.0):
+    """
+    prime program: valve to input, empty and fill N times, valve to output:
+    V<speed>,1IgA0,1A<full>,1G<N>[V<restore_speed>,1]OR
+    """
+    builder = CommandBuilder(address, volume).speed(speed).valve('i')
+    if N > 0:
+        builder.loop().absolute(0).absolute(full).repeat(N)
+    return _restore(builder, restore_speed).frame()
+
+
+@lru_cache(maxsize = CACHE_SIZE)
+def encode_empty(address, speed = 100.0, restore_speed = None, volume = 250.0):
+    """empty program: valve to input, plunger to zero, valve to output: V<speed>,1IA0,1[V<restore_speed>,1]OR"""
+    builder = CommandBuilder(address, volume).speed(speed).valve('i').absolute(0)
+    return _restore(builder, restore_speed).frame()
+
+
+@lru_cache(maxsize = CACHE_SIZE)
+def encode_fill(address, position = 250.0, speed = 100.0, restore_speed = None, volume = 250.0):
+    """
+    fill program: valve to input, plunger to zero and to position, valve to output:
+    V<speed>,1IA0,1A<position>,1[V<restore_speed>,1]OR
+    """
+    builder = CommandBuilder(address, volume).speed(speed).valve('i').absolute(0).absolute(position)
+    return _restore(builder, restore_speed).frame()
+
+
+def cache_info():
+    """
+    returns lru cache statistics of all cached encoders
+
+    Examples
+    --------
+    >>> cache_info()['encode_move_abs']
+    CacheInfo(hits=120, misses=3, maxsize=1024, currsize=3)
+    """
+    return {function.__name__: function.cache_info() for function in
+            (encode_query, encode_move_abs, encode_load_move_abs, encode_execute, encode_set_position,
+             encode_set_speed, encode_valve, encode_backlash, encode_home, encode_prime, encode_empty,
+             encode_fill)}
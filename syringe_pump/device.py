@@ -16,7 +16,8 @@ from pdb import pm
 
 
 
-from numpy import nan, mean, std, nanstd, asfarray, asarray, hstack, array, concatenate, delete, round, vstack, hstack, zeros, transpose, split, unique, nonzero, take, savetxt, min, max
+from numpy import nan, mean, std, nanstd, asarray, hstack, array, concatenate, delete, round, vstack, hstack, \
+    zeros, transpose, split, unique, nonzero, take, savetxt, min, max, searchsorted
 
 from time import time, sleep
 import sys
@@ -30,17 +31,25 @@ from timeit import Timer, timeit
 
 class Device(object):
 
-    def __init__(self):
+    def __init__(self, clock = None):
+        """
+        Parameters
+        ----------
+        clock: object
+            time and sleep provider, default is the system clock, see syringe_pump.clock
+        """
         #Thread.__init__(self)
         self.running = False
         #self.daemon = False # OK for main thread to exit even if instance is still running
         self.description = ''
 
-        #circular buffers dictionary contains information about all circular buffers and their type (Server, Client or Queue)
+        #circular buffers dictionary contains information about all circular buffers and their type (Server, Client
+        #or Queue)
         self.circular_buffers = {}
 
         self.command_queue = []
         self.position = 0.0
+        self.busy = None
         self.velocity = 0.0
         self.speed = 0.0
         self.flow_speed_high_limit = 5.0
@@ -51,10 +60,35 @@ class Device(object):
         self.running = 0
         self.scan_period = 0.001
         self.default_scan_period = 1.0
+        self.min_scan_period = 0.001 #scan period while the pump is busy or right after a command
+        self.scan_backoff = 2.0 #growth factor of the scan period while the pump is idle
+        self.correction_period = 0.5 #position poll period while the motion model predicts the move
+        self.estimate_period = 0.05 #RBV update period from the motion model between polls
+        self.valve = ''
+        self.status_refresh_period = 10.0 #period of the full status read (valve and speed)
+        self.last_full_status = 0.0
 
         self.io_put_queue = None
         self.io_get_queue = None
 
+        from threading import Condition
+        from collections import deque
+        self.wakeup = Condition()
+        self.wake_time = None #time of the first wake() since the last scan
+        self.reaction_latency = deque(maxlen = 100)
+        self.scan_times = deque(maxlen = 100)
+
+        from syringe_pump.trajectory import Trajectory
+        self.trajectory = Trajectory()
+
+        from syringe_pump.clock import real_clock
+        self.clock = clock if clock is not None else real_clock
+        self.scheduler = None #runs compound actions, see syringe_pump.sequence
+        self.sequences = [] #running compound actions
+        self.archive_writer = None #streams the telemetry ring to disk, see syringe_pump.archive
+        self.analytics_window = 10.0 #window of the flow analytics published every scan, seconds
+        self.loaded = None #(position, speed) of the move loaded into the pump without R, see prepare_flow
+
 #  ############################################################################
 #  Basic IOC operations
 #  ############################################################################
@@ -62,7 +96,8 @@ class Device(object):
         """default factory setting or first time setup"""
         raise NotImplementedError
 
-    def init(self, pump_id = None, speed = None, backlash = None, orientation = None, volume = None):
+    def init(self, pump_id = None, speed = None, backlash = None, orientation = None, volume = None, bus = None,
+             driver = None):
         """
         initialize the device level code
 
@@ -83,6 +118,12 @@ class Device(object):
             the orientation of the syringe pump valve: Y or Z
         volume: float
             the volume of the installed syringe
+        bus: Bus
+            optional shared RS-485 bus. If given, the pump is addressed over the bus instead of discovering its own
+            serial port.
+        driver: Driver
+            optional driver object, e.g. syringe_pump.mock_driver.Driver connected to a simulator. Takes precedence
+            over bus.
 
         Returns
         -------
@@ -97,14 +138,23 @@ class Device(object):
         from circular_buffer_numpy.circular_buffer import CircularBuffer
         self.buffers = {}
         self.buffers['position'] = CircularBuffer(shape = (1*3600*2,2), dtype = 'float64')
+        from syringe_pump.telemetry import Telemetry
+        self.telemetry = Telemetry(length = 1*3600*2)
 
         from syringe_pump.driver import Driver
         self.pump_id = pump_id
-        self.driver = Driver()
+        if driver is not None:
+            self.driver = driver
+        elif bus is not None:
+            self.driver = bus.get_driver(pump_id)
+        else:
+            self.driver = Driver()
+        self.driver.clock = self.clock
         self.name = 'NIH_syringe_pump_'+ str(pump_id)
         self.prefix = 'NIH:SYRINGE' + str(pump_id)
         if pump_id is not None:
-            self.driver.init(pump_id, speed = speed, backlash = backlash, orientation = orientation, volume = volume)
+            self.driver.init(pump_id, speed = speed, backlash = backlash, orientation = orientation,
+                             volume = volume)
             self.speed = speed
             self.cmd_position = 0.0
             self.set_valve(b'o')
@@ -127,17 +177,36 @@ class Device(object):
         >>> device.abort()
         """
         debug('device.abort')
-        reply = self.driver.abort()
-        self.process_driver_reply(reply)
-        t1 = time()
+        self.cancel_sequences()
+        self.terminate()
+        t1 = self.clock.time()
         flag = True
         while self.get_busy():
-            sleep(0.1)
-            if time() - t1 > 10.0:
+            self.clock.sleep(0.1)
+            if self.clock.time() - t1 > 10.0:
                 flag = False
                 break
 
 
+    def terminate(self):
+        """
+        stops the plunger ([T] command) without waiting for the pump to become ready and without cancelling the
+        compound actions
+
+        Parameters
+        ----------
+
+        Returns
+        -------
+
+        Examples
+        --------
+        >>> device.terminate()
+        """
+        reply = self.driver.abort()
+        self.trajectory.stop(self.clock.time())
+        self.process_driver_reply(reply)
+
     def close(self):
         """
         orderly close of the serial port and shutdown
@@ -154,6 +223,7 @@ class Device(object):
         """
         self.stop()
         self.abort()
+        self.stop_archive()
         #self.cleanup()
         self.driver.close()
 
@@ -242,6 +312,8 @@ class Device(object):
         """
         self.running = False
         self.iowrite(".RUNNING",value = self.running)
+        with self.wakeup:
+            self.wakeup.notify_all()
 
 
     def run_once(self):
@@ -260,28 +332,156 @@ class Device(object):
 
         """
         debug('run_once')
-        self.position = self.get_position()
-        if not self.busy:
-            self.scan_period = self.default_scan_period
+        status = self.poll_status()
+        if self.busy:
+            self.scan_period = self.busy_scan_period()
+        else:
+            scan_period = self.scan_period*self.scan_backoff
+            if scan_period < self.min_scan_period:
+                scan_period = self.min_scan_period
+            if scan_period > self.default_scan_period:
+                scan_period = self.default_scan_period
+            self.scan_period = scan_period
         self.iowrite(pv_name = "DMOV",value = self.isdonemoving())
         self.iowrite(pv_name = "RBV",value = self.position)
+        if status.valve is not None:
+            self.iowrite(pv_name = "VALVE",value = self.valve)
+        if status.speed is not None:
+            self.iowrite(pv_name = "VELO",value = self.speed)
+        self.publish_analytics()
 
 
 
     def run(self):
-        """"""
+        """
+        scan loop: calls run_once() and waits for scan_period or until wake() is called, whichever comes first. The
+        scan period is min_scan_period while the pump is busy and grows by scan_backoff up to default_scan_period
+        while it is idle. While the motion model predicts a move, the pump is polled every correction_period and
+        RBV is updated from the model every estimate_period in between.
+        """
         self.running = True
         self.iowrite("RUNNING",value = self.running)
 
         while self.running:
-            t = time()
-            self.run_once()
-            while time() - t < self.scan_period:
-                sleep(0.1)
+            with self.wakeup:
+                wake_time = self.wake_time
+                self.wake_time = None
+            t = self.clock.time()
+            try:
+                self.run_once()
+            except Exception:
+                error(f'run_once failed: {traceback.format_exc()}')
+            self.scan_times.append(t)
+            if wake_time is not None:
+                self.reaction_latency.append(self.clock.time() - wake_time)
+            with self.wakeup:
+                while self.wake_time is None and self.running:
+                    timeout = t + self.scan_period - self.clock.time()
+                    if timeout <= 0:
+                        break
+                    if self.trajectory.moving(self.clock.time()):
+                        if timeout > self.estimate_period:
+                            timeout = self.estimate_period
+                        self.clock.wait(self.wakeup, timeout = timeout)
+                        self.publish_estimate()
+                    else:
+                        self.clock.wait(self.wakeup, timeout = timeout)
+                        break
 
         self.running = False
         self.iowrite("RUNNING",value = self.running)
 
+    def busy_scan_period(self):
+        """
+        returns scan period while the pump is busy: correction_period if the motion model predicts the move, but
+        not later than the predicted arrival, otherwise min_scan_period.
+        """
+        arrival = self.trajectory.arrival()
+        if arrival is None:
+            return self.min_scan_period
+        period = arrival - self.clock.time()
+        if period > self.correction_period:
+            period = self.correction_period
+        if period < self.min_scan_period:
+            period = self.min_scan_period
+        return period
+
+    def publish_estimate(self):
+        """
+        writes position estimated by the motion model into RBV
+        """
+        self.iowrite(pv_name = "RBV",value = round(self.trajectory.position(self.clock.time()),3))
+
+    def wake(self):
+        """
+        wakes up the scan loop immediately and resets the scan period to min_scan_period. Called after every move,
+        speed or valve command.
+
+    	Parameters
+    	----------
+
+    	Returns
+    	-------
+
+    	Examples
+    	--------
+    	>>> device.wake()
+        """
+        with self.wakeup:
+            self.scan_period = self.min_scan_period
+            if self.wake_time is None:
+                self.wake_time = self.clock.time()
+            self.wakeup.notify_all()
+
+    def scan_metrics(self):
+        """
+        returns scan loop metrics: polling rate over the last 100 scans and reaction latency (time from wake() to
+        the end of the next scan).
+
+    	Parameters
+    	----------
+
+    	Returns
+    	-------
+        metrics: dictionary
+
+    	Examples
+    	--------
+    	>>> device.scan_metrics()
+        {'scan_period': 1.0, 'poll_rate': 1.02, 'latency_mean': 0.012, 'latency_max': 0.105, 'latency_count': 12}
+        """
+        from numpy import mean
+        times = list(self.scan_times)
+        latency = list(self.reaction_latency)
+        if len(times) > 1 and times[-1] > times[0]:
+            poll_rate = (len(times) - 1)/(times[-1] - times[0])
+        else:
+            poll_rate = nan
+        return {'scan_period': self.scan_period,
+                'poll_rate': poll_rate,
+                'latency_mean': float(mean(latency)) if latency else nan,
+                'latency_max': float(max(latency)) if latency else nan,
+                'latency_count': len(latency)}
+
+    def command_stats(self):
+        """
+        returns serial transaction counters of the driver: count, timeouts, bad replies, errors, latency and lock
+        wait per opcode and per port, see syringe_pump.instrumentation.
+
+    	Parameters
+    	----------
+
+    	Returns
+    	-------
+        stats: dictionary
+
+    	Examples
+    	--------
+    	>>> device.command_stats()['opcodes']['?18']['count']
+        120
+        """
+        return self.driver.instrumentation.snapshot()
+
     def get_busy(self):
         reply = self.driver.busy()
         value = self.process_driver_reply(reply)
@@ -351,10 +551,10 @@ class Device(object):
 
         """
         if self.io_put_queue is not None:
-            debug(f"iowrite got request {pv_name},{value}")
+            debug('iowrite got request %s,%r', pv_name, value)
             self.io_put_queue.put({pv_name: value})
         else:
-            debug(f"no IO is linked to the device. Couldn't process {pv_name}")
+            debug("no IO is linked to the device. Couldn't process %s", pv_name)
 
     def ioread(self, pv_name = None, value = None):
         """
@@ -416,6 +616,19 @@ class Device(object):
                 warning(f'the input value {pv_name} for PV {value} is not float')
         if pv_name == 'CMD':
             print(f'{value},{type(value)}')
+            # command with space separated numeric arguments, e.g. 'flow 25 0.1' or 'prime 3'
+            commands = {'abort': self.abort,
+                        'fill': self.fill,
+                        'empty': self.empty,
+                        'prime': lambda N = 5: self.prime(N = int(N)),
+                        'home': self.home,
+                        'flow': self.flow}
+            words = str(value).split()
+            command = words[0].lower() if words else ''
+            if command in commands:
+                commands[command](*[float(word) for word in words[1:]])
+            else:
+                raise ValueError(f'unknown command {value!r}, choose from {list(commands)}')
 
 
 
@@ -448,18 +661,222 @@ class Device(object):
     	>>> device.get_position()
         0.0
         """
-        from numpy import nan, zeros
+        from numpy import nan
+        t = self.clock.time()
         reply = self.driver._get_position()
         value = self.process_driver_reply(reply)
         if value is None:
             value = nan
         self.position = round(float(value),3)
-        arr = zeros((1,2))
-        arr[0,0] = time()
-        arr[0,1] = self.position
-        self.buffers['position'].append(arr)
+        self.record(self.clock.time(), self.clock.time() - t)
         return self.position
 
+    def record(self, t, latency):
+        """
+        records current position into the position circular buffer and the full state into the telemetry ring. Both
+        are written in place, no arrays are allocated.
+
+    	Parameters
+    	----------
+        t: float
+            time of the sample
+        latency: float
+            duration of the status query
+        """
+        buffer = self.buffers['position']
+        p = buffer.pointer + 1
+        if p == buffer.buffer.shape[0]:
+            p = 0
+        buffer.buffer[p,0] = t
+        buffer.buffer[p,1] = self.position
+        buffer.pointer = p
+        buffer.g_pointer += 1
+        self.telemetry.append(t, self.position, self.busy, self.valve, self.speed, self.error_code, latency)
+
+    def samples(self, window = None, start = None, end = None):
+        """
+        returns telemetry samples of the last window seconds or between start and end. Samples older than the
+        telemetry ring are read from the archive if it is running.
+
+    	Parameters
+    	----------
+        window: float
+            seconds before the last sample, used if start is None
+        start: float
+        end: float
+
+    	Returns
+    	-------
+        samples: numpy structured array or dictionary
+            field -> column, views of the ring or of the archive files
+        """
+        if start is None:
+            if window is None:
+                return self.telemetry.last_N(self.telemetry.length)
+            return self.telemetry.last_seconds(window)
+        ring = self.telemetry.last_N(self.telemetry.length)
+        if self.archive_writer is not None and (len(ring) == 0 or start < ring['time'][0]):
+            return self.archive_writer.archive.read(start, end)
+        t = ring['time']
+        i = searchsorted(t, start, side = 'left')
+        j = len(t) if end is None else searchsorted(t, end, side = 'left')
+        return ring[i:j]
+
+    def flow_analytics(self, window = None, start = None, end = None):
+        """
+        returns flow analytics of the last window seconds (default analytics_window) or between start and end:
+        flow_rate, flow_rate_window (uL/s, positive while dispensing), dispensed and aspirated (uL),
+        speed_deviation (relative to the commanded speed), stalls and stalled, see syringe_pump.analytics
+
+    	Examples
+    	--------
+    	>>> device.flow_analytics(window = 60)
+        {'flow_rate': 0.1, 'flow_rate_window': 0.1, 'dispensed': 6.0, 'aspirated': 0.0, 'speed_deviation': 0.001,
+         'stalls': 0, 'stalled': False}
+        """
+        from syringe_pump.analytics import summarize
+        if window is None and start is None:
+            window = self.analytics_window
+        samples = self.samples(window = window, start = start, end = end)
+        return summarize(samples['time'], samples['position'], samples['busy'], samples['speed'],
+                         tolerance = self.dpos)
+
+    def delivered_volume(self, window = None, start = None, end = None):
+        """
+        returns (dispensed, aspirated) volume in uL over the last window seconds (all recorded samples if None) or
+        between start and end
+
+    	Examples
+    	--------
+    	>>> device.delivered_volume(start = time() - 86400)
+        (120.5, 125.0)
+        """
+        from syringe_pump.analytics import delivered_volume
+        return delivered_volume(self.samples(window = window, start = start, end = end)['position'])
+
+    def publish_analytics(self):
+        """
+        writes flow analytics of the last analytics_window seconds into the FLOW, FLOW_AVG, DISPENSED, SPEED_DEV
+        and STALL PVs
+        """
+        if self.io_put_queue is None:
+            return
+        analytics = self.flow_analytics()
+        self.iowrite(pv_name = "FLOW",value = analytics['flow_rate'])
+        self.iowrite(pv_name = "FLOW_AVG",value = analytics['flow_rate_window'])
+        self.iowrite(pv_name = "DISPENSED",value = analytics['dispensed'])
+        self.iowrite(pv_name = "SPEED_DEV",value = analytics['speed_deviation'])
+        self.iowrite(pv_name = "STALL",value = analytics['stalled'])
+
+    def start_archive(self, directory, segment_duration = 3600.0, retention = 7*86400.0, period = 1.0):
+        """
+        starts writing the telemetry ring to a persistent archive in a background thread, see syringe_pump.archive
+
+    	Parameters
+    	----------
+        directory: string
+            archive directory of this pump
+        segment_duration: float
+            time span of one archive segment, seconds
+        retention: float
+            age of the oldest kept samples, seconds; None - keep everything
+        period: float
+            seconds between two writes
+
+    	Returns
+    	-------
+        archive: Archive
+
+    	Examples
+    	--------
+    	>>> archive = device.start_archive('/data/syringe_pump/pump1', retention = 3*86400)
+        >>> archive.read(start = time() - 86400)['position']
+        """
+        from syringe_pump.archive import Archive, ArchiveWriter
+        self.stop_archive()
+        archive = Archive(directory, segment_duration = segment_duration, retention = retention)
+        self.archive_writer = ArchiveWriter(self.telemetry, archive, period = period)
+        return archive
+
+    def stop_archive(self):
+        """
+        writes the samples not yet archived and stops the archive writer
+        """
+        if self.archive_writer is not None:
+            self.archive_writer.stop()
+            self.archive_writer = None
+
+    def get_history(self, window = None, N = None, bins = None):
+        """
+        returns position history from the telemetry ring: the last window seconds or the last N samples, min/max
+        decimated to bins bins.
+
+    	Parameters
+    	----------
+        window: float
+            time window in seconds
+        N: integer
+            number of samples, used if window is None
+        bins: integer
+            number of decimation bins, no decimation if None or 0
+
+    	Returns
+    	-------
+        history: numpy array
+            shape (n, 2), columns time and position
+
+    	Examples
+    	--------
+    	>>> device.get_history(window = 3600, bins = 1000).shape
+        (2000, 2)
+        """
+        return self.telemetry.history(window = window, N = N, bins = bins)
+
+    def poll_status(self, full = None):
+        """
+        reads the pump state needed for the RBV, DMOV, VALVE and VELO PVs via Driver.status(). Position, busy flag
+        and error code come with one "?18" transaction. The valve and speed change only by commands sent from this
+        device and are recorded by set_valve and set_speed, so they are read from the pump only on a full read.
+
+    	Parameters
+    	----------
+        full: boolean
+            read valve and speed too. Default (None) is a full read every status_refresh_period seconds.
+
+    	Returns
+    	-------
+        status: Status
+            snapshot record, valve and speed are None if they were not read
+
+    	Examples
+    	--------
+    	>>> device.poll_status()
+        Status(time=1571234567.89, position=25.0, busy=False, error='No Error', error_code=b'`', valve=None,
+               speed=None)
+        """
+        from numpy import isnan
+        if full is None:
+            full = self.clock.time() - self.last_full_status >= self.status_refresh_period
+        t = self.clock.time()
+        status = self.driver.status(valve = full, speed = full)
+        if self.busy and status.busy is False and self.scheduler is not None:
+            #the pump is ready again, the next step of a compound action can start now
+            self.scheduler.wake()
+        self.busy = status.busy
+        self.error_code = status.error_code
+        self.error = status.error
+        self.last_reply_process = status.time
+        self.position = round(status.position,3)
+        self.trajectory.correct(status.time, status.position, status.busy)
+        if full:
+            self.last_full_status = status.time
+            if status.valve is not None:
+                self.valve = status.valve
+            if status.speed is not None and not isnan(status.speed):
+                self.speed = status.speed
+        self.record(status.time, status.time - t)
+        return status
+
     def set_position(self, value):
         self.set_cmd_position(value)
 
@@ -497,9 +914,12 @@ class Device(object):
     	--------
     	>>> device.set_cmd_position(value = 25.0)
         """
+        t = self.clock.time()
         reply = self.driver._set_position(value)
         self.cmd_position = value
-        self.scan_period = 0.001
+        if reply['busy'] is not None:
+            self.trajectory.start(t, self.position, value, self.speed)
+        self.wake()
 
     def get_speed(self):
         """
@@ -519,7 +939,7 @@ class Device(object):
         25.0
         """
         reply  = self.driver.get_speed()
-        self.speed = self.process_driver_reply(reply)
+        self.speed = self.driver.to_float(self.process_driver_reply(reply))
         return self.speed
 
     def set_speed_on_the_fly(self,value):
@@ -539,10 +959,13 @@ class Device(object):
     	>>> device.set_speed_on_the_fly(25.0)
         """
         reply = self.driver._set_speed_on_the_fly(value)
+        if reply['busy'] is not None:
+            self.trajectory.change_speed(self.clock.time(), value)
         debug(f'reply: {reply}')
         temp = self.process_driver_reply(reply)
         debug(f'set_speed_on_the_fly: {reply}, {temp}')
         self.speed = value
+        self.wake()
         debug(f'set_speed_on_the_fly: {self.speed}')
 
     def set_speed(self,value):
@@ -564,6 +987,7 @@ class Device(object):
         reply = self.driver.set_speed(value)
         temp = self.process_driver_reply(reply)
         self.speed = value
+        self.wake()
 
     def set_status(self, value = ''):
         value = str(value)
@@ -602,9 +1026,13 @@ class Device(object):
         self.driver.abort()
         if speed is None:
             speed = self.speed
-        self.scan_period = 0.001
         self.cmd_position = position
+        t = self.clock.time()
         response = self.driver.move_abs(position = position, speed = speed)
+        if response['busy'] is not None:
+            self.trajectory.start(t, self.position, position, speed)
+            self.speed = speed #the move sets the top speed of the pump
+        self.wake()
         return response
 
     def get_valve(self):
@@ -647,11 +1075,13 @@ class Device(object):
         """
         self.driver.set_valve(value)
         self.valve = value
+        self.wake()
 
 
     def process_driver_reply(self,reply):
         """
-        waits for the syringe to finish the previous task. The while loop checks every dt for the status of the syringe pump.
+        waits for the syringe to finish the previous task. The while loop checks every dt for the status of the
+        syringe pump.
 
         Parameters
         ----------
@@ -666,13 +1096,12 @@ class Device(object):
         >>> reply = {'value': '', 'error_code': '`', 'busy': False, 'error': 'No Error'}
         >>> device.process_driver_reply(reply)
         """
-        from time import time
         debug('process_driver_reply')
         if reply is not None:
             self.busy = reply['busy']
             self.error_code = reply['error_code']
             self.error = reply['error']
-            self.last_reply_process = time()
+            self.last_reply_process = self.clock.time()
             value = reply['value']
             if False:
                 self.iowrite("MOVN",value = self.moving)
@@ -692,7 +1121,8 @@ class Device(object):
         returns integer if alarm conditions are met
         """
         if self.position <= self.low_level_limit_alarm:
-            string = 'current position {} below low level limit {}'.format(self.position, self.low_level_limit_alarm)
+            string = 'current position {} below low level limit {}'.format(self.position,
+                                                                            self.low_level_limit_alarm)
         else:
             string = ''
         return string
@@ -702,7 +1132,8 @@ class Device(object):
         returns integer if alarm conditions are met
         """
         if self.position <= self.low_level_limit_warning:
-            flag = 'current position {} below low level limit {}'.format(self.position, self.low_level_limit_warning)
+            flag = 'current position {} below low level limit {}'.format(self.position,
+                                                                          self.low_level_limit_warning)
         else:
             flag = ''
         return flag
@@ -711,7 +1142,8 @@ class Device(object):
 
     def wait(self, dt = 0.34):
         """
-        waits for the syringe to finish the previous task. The while loop checks every dt for the status of the syringe pump.
+        waits for the syringe to finish the previous task. The while loop checks every dt for the status of the
+        syringe pump.
 
         Parameters
         ----------
@@ -725,155 +1157,294 @@ class Device(object):
         --------
         >>> device.wait(dt = 0.34)
         """
-        busy = self.get_busy()
-        while self.busy:
-            sleep(dt)
-        busy = self.get_busy()
+        while self.get_busy():
+            self.clock.sleep(dt)
 
-    def prime(self, N = 5):
+    def prime(self, N = 5, wait = True):
         """
-        performs safe compound "prime" command which empties and fills the  syringe N times The final state of the valve is 'out'. The final state of the syringe is full.
+        performs safe compound "prime" command which empties and fills the  syringe N times The final state of the
+        valve is 'out'. The final state of the syringe is full.
 
         Parameters
         ----------
         N: ingteger
             number of times to empty and fill. Default = 5 which is good enough.
+        wait: boolean
+            wait for the end of the sequence, otherwise return the running Sequence
 
         Returns
         -------
+        sequence: Sequence
 
         Examples
         --------
-        >>> device.empty()
+        >>> device.prime(N = 5)
         """
-        start_speed = self.speed
-        self.set_speed(68.0)
-        self.set_valve('i')
-        self.wait()
-        for i in range(N):
-            self.set_cmd_position(0.0)
-            self.wait()
-            self.set_cmd_position(250.0)
-            self.wait()
-        self.set_speed(start_speed)
-        self.set_valve('o')
-        busy = self.get_busy()
+        return self.run_sequence('prime', self.prime_steps(N), total = 1, wait = wait)
 
+    def prime_steps(self, N = 5):
+        #one program string on the pump, see Driver.prime
+        restore_speed = self.restore_speed()
+        reply = self.driver.prime(N, speed = 68.0, restore_speed = restore_speed)
+        self.start_program(reply)
+        yield ('prime program', (self.position + (2*N - 1)*250.0)/68.0 if N > 0 else 0.0)
+        self.finish_program(restore_speed, 68.0, 250.0 if N > 0 else None)
 
-    def empty(self):
+    def empty(self, wait = True):
         """
-        performs safe compound "empty" command which empties the syringe with fluid back into the reservour. The final state of the valve is 'out'.
+        performs safe compound "empty" command which empties the syringe with fluid back into the reservour. The
+        final state of the valve is 'out'.
 
         Parameters
         ----------
+        wait: boolean
+            wait for the end of the sequence, otherwise return the running Sequence
 
         Returns
         -------
+        sequence: Sequence
 
         Examples
         --------
         >>> device.empty()
         """
+        return self.run_sequence('empty', self.empty_steps(), total = 1, wait = wait)
 
-        start_speed = self.speed
-        self.set_speed(100.0)
-        self.set_valve('i')
-        self.wait()
-        self.set_cmd_position(0.0)
-        self.wait()
-        self.set_speed(start_speed)
-        self.set_valve('o')
+    def empty_steps(self):
+        restore_speed = self.restore_speed()
+        self.start_program(self.driver.empty(speed = 100.0, restore_speed = restore_speed))
+        yield ('empty program', self.position/100.0)
+        self.finish_program(restore_speed, 100.0, 0.0)
 
-    def fill(self, volume = None):
+    def fill(self, volume = None, wait = True):
         """
-        performs safe compound "fill" command which refills the syringe with fluid from the reservour. The final state of the valve is 'out'.
+        performs safe compound "fill" command which refills the syringe with fluid from the reservour. The final
+        state of the valve is 'out'.
 
         Parameters
         ----------
         volume :: float
             volume in uL to fill up to.
+        wait: boolean
+            wait for the end of the sequence, otherwise return the running Sequence
 
         Returns
         -------
+        sequence: Sequence
 
         Examples
         --------
         >>> device.fill(volume = 100.0)
         """
-        start_speed = self.speed
-        self.set_speed(100.0)
-        self.set_valve('i')
-        self.wait()
-        self.set_cmd_position(0.0)
-        self.wait()
+        return self.run_sequence('fill', self.fill_steps(volume), total = 1, wait = wait)
+
+    def fill_steps(self, volume = None):
         if volume is None:
             volume = 250.0
-        self.set_cmd_position(volume)
-        self.wait()
-        self.set_speed(start_speed)
-        self.set_valve('o')
+        restore_speed = self.restore_speed()
+        self.start_program(self.driver.fill(position = volume, speed = 100.0, restore_speed = restore_speed))
+        yield ('fill program', (self.position + volume)/100.0)
+        self.finish_program(restore_speed, 100.0, volume)
 
-    def flow(self,position = 0, speed = 0.1):
+    def restore_speed(self):
         """
-        performs safe compound "flow" command which initits flow towards posotion with the given speed. Makes sure to set the valve orientation to 'o' output.
+        returns current speed if it can be sent to the pump at the end of a program, otherwise None
+        """
+        from syringe_pump.commands import speed_range
+        low, high = speed_range(self.driver.volume)
+        if low <= self.speed <= high:
+            return self.speed
+        return None
+
+    def start_program(self, reply):
+        """
+        processes reply to a program string (see Driver.prime) and raises RuntimeError if the pump did not accept
+        the program
+        """
+        self.process_driver_reply(reply)
+        if reply['error'] != 'No Error':
+            raise RuntimeError('the pump did not accept the program: {}'.format(reply['error']))
+        #the program is not a single move, the motion model has nothing to predict
+        self.trajectory.stop(self.clock.time())
+        self.wake()
+
+    def finish_program(self, restore_speed, program_speed, position):
+        """
+        records the final speed, valve and command position of a finished program
+        """
+        self.speed = restore_speed if restore_speed is not None else program_speed
+        self.valve = 'o'
+        if position is not None:
+            self.cmd_position = position
+
+    def flow(self,position = 0, speed = 0.1, wait = True):
+        """
+        performs safe compound "flow" command which initits flow towards posotion with the given speed. Makes sure
+        to set the valve orientation to 'o' output. The sequence ends when the flow has started.
 
         Parameters
         ----------
+        wait: boolean
+            wait for the start of the flow, otherwise return the running Sequence
 
         Returns
         -------
+        sequence: Sequence
 
         Examples
         --------
         >>> device.flow(position = 25, speed = 0.1)
         """
-        self.abort()
-        if self.valve is not 'o':
+        return self.run_sequence('flow', self.flow_steps(position, speed), total = 2, wait = wait,
+                                 wait_ready = False)
+
+    def flow_steps(self, position = 0, speed = 0.1):
+        self.terminate()
+        yield 'stop'
+        if self.valve != 'o':
             self.set_valve('o')
+            yield 'valve out'
         if speed <= self.flow_speed_high_limit:
             reply = self.move_abs(position = position, speed = speed)
             self.process_driver_reply(reply)
         else:
-            warning('the flow command received speed {} large than flow_speed_high_limit {}'.format(speed,self.flow_speed_high_limit))
+            warning('the flow command received speed {} large than flow_speed_high_limit {}'.format(
+                speed,self.flow_speed_high_limit))
+
+    def prepare_flow(self, position = 0, speed = 0.1, wait = True):
+        """
+        performs the safe part of the compound "flow" command without starting the flow: stops the plunger, sets
+        the valve to 'o' output and loads the move towards position with the given speed into the pump. The flow is
+        started by the R command, see syringe_pump.group.
+
+        Parameters
+        ----------
+        wait: boolean
+            wait until the move is loaded, otherwise return the running Sequence
+
+        Returns
+        -------
+        sequence: Sequence
+
+        Examples
+        --------
+        >>> device.prepare_flow(position = 0, speed = 0.1)
+        """
+        return self.run_sequence('prepare_flow', self.prepare_flow_steps(position, speed), total = 2, wait = wait,
+                                 wait_ready = False)
+
+    def prepare_flow_steps(self, position = 0, speed = 0.1):
+        self.loaded = None
+        self.terminate()
+        yield 'stop'
+        if self.valve != 'o':
+            self.set_valve('o')
+            yield 'valve out'
+        if speed > self.flow_speed_high_limit:
+            raise ValueError('the flow speed {} is larger than flow_speed_high_limit {}'.format(
+                speed,self.flow_speed_high_limit))
+        reply = self.driver.load_move_abs(position = position, speed = speed)
+        self.process_driver_reply(reply)
+        if reply['error'] != 'No Error':
+            raise RuntimeError('the pump did not accept the move: {}'.format(reply['error']))
+        self.loaded = (position, speed)
+
+    def started(self, t, reply):
+        """
+        processes reply to the R command that started the loaded move at time t: starts the motion model and wakes
+        up the scan loop
+        """
+        self.process_driver_reply(reply)
+        if self.loaded is not None and reply['busy'] is not None and reply['error'] == 'No Error':
+            position, speed = self.loaded
+            self.cmd_position = position
+            self.speed = speed
+            self.trajectory.start(t, self.position, position, speed)
+        self.loaded = None
+        self.wake()
 
-    def create_low_pressure(self,N = 1):
+    def create_low_pressure(self,N = 1, wait = True):
         """
         performs safe compound "create_low_pressure" command which creates low pressure in syringe pump #2.
 
         Parameters
         ----------
+        wait: boolean
+            wait for the end of the sequence, otherwise return the running Sequence
 
         Returns
         -------
+        sequence: Sequence
 
         Examples
         --------
         >>> device.create_low_pressure(N = 1)
         """
-        from time import sleep
-        self.abort()
+        return self.run_sequence('create_low_pressure', self.create_low_pressure_steps(N), total = 4*N + 1,
+                                 wait = wait, wait_ready = False)
+
+    def create_low_pressure_steps(self, N = 1):
+        self.terminate()
+        yield 'stop'
         for i in range(N):
             self.set_valve('i')
-            sleep(0.3)
-            while self.busy:
-                sleep(0.1)
-
+            yield 'valve in {}/{}'.format(i + 1, N)
             self.move_abs(250,65)
-            sleep(1)
-            while self.busy:
-                sleep(0.1)
-
+            yield 'fill {}/{}'.format(i + 1, N)
             self.set_valve('o')
-            sleep(0.3)
-            while self.busy:
-                sleep(0.1)
-
+            yield 'valve out {}/{}'.format(i + 1, N)
             self.move_abs(0,65)
-            sleep(1)
-            while self.busy:
-                sleep(0.1)
+            yield 'empty {}/{}'.format(i + 1, N)
+
+    def run_sequence(self, name, steps, total = None, wait = True, wait_ready = True):
+        """
+        starts compound action steps (generator, see syringe_pump.sequence) on the scheduler. The first step runs
+        when the pump is ready (if wait_ready) or right away. The progress is reported with the ACK PV. If wait is
+        True, waits for the end of the sequence and raises the exception of the failed step.
 
+    	Parameters
+    	----------
+        name: string
+        steps: generator
+        total: integer
+            expected number of steps
+        wait: boolean
+        wait_ready: boolean
 
+    	Returns
+    	-------
+        sequence: Sequence
+
+    	Examples
+    	--------
+    	>>> device.run_sequence('fill', device.fill_steps(100.0), total = 4)
+        """
+        from syringe_pump.sequence import Sequence, Scheduler, shared_scheduler
+        from syringe_pump.clock import real_clock
+        if self.scheduler is None:
+            self.scheduler = shared_scheduler() if self.clock is real_clock else Scheduler(clock = self.clock)
+        sequence = Sequence(self, steps, name = name, total = total, on_progress = self.report_progress,
+                            wait_ready = wait_ready)
+        self.sequences.append(sequence)
+        self.scheduler.start(sequence)
+        if wait:
+            sequence.wait()
+            if sequence.state == 'error':
+                raise sequence.error
+        return sequence
+
+    def report_progress(self, sequence):
+        if sequence.finished.is_set() and sequence in self.sequences:
+            self.sequences.remove(sequence)
+        self.iowrite(pv_name = 'ACK',
+                     value = '{name}: {label} {state} ({progress:.0%})'.format(**sequence.as_dict()))
+
+    def cancel_sequences(self):
+        """
+        cancels the running compound actions of the device, the motion is not stopped
+        """
+        for sequence in list(self.sequences):
+            sequence.cancel()
 
 
     def parse_cmd_string(self,string):
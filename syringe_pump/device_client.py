@@ -1,19 +1,264 @@
 #!/usr/bin/env python3
 #import os
 #os.environ["EPICS_CA_ADDR_LIST"] = '128.231.5.255
+"""
+Channel Access client for the syringe pump IOC.
+
+All Clients share one caproto Context (and therefore one circuit per IOC), the
+PVs of a client are connected with one get_pvs() call. Every reading is kept in
+a local cache with the IOC timestamp and the time it was received. Subscribed
+PVs are updated by the monitors, so their reads are served from memory; other
+PVs are read again when the cached value is older than max_age. read_many()
+reads a set of PVs of many pumps in one batch.
+
+Examples
+--------
+>>> from syringe_pump.device_client import Client, read_many
+>>> clients = [Client('NIH:SYRINGE1.'), Client('NIH:SYRINGE2.')]
+>>> read_many(clients, names = ('RBV', 'VALVE'))
+{'NIH:SYRINGE1.': {'RBV': 25.0, 'VALVE': 'o'}, 'NIH:SYRINGE2.': {'RBV': 100.0, 'VALVE': 'i'}}
+>>> clients[0].subscribe()
+>>> clients[0].get('RBV')
+25.0
+"""
+from threading import Lock, Event
+from time import time
+
+PV_NAMES = ('RBV', 'VAL', 'VELO', 'VALVE', 'DMOV', 'HISTORY', 'HIST_WINDOW', 'HIST_BINS', 'STATS',
+            'FLOW', 'FLOW_AVG', 'FLOW_WINDOW', 'DISPENSED', 'SPEED_DEV', 'STALL')
+DEFAULT_NAMES = ('RBV', 'VAL', 'VELO', 'VALVE')
+
+_context = None
+
+def shared_context():
+    """
+    returns caproto threading Context shared by all clients
+    """
+    global _context
+    if _context is None:
+        from caproto.threading.client import Context
+        _context = Context()
+    return _context
+
+def response_value(response):
+    """
+    converts Channel Access response into a python value: scalar for one element PVs, string for string PVs, array
+    otherwise
+    """
+    from caproto import ChannelType
+    data = response.data
+    if response.data_type in (ChannelType.CHAR, ChannelType.TIME_CHAR):
+        #long strings are served as char arrays
+        return bytes(data).rstrip(b'\x00').decode('Latin-1')
+    if len(data) == 1:
+        value = data[0]
+        if isinstance(value, bytes):
+            value = value.decode('Latin-1')
+        elif hasattr(value, 'item'):
+            value = value.item()
+        return value
+    return data
+
+def read_many(clients, names = DEFAULT_NAMES, timeout = 2.0):
+    """
+    reads PVs names of all clients in one batch: all read requests are sent together and the responses are
+    collected as they arrive. The client caches are updated.
+
+    Parameters
+    ----------
+    clients: list
+        Client objects
+    names: list
+        PV names without prefix
+    timeout: float
+        seconds to wait for the connections (one deadline shared by all PVs) and then for the responses, so the
+        worst case is 2*timeout whatever the number of PVs
+
+    Returns
+    -------
+    values: dictionary
+        prefix -> {name: value}, None for disconnected PVs and missing responses
+    """
+    from caproto.threading.client import Batch
+    deadline = time() + timeout
+    results = {client.prefix: {name: None for name in names} for client in clients}
+    requests = []
+    #the channels connect concurrently, waiting for one after the other against one deadline bounds the total wait
+    #by timeout
+    for client in clients:
+        for name in names:
+            pv = client.pvs[name]
+            if not pv.connected:
+                try:
+                    pv.wait_for_connection(timeout = max(deadline - time(), 0.001))
+                except Exception:
+                    continue
+            requests.append((client, name))
+    if len(requests) == 0:
+        return results
+    lock = Lock()
+    done = Event()
+    remaining = [len(requests)]
+
+    def callback(client, name, response):
+        value = client.store(name, response)
+        with lock:
+            results[client.prefix][name] = value
+            remaining[0] -= 1
+            if remaining[0] == 0:
+                done.set()
+
+    from functools import partial
+    with Batch(timeout = timeout) as batch:
+        for client, name in requests:
+            batch.read(client.pvs[name], partial(callback, client, name), data_type = 'time')
+    done.wait(timeout)
+    with lock:
+        return {prefix: dict(values) for prefix, values in results.items()}
+
+
 class Client(object):
     RBV = None
     VAL = None
     VELO = None
     VALVE = None
-    def __init__(self,prefix):
-        from caproto.threading.client import Context
+    DMOV = None
+    HISTORY = None
+    HIST_WINDOW = None
+    HIST_BINS = None
+    STATS = None
+    def __init__(self, prefix, ctx = None):
+        """
+        Parameters
+        ----------
+        prefix: string
+            PV prefix of the pump, e.g. 'NIH:SYRINGE1.'
+        ctx: Context
+            caproto threading Context, default is the context shared by all clients
+        """
         self.prefix = prefix
-        self.ctx = Context()
-        self.RBV, = self.ctx.get_pvs(self.prefix+'RBV')
-        self.VAL, = self.ctx.get_pvs(self.prefix+'VAL')
-        self.VELO, = self.ctx.get_pvs(self.prefix+'VELO')
-        self.VALVE, = self.ctx.get_pvs(self.prefix+'VALVE')
+        self.ctx = ctx if ctx is not None else shared_context()
+        self.pvs = dict(zip(PV_NAMES, self.ctx.get_pvs(*[self.prefix+name for name in PV_NAMES])))
+        for name, pv in self.pvs.items():
+            setattr(self, name, pv)
+        self.lock = Lock()
+        self.cache = {} #name -> (value, IOC timestamp, time received)
+        self.subscriptions = {}
+
+    def store(self, name, response):
+        """
+        stores response in the cache and returns its value
+        """
+        value = response_value(response)
+        timestamp = getattr(response.metadata, 'timestamp', None)
+        with self.lock:
+            self.cache[name] = (value, timestamp, time())
+        return value
+
+    def subscribe(self, names = DEFAULT_NAMES):
+        """
+        subscribes to PVs names, the cache is updated by the monitors
+        """
+        for name in names:
+            if name not in self.subscriptions:
+                subscription = self.pvs[name].subscribe(data_type = 'time')
+                callback = lambda sub, response, name = name: self.store(name, response)
+                subscription.add_callback(callback)
+                self.subscriptions[name] = (subscription, callback)
+
+    def unsubscribe(self):
+        """
+        removes all subscriptions
+        """
+        for subscription, callback in self.subscriptions.values():
+            subscription.remove_callback(callback)
+        self.subscriptions = {}
+
+    def get(self, name, max_age = 1.0):
+        """
+        returns value of PV name from the cache if the PV is subscribed or the cached value is not older than
+        max_age seconds, otherwise reads the PV. Returns None if the PV is disconnected (the cached value of a
+        disconnected PV is dropped).
+
+        Parameters
+        ----------
+        name: string
+            PV name without prefix, e.g. 'RBV'
+        max_age: float
+            maximum age of a cached value of a PV without subscription
+
+        Returns
+        -------
+        value: object
+        """
+        if not self.pvs[name].connected:
+            with self.lock:
+                self.cache.pop(name, None)
+            return None
+        with self.lock:
+            entry = self.cache.get(name)
+        if entry is not None and (name in self.subscriptions or time() - entry[2] <= max_age):
+            return entry[0]
+        return self.store(name, self.pvs[name].read(data_type = 'time'))
+
+    def read(self, names = DEFAULT_NAMES, timeout = 2.0):
+        """
+        reads PVs names in one batch and returns dictionary name -> value
+        """
+        return read_many([self], names, timeout)[self.prefix]
+
+    def age(self, name):
+        """
+        returns seconds since the cached value of PV name was received, None if there is no cached value
+        """
+        with self.lock:
+            entry = self.cache.get(name)
+        return None if entry is None else time() - entry[2]
+
+    def get_history(self, window = None, bins = None):
+        """
+        returns position history served by the IOC as an array of shape (n, 2) with columns time and position. The
+        window (seconds) and the number of min/max decimation bins are set on the server if given.
+
+        Examples
+        --------
+        >>> client.get_history(window = 3600, bins = 1000).shape
+        (2000, 2)
+        """
+        if window is not None:
+            self.HIST_WINDOW.write(window, wait = True)
+        if bins is not None:
+            self.HIST_BINS.write(bins, wait = True)
+        data = self.HISTORY.read().data
+        return data[:len(data)//2*2].reshape(-1, 2)
+
+    def get_stats(self):
+        """
+        returns serial transaction counters of the pump served by the IOC, see Device.command_stats
+
+        Examples
+        --------
+        >>> client.get_stats()['ports']
+        {'/dev/ttyUSB0': {'count': 5120, 'timeouts': 2, ...}}
+        """
+        import json
+        return json.loads(response_value(self.STATS.read()) or '{}')
+
+    def get_flow(self):
+        """
+        returns flow analytics of the pump served by the IOC over the last FLOW_WINDOW seconds, see
+        Device.flow_analytics
+
+        Examples
+        --------
+        >>> client.get_flow()
+        {'flow_rate': 0.1, 'flow_rate_window': 0.1, 'dispensed': 1.0, 'speed_deviation': 0.002, 'stalled': False}
+        """
+        return {'flow_rate': response_value(self.FLOW.read()),
+                'flow_rate_window': response_value(self.FLOW_AVG.read()),
+                'dispensed': response_value(self.DISPENSED.read()),
+                'speed_deviation': response_value(self.SPEED_DEV.read()),
+                'stalled': bool(response_value(self.STALL.read()))}
 if __name__ == '__main__':
     from tempfile import gettempdir
     client = Client('NIH:SYRINGE1.')
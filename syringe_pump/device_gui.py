@@ -49,7 +49,8 @@ class PanelTemplate(wx.Frame):
 
             self.sizer[b'RBV'] = wx.BoxSizer(wx.HORIZONTAL)
             self.label[b'RBV'] = wx.StaticText(self.panel, label= 'Volume', style = wx.ALIGN_CENTER)
-            self.field[b'RBV'] = epics.wx.PVText(self.panel, pv= prefix+'RBV',minor_alarm = wx.Colour(5, 6, 7),auto_units = True)
+            self.field[b'RBV'] = epics.wx.PVText(self.panel, pv= prefix+'RBV',minor_alarm = wx.Colour(5, 6, 7),
+                                                 auto_units = True)
             self.sizer[b'RBV'].Add(self.label[b'RBV'] , 0)
             self.sizer[b'RBV'].Add(self.field[b'RBV'] , 0)
 
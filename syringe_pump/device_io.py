@@ -15,6 +15,7 @@ from numpy import zeros, random, nan
 
 class Server(PVGroup):
     RBV = pvproperty(value=nan, units = 'uL', read_only = True, precision = 3)
+    DMOV = pvproperty(value=1, read_only = True)
     VAL = pvproperty(value=nan,
                     units = 'uL',
                     precision = 3,
@@ -32,31 +33,130 @@ class Server(PVGroup):
     #ERROR
     #ERROR_CODE
     STATUS = pvproperty(value='unknown', max_length=10, dtype=str, read_only = True)
+    #position history: flat [t0, position0, t1, position1, ...] of the last HIST_WINDOW seconds, min/max decimated
+    #to HIST_BINS bins
+    HISTORY = pvproperty(value=[0.0], dtype=float, max_length=4*7200, read_only = True)
+    HIST_WINDOW = pvproperty(value=3600.0, units = 's', precision = 1, lower_ctrl_limit=0.0)
+    HIST_BINS = pvproperty(value=1000, lower_ctrl_limit=0, upper_ctrl_limit=7200)
+    #serial transaction counters per opcode and per port as JSON, see Device.command_stats
+    STATS = pvproperty(value='{}', dtype=str, max_length=16384, read_only = True)
+    #flow analytics of the last FLOW_WINDOW seconds, see Device.flow_analytics; flow rates are positive while
+    #dispensing
+    FLOW = pvproperty(value=nan, units = 'uL/s', precision = 4, read_only = True)
+    FLOW_AVG = pvproperty(value=nan, units = 'uL/s', precision = 4, read_only = True)
+    FLOW_WINDOW = pvproperty(value=10.0, units = 's', precision = 1, lower_ctrl_limit=0.0)
+    DISPENSED = pvproperty(value=0.0, units = 'uL', precision = 3, read_only = True)
+    SPEED_DEV = pvproperty(value=nan, precision = 3, read_only = True)
+    STALL = pvproperty(value=0, read_only = True)
 
     device = None
+    worker = None
+
+    # publish settings: deadband and maximum publish rate (Hz) per PV
+    publish_settings = {'RBV': {'deadband': 0.001, 'max_rate': 20.0},
+                        'FLOW': {'deadband': 0.0001, 'max_rate': 5.0},
+                        'FLOW_AVG': {'deadband': 0.0001, 'max_rate': 5.0},
+                        'DISPENSED': {'deadband': 0.001, 'max_rate': 5.0},
+                        'SPEED_DEV': {'deadband': 0.001, 'max_rate': 5.0}}
 
     # NOTE the decorator used here:
     @RBV.startup
     async def RBV(self, instance, async_lib):
         # This method will be called when the server starts up.
         debug('* request method called at server startup')
+        from syringe_pump.publisher import Publisher
+        if self.device is None:
+            # the pump failed to initialize, the PVs of the other pumps in the same IOC are served as usual
+            await self.STATUS.write('fault')
+            return
         self.io_get_queue = async_lib.ThreadsafeQueue()
-        self.io_put_queue = async_lib.ThreadsafeQueue()
+        self.doorbell = async_lib.ThreadsafeQueue()
+        self.io_put_queue = Publisher(doorbell = self.doorbell, settings = self.publish_settings)
         self.device.io_put_queue = self.io_put_queue
         self.device.io_get_queue = self.io_get_queue
 
-        # Loop and grab items from the response queue one at a time
+        # Wait for the device to ring the doorbell and publish the latest values in one batch.
         while True:
-            value = await self.io_put_queue.async_get()
-            debug(f'Got put request from the device: {value}')
-            if 'RBV' in list(value.keys()):
-                await self.RBV.write(value['RBV'])
-            elif 'VAL' in list(value.keys()):
-                await self.VAL.write(value['VAL'])
-            elif 'VELO' in list(value.keys()):
-                await self.VELO.write(value['VELO'])
-            elif 'VALVE' in list(value.keys()):
-                await self.VALVE.write(value['VALVE'])
+            delay = self.io_put_queue.next_due(time.time())
+            if delay is None:
+                await self.doorbell.async_get()
+                continue
+            if delay > 0:
+                # the values wait for the rate limit; a token rung meanwhile is taken here, so the doorbell
+                # never builds a backlog
+                try:
+                    await async_lib.library.wait_for(self.doorbell.async_get(), delay)
+                except async_lib.library.TimeoutError:
+                    pass
+                continue
+            values = self.io_put_queue.flush(time.time())
+            debug('Got put request from the device: %r', values)
+            await self.publish(values)
+
+    @HISTORY.getter
+    async def HISTORY(self, instance):
+        if self.device is None:
+            return [0.0]
+        history = self.device.get_history(window = self.HIST_WINDOW.value, bins = self.HIST_BINS.value)
+        if len(history) == 0:
+            return [0.0]
+        return history.ravel()
+
+    @STATS.getter
+    async def STATS(self, instance):
+        if self.device is None:
+            return '{}'
+        from syringe_pump.instrumentation import to_json
+        return to_json(self.device.command_stats(), max_length = 16384)
+
+    async def publish(self, values):
+        """
+        writes values published by the device into the PVs. A value that cannot be written is logged and skipped,
+        so the publishing of the other PVs goes on.
+        """
+        import traceback
+        for pv_name, value in values.items():
+            try:
+                await self.write_pv(pv_name, value)
+            except Exception:
+                error(f'publishing {pv_name} = {value!r} failed: {traceback.format_exc()}')
+
+    async def write_pv(self, pv_name, value):
+        """
+        writes value published by the device into PV. The values are readbacks: they are written without
+        verify_value, so the putters (which would send the value back to the pump) and the control limits of the
+        setpoint PVs (VAL, VELO, VALVE) are not applied.
+        """
+        if pv_name == 'RBV':
+            await self.RBV.write(value, verify_value = False)
+        elif pv_name == 'VAL':
+            await self.VAL.write(value, verify_value = False)
+        elif pv_name == 'VELO':
+            await self.VELO.write(value, verify_value = False)
+        elif pv_name == 'VALVE':
+            await self.VALVE.write(value, verify_value = False)
+        elif pv_name == 'DMOV':
+            await self.DMOV.write(int(value), verify_value = False)
+        elif pv_name == 'ACK':
+            await self.ACK.write(str(value)[:1000], verify_value = False)
+        elif pv_name == 'STATUS':
+            await self.STATUS.write(str(value)[:10], verify_value = False)
+        elif pv_name in ('FLOW', 'FLOW_AVG', 'DISPENSED', 'SPEED_DEV'):
+            await getattr(self, pv_name).write(float(value), verify_value = False)
+        elif pv_name == 'STALL':
+            await self.STALL.write(int(value), verify_value = False)
+
+    def publish_stats(self):
+        """
+        returns publish queue depth and number of dropped stale updates, see Publisher.stats
+        """
+        return self.io_put_queue.stats()
+
+    @FLOW_WINDOW.putter
+    async def FLOW_WINDOW(self, instance, value):
+        if self.device is not None:
+            self.device.analytics_window = float(value)
+        return value
 
     #@VAL.startup
     #async def VAL(self, instance, async_lib):
@@ -88,9 +188,19 @@ class Server(PVGroup):
 
     async def device_ioexecute(self, pv_name, value):
         """
+        submits request to the device worker and returns without waiting for the device. The progress is reported
+        by the ACK and STATUS PVs. CMD 'abort' bypasses the queue: pending requests are cancelled and the motion is
+        aborted in an executor thread.
         """
         if self.device is not None:
-            self.device.ioexecute(pv_name = pv_name, value = value)
+            if self.worker is None:
+                from syringe_pump.worker import DeviceWorker
+                self.worker = DeviceWorker(self.device)
+            if pv_name == 'CMD' and str(value).strip().lower() == 'abort':
+                import asyncio
+                await asyncio.get_running_loop().run_in_executor(None, self.worker.abort)
+            else:
+                self.worker.submit(pv_name = pv_name, value = value)
 
     async def device_ioread(self, pv_name, value):
         """
@@ -137,6 +247,120 @@ class Device_IO(object):
         ioc.device = pump
         run(ioc.pvdb, **run_options)
 
+def pump_orientation(pump_id):
+    """
+    returns valve orientation of the pump: Y for pumps 1 and 3 (left), Z for pumps 2 and 4 (right)
+    """
+    return {1: 'Y', 2: 'Z', 3: 'Y', 4: 'Z'}.get(pump_id, 'Y')
+
+def init_device(pump_id, bus = None, port_name = None):
+    """
+    initializes and starts Device for pump_id on the shared bus or on the serial port port_name. Returns None if
+    the initialization fails or the pump was not found, so that one faulty pump does not stop the others.
+    """
+    from syringe_pump.device import Device
+    from syringe_pump.driver import Driver
+    import traceback
+    if bus is None and port_name is None:
+        error(f'pump {pump_id} initialization failed: the pump is not found')
+        return None
+    try:
+        driver = None
+        if bus is None:
+            driver = Driver()
+            driver.port = Driver.open_port(port_name)
+        pump = Device()
+        pump.init(pump_id,0.1,100,pump_orientation(pump_id),250,bus = bus,driver = driver)
+        pump.start()
+    except Exception:
+        error(f'pump {pump_id} initialization failed: {traceback.format_exc()}')
+        return None
+    return pump
+
+def build_pvdb(devices, prefix = ''):
+    """
+    creates one Server (PV group with prefix + 'SYRINGE<pump_id>.') per device and returns the combined pvdb and
+    the list of servers
+
+    Parameters
+    ----------
+    devices: dictionary
+        pump_id -> Device, None for pumps that failed to initialize
+    prefix: string
+
+    Returns
+    -------
+    pvdb: dictionary
+    servers: list
+
+    Examples
+    --------
+    >>> pvdb, servers = build_pvdb({1: pump1, 2: pump2}, prefix = 'TEST:')
+    >>> sorted(pvdb)[:2]
+    ['TEST:SYRINGE1.ACK', 'TEST:SYRINGE1.CMD']
+    """
+    pvdb = {}
+    servers = []
+    for pump_id, device in devices.items():
+        server = Server(prefix = prefix + 'SYRINGE' + str(pump_id) + '.')
+        server.device = device
+        pvdb.update(server.pvdb)
+        servers.append(server)
+    return pvdb, servers
+
+class Multi_IO(object):
+    def __init__(self, pump_ids, prefix = '', bus_ports = ()):
+        """
+        serves PVs of several pumps from one process and one event loop.
+
+        Parameters
+        ----------
+        pump_ids: list
+            pump ids
+        prefix: string
+            PV prefix, the PVs are prefix + 'SYRINGE<pump_id>.' + name
+        bus_ports: list
+            serial ports with several pumps on a shared RS-485 bus. Pumps found on these ports share the port, the
+            ports of all other pumps are found with one PortDiscovery.find_all().
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        from syringe_pump.bus import Bus
+        from syringe_pump.discovery import PortDiscovery
+        from tempfile import gettempdir
+        import logging
+        filename=gettempdir()+f'/syringe_pump_device_io_multi.log'
+        logging.basicConfig(filename=filename,
+                            level=logging.DEBUG,
+                            format="%(asctime)s %(levelname)s %(module)s.%(funcName)s: %(message)s")
+        buses = {}
+        for port_name in bus_ports:
+            bus = Bus()
+            bus.open(port_name)
+            for pump_id in bus.scan():
+                buses[pump_id] = bus
+        # all other pumps are resolved to their ports up front with one scan; parallel scans would collide on
+        # the same ports
+        port_names = PortDiscovery().find_all([pump_id for pump_id in pump_ids if pump_id not in buses])
+        # only the homing runs in parallel, the pumps on a shared bus are serialized by the bus lock
+        pumps = []
+        if len(pump_ids) > 0:
+            with ThreadPoolExecutor(max_workers = len(pump_ids)) as executor:
+                pumps = list(executor.map(
+                    lambda pump_id: init_device(pump_id, buses.get(pump_id), port_names.get(pump_id)), pump_ids))
+        self.devices = dict(zip(pump_ids, pumps))
+        ioc_options, run_options = ioc_arg_parser(
+            default_prefix=prefix,
+            desc='Run an IOC that serves several syringe pumps.')
+        pvdb, self.servers = build_pvdb(self.devices, prefix = ioc_options['prefix'])
+        run(pvdb, **run_options)
+
+def run_multi_ioc(pump_ids = (1,2,3,4), bus_ports = ()):
+    from syringe_pump import device_io
+    import multiprocessing
+    p = multiprocessing.Process(target=device_io.Multi_IO,args=(list(pump_ids),'TEST:',list(bus_ports)))
+    p.start()
+    return p
+
 def run_ioc(pump_id = 2):
     from syringe_pump import device_io
     import multiprocessing
@@ -0,0 +1,330 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Serial port discovery for Cavro Centris syringe pumps.
+
+All candidate serial ports are probed concurrently with the pump id query
+("?80") and the result is stored in a small JSON cache file together with the
+USB serial number and location of the USB-serial adapter. On the next start the
+cached port is validated first (the device name is resolved again from the
+serial number and location, because '/dev/ttyUSB<n>' names can change between
+reboots) and the full scan is done only if the pump is not found there.
+find_all() resolves several pumps with one validation pass and one scan, so an
+IOC serving several pumps does not run concurrent scans of the same ports.
+
+Examples
+--------
+>>> from syringe_pump.discovery import PortDiscovery
+>>> discovery = PortDiscovery()
+>>> discovery.find(pump_id = 1)
+'/dev/ttyUSB0'
+>>> discovery.cache
+{'1': {'port': '/dev/ttyUSB0', 'serial_number': 'FT1ABCDE', 'location': '1-1.2'}}
+"""
+
+import os
+import json
+from logging import debug,info,warning,error
+
+
+def default_cache_filename():
+    """
+    returns the default location of the discovery cache file: ~/.syringe_pump/ports.json
+    """
+    return os.path.join(os.path.expanduser('~'), '.syringe_pump', 'ports.json')
+
+
+class PortDiscovery(object):
+
+    def __init__(self, cache_filename = None, address = b'1', baudrate = 9600, timeout = 0.5, max_workers = 16):
+        """
+        Parameters
+        ----------
+        cache_filename: string
+            JSON file with pump_id -> port map. Default is ~/.syringe_pump/ports.json
+        address: bytes
+            pump address used for the probing
+        baudrate: integer
+        timeout: float
+            read timeout of one probe in seconds, the pump answers within a few ms
+        max_workers: integer
+            maximum number of ports probed at the same time
+        """
+        if cache_filename is None:
+            cache_filename = default_cache_filename()
+        self.cache_filename = cache_filename
+        self.address = address
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.max_workers = max_workers
+        self.cache = self.load_cache()
+
+    def load_cache(self):
+        """
+        reads cache file. Returns empty dictionary if the file does not exist or cannot be read.
+        """
+        try:
+            with open(self.cache_filename, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def save_cache(self):
+        """
+        writes cache file atomically.
+        """
+        try:
+            directory = os.path.dirname(self.cache_filename)
+            if directory:
+                os.makedirs(directory, exist_ok = True)
+            temp = self.cache_filename + '.tmp'
+            with open(temp, 'w') as f:
+                json.dump(self.cache, f, indent = 2, sort_keys = True)
+            os.replace(temp, self.cache_filename)
+        except OSError:
+            warning('cannot write port discovery cache {}'.format(self.cache_filename))
+
+    @staticmethod
+    def candidates():
+        """
+        returns list of serial port descriptions (serial.tools.list_ports ListPortInfo) that can have a pump
+        attached
+
+        Parameters
+        ----------
+
+        Returns
+        -------
+        ports: list
+
+        Examples
+        --------
+        >>> [port.device for port in PortDiscovery.candidates()]
+        ['/dev/ttyUSB0', '/dev/ttyUSB1']
+        """
+        from platform import system
+        from serial.tools.list_ports import comports
+        if system() == 'Darwin':
+            prefix = 'cu.usbserial'
+        elif system() == 'Windows':
+            prefix = 'COM'
+        elif system() == 'Linux':
+            prefix = '/dev/tty'
+        else:
+            prefix = ''
+        return [port for port in comports() if prefix in port.device]
+
+    @staticmethod
+    def describe(port):
+        """
+        returns dictionary with port name, USB serial number and location of the port. port can be a ListPortInfo
+        or a device name.
+        """
+        if isinstance(port, str):
+            return {'port': port, 'serial_number': None, 'location': None}
+        return {'port': port.device,
+                'serial_number': getattr(port, 'serial_number', None),
+                'location': getattr(port, 'location', None)}
+
+    def probe(self, port_name):
+        """
+        opens port, queries pump id and closes the port.
+
+        Parameters
+        ----------
+        port_name: string
+
+        Returns
+        -------
+        pump_id: integer
+            or None if there is no pump or the port cannot be opened
+
+        Examples
+        --------
+        >>> discovery.probe('/dev/ttyUSB0')
+        1
+        """
+        from serial import Serial, SerialException
+        from syringe_pump.driver import Driver
+        try:
+            port = Serial(port_name, baudrate = self.baudrate, timeout = self.timeout)
+        except (SerialException, OSError, ValueError):
+            debug('probe: cannot open %s', port_name)
+            return None
+        try:
+            driver = Driver()
+            driver.address = self.address
+            driver.port = port
+            pump_id = driver.get_pump_id()
+        except Exception:
+            pump_id = None
+        finally:
+            port.close()
+        debug('probe: port %s, pump_id %r', port_name, pump_id)
+        return pump_id
+
+    def probe_all(self, port_names):
+        """
+        probes ports concurrently, every port once.
+
+        Parameters
+        ----------
+        port_names: list
+            device names
+
+        Returns
+        -------
+        pump_ids: dictionary
+            port name -> pump id or None
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        port_names = list(dict.fromkeys(port_names))
+        if len(port_names) == 0:
+            return {}
+        with ThreadPoolExecutor(max_workers = min(self.max_workers, len(port_names))) as executor:
+            return dict(zip(port_names, executor.map(self.probe, port_names)))
+
+    def scan(self, ports = None, save = True):
+        """
+        probes all candidate ports concurrently and updates the cache with every pump found.
+
+        Parameters
+        ----------
+        ports: list
+            ListPortInfo objects or device names, default self.candidates()
+        save: boolean
+            write the cache file
+
+        Returns
+        -------
+        found: dictionary
+            pump_id -> port description
+
+        Examples
+        --------
+        >>> discovery.scan()
+        {1: {'port': '/dev/ttyUSB0', 'serial_number': 'FT1ABCDE', 'location': '1-1.2'}}
+        """
+        if ports is None:
+            ports = self.candidates()
+        descriptions = [self.describe(port) for port in ports]
+        found = {}
+        if len(descriptions) == 0:
+            return found
+        pump_ids = self.probe_all([description['port'] for description in descriptions])
+        for description in descriptions:
+            pump_id = pump_ids[description['port']]
+            if pump_id is not None:
+                found[pump_id] = description
+        for pump_id, description in found.items():
+            self.cache[str(pump_id)] = description
+        if save:
+            self.save_cache()
+        return found
+
+    def resolve(self, entry, ports = None):
+        """
+        returns current device name of a cached entry. The port is looked up by USB serial number and location
+        first, the cached device name is used as a fallback.
+        """
+        if entry.get('serial_number') is not None:
+            if ports is None:
+                ports = self.candidates()
+            for port in ports:
+                description = self.describe(port)
+                if (description['serial_number'] == entry['serial_number']
+                        and description['location'] == entry.get('location')):
+                    return description['port']
+        return entry.get('port')
+
+    def find(self, pump_id, ports = None):
+        """
+        returns device name of the port with pump pump_id. The cached port is validated first, the full scan is
+        done only on a miss.
+
+        Parameters
+        ----------
+        pump_id: integer
+        ports: list
+            ListPortInfo objects or device names to scan on a miss, default self.candidates()
+
+        Returns
+        -------
+        port_name: string
+            or None if the pump is not found
+
+        Examples
+        --------
+        >>> discovery.find(pump_id = 1)
+        '/dev/ttyUSB0'
+        """
+        entry = self.cache.get(str(pump_id))
+        if entry is not None:
+            port_name = self.resolve(entry, ports)
+            if port_name is not None and self.probe(port_name) == pump_id:
+                info('pump {} found on cached port {}'.format(pump_id, port_name))
+                return port_name
+            debug('cached port %r of pump %r is not valid anymore', port_name, pump_id)
+        found = self.scan(ports)
+        if pump_id in found:
+            info('pump {} found on port {}'.format(pump_id, found[pump_id]['port']))
+            return found[pump_id]['port']
+        else:
+            self.cache.pop(str(pump_id), None)
+            self.save_cache()
+            warning('pump {} is not found'.format(pump_id))
+            return None
+
+    def find_all(self, pump_ids, ports = None):
+        """
+        returns device names of the ports of several pumps. The cached ports are validated first (every port probed
+        once), the remaining ports are scanned once for all pumps not found there, and the cache file is written
+        once. Use it instead of find() in parallel threads, whose probes would collide on the same ports.
+
+        Parameters
+        ----------
+        pump_ids: list
+        ports: list
+            ListPortInfo objects or device names to scan on a miss, default self.candidates()
+
+        Returns
+        -------
+        port_names: dictionary
+            pump_id -> device name or None if the pump is not found
+
+        Examples
+        --------
+        >>> discovery.find_all([1, 2, 3])
+        {1: '/dev/ttyUSB0', 2: '/dev/ttyUSB1', 3: None}
+        """
+        if len(pump_ids) == 0:
+            return {}
+        if ports is None:
+            ports = self.candidates()
+        cached = {}
+        for pump_id in pump_ids:
+            entry = self.cache.get(str(pump_id))
+            if entry is not None:
+                port_name = self.resolve(entry, ports)
+                if port_name is not None:
+                    cached[pump_id] = port_name
+        probed = self.probe_all(cached.values())
+        port_names = {}
+        for pump_id, port_name in cached.items():
+            if probed[port_name] == pump_id:
+                info('pump {} found on cached port {}'.format(pump_id, port_name))
+                port_names[pump_id] = port_name
+        missing = [pump_id for pump_id in pump_ids if pump_id not in port_names]
+        if missing:
+            claimed = set(port_names.values())
+            found = self.scan([port for port in ports if self.describe(port)['port'] not in claimed], save = False)
+            for pump_id in missing:
+                if pump_id in found:
+                    info('pump {} found on port {}'.format(pump_id, found[pump_id]['port']))
+                    port_names[pump_id] = found[pump_id]['port']
+                else:
+                    self.cache.pop(str(pump_id), None)
+                    warning('pump {} is not found'.format(pump_id))
+                    port_names[pump_id] = None
+            self.save_cache()
+        return {pump_id: port_names[pump_id] for pump_id in pump_ids}
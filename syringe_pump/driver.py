@@ -24,18 +24,43 @@ from logging import debug,info,warning,error
 import sys
 from pdb import pm
 
-from numpy import nan, inf
+from numpy import nan, inf, isnan
 from threading import RLock as Lock
+from syringe_pump.pacing import Pacer
+from syringe_pump.clock import real_clock
+from syringe_pump.instrumentation import Instrumentation
+from syringe_pump.reply import parse_reply, rejected_reply, ErrorCode, STATUS_TABLE, Status
+from syringe_pump import commands
 
 class Driver(object):
 
     def __init__(self):
         self._orientation = ''
-        self.serial_communication_dt = 0.1 #minimum distance between two.
+        self.serial_communication_dt = 0.1 #minimum distance between two commands while the pump is busy.
         self.pump_id = None
+        self.address = b'1'
         self.port = None
         self._backlash = nan
+        self.volume = 250.0 #syringe volume in uL, used to validate positions and speeds before they are sent
         self.lock = Lock()
+        self.pacer = Pacer(busy_gap = self.serial_communication_dt)
+        self.clock = real_clock #time and sleep provider, see syringe_pump.clock
+        self.instrumentation = Instrumentation() #per opcode and per port transaction counters
+
+    @property
+    def header(self):
+        """
+        start of every command: '/' followed by the pump address character, e.g. b'/1'
+        """
+        return b'/' + self.address
+
+    def invalid_operand(self, message, error = ErrorCode.INVALID_OPERAND):
+        """
+        logs message and returns Reply with the error (invalid operand by default) for a command rejected before it
+        was sent to the pump
+        """
+        warning(message)
+        return rejected_reply(error)
 
 
 #  ############################################################################
@@ -43,10 +68,15 @@ class Driver(object):
 #  ############################################################################
 
     def discover(self, pump_id = None):
-        """Finds the serial ports for the specified pump controller id number. uses self.available_ports class property to get all potential serial ports. Then submits the identification command. If the query return corrrect string and the id matches self.pump_id, the tested port will be assigned to self.port of the syringe pump driver class.
+        """Finds the serial ports for the specified pump controller id number. The candidate ports are probed
+        concurrently with the identification command by PortDiscovery and the pump_id -> port map is cached in
+        ~/.syringe_pump/ports.json, so on the next start the cached port is validated first and the full scan is
+        done only on a miss. If a port with matching pump id is found, it is opened and returned.
 
         Parameters
         ----------
+        pump_id: integer
+            pump id, default self.pump_id
 
         Returns
         -------
@@ -56,48 +86,32 @@ class Driver(object):
         --------
         >>> driver.port = driver.discover()
         """
-        from serial import Serial
-
-        from sys import version_info
+        from syringe_pump.discovery import PortDiscovery
         if pump_id  is None:
             pump_id = self.pump_id
+        port_name = PortDiscovery(address = self.address).find(pump_id)
+        if port_name is not None:
+            info("self.port %r: found pump %r" % (port_name,pump_id))
+            port = self.open_port(port_name)
+        else:
+            port = None
+        return port
 
-        available_ports = self.available_ports
-        port = None
-        for port_name in self.available_ports:
-            try:
-                debug("Trying self.port %s..." % port_name)
-                port = Serial(port_name, timeout = 2)
-                port.close()
-            except:
-                available_ports.pop(available_ports.index(port_name))
-        debug("available ports {}...".format(available_ports))
-        for port_name in available_ports:
-            debug("Trying port %s..." % port_name)
-            port = Serial(port_name, timeout = 2)
-            port.baudrate = 9600
-            port.timeout = 2
-            port.flushInput()
-            port.flushOutput()
-            full_reply = self.query(command = b"/1?80\r", port = port)
-            if len(full_reply) != 0:
-                debug("port %r: full_reply %r" % (port_name,full_reply))
-                reply = full_reply[3:][:-3]
-                status = reply[0:1]
-                received_pump_id = int(reply[3:4].decode('Latin-1'))
-                debug("self.ports %r: full_reply %r, status %r, pump_id %r" % (port_name,full_reply, status, pump_id))
-            else:
-                received_pump_id = 0
-                debug("port %r: full_reply %r" % (port_name,full_reply))
+    @staticmethod
+    def open_port(port_name):
+        """
+        opens serial port with the pump settings, e.g. for a port name found by PortDiscovery.find_all()
 
-            if received_pump_id == pump_id: # get pump id for new_pump
-                info("self.port %r: found pump %r" % (port_name,pump_id))
-                break
-            else:
-                port.close()
-                port = None
-                debug("closing the serial connection")
-        return port
+        Parameters
+        ----------
+        port_name: string
+
+        Returns
+        -------
+        port :: Serial
+        """
+        from serial import Serial
+        return Serial(port_name, baudrate = 9600, timeout = 2)
 
 
     @property
@@ -135,7 +149,8 @@ class Driver(object):
 
     def write(self,command, port = None):
         """
-        serial write command. the port attribute is optional. if port left None, the self.port object will be used. this fucnction is both Python 2 and 3 compatible.
+        serial write command. the port attribute is optional. if port left None, the self.port object will be used.
+        this fucnction is both Python 2 and 3 compatible.
 
         Parameters
         ----------
@@ -155,12 +170,11 @@ class Driver(object):
         if type(command) is not bytes:
             warning('Depreciation warning: expecting type bytes in write but received %r' % command)
             command = command.encode('Latin-1')
-        debug('encoding: {}'.format(command))
         if port is None:
             port = self.port
         if port is not None:
             port.flushInput()
-            debug('write(): pid %r and command = %r' %(self.pump_id,command))
+            debug('write(): pid %r and command = %r', self.pump_id, command)
             port.write(command)
             self.last_command = command
         else:
@@ -168,7 +182,8 @@ class Driver(object):
 
     def read(self, port = None):
         """
-        serial read command. the port attribute is optional. if port left None, the self.port object will be used. this fucnction is both Python 2 and 3 compatible.
+        serial read command. the port attribute is optional. if port left None, the self.port object will be used.
+        this fucnction is both Python 2 and 3 compatible.
 
         Parameters
         ----------
@@ -193,13 +208,16 @@ class Driver(object):
             self.last_reply = reply
         else:
             reply = ''
-        debug("read: {}".format(reply))
+        debug('read: %r', reply)
         return reply
 
 
     def query(self,command, port = None):
         """
-        write-read command with build in threading lock to insure no commands can be send within 100 ms, which is the syringe pump hardware limitation. first performs write into port and later read out serial buffer of the port object.
+        write-read command with build in threading lock. The pacing between consecutive commands is done by
+        self.pacer: the command is held back only for the gap learned for the previous command class (at least 100
+        ms if the pump reported busy, which is the syringe pump hardware limitation). first performs write into
+        port and later read out serial buffer of the port object.
 
         Parameters
         ----------
@@ -219,37 +237,60 @@ class Driver(object):
         >>> driver.query(command = '/1?29R\\r')
         "ÿ/0`0\\x03\\r\\n"
         """
-        from time import time
-        from sys import version_info
-        timeout = self.serial_communication_dt
-        debug('query(): pid {!r} and command = {!r}'.format(self.pump_id,command))
+        debug('query(): pid %r and command = %r', self.pump_id, command)
         if port is None:
             port = self.port
         if port is not None:
-            t1 = time()
-            with self.lock:
-                port.flushInput()
-                port.flushOutput()
-                self.write(command = command, port = port)
-                reply = self.read(port = port)
-            dt = self.serial_communication_dt - (time()-t1)
-            debug('query: left of dt = {:.3f}. will sleep this amount'.format(dt))
-            if dt > 0:
-                if dt < 0 : dt = 0
-                sleep(dt)
+            command_class = self.pacer.classify(command)
+            lock_wait = 0.0
+            while True:
+                #the pacing wait is done outside of the lock so other pumps sharing the same bus lock are not held
+                #back
+                t0 = self.clock.time()
+                with self.lock:
+                    t1 = self.clock.time()
+                    lock_wait += t1 - t0
+                    dt = self.pacer.delay(t1)
+                    if dt <= 0:
+                        port.flushInput()
+                        port.flushOutput()
+                        self.write(command = command, port = port)
+                        reply = self.read(port = port)
+                        t2 = self.clock.time()
+                        result = self.parse_reply(reply)
+                        self.pacer.record(command_class, t1, t2, replied = len(reply) != 0, busy = result['busy'])
+                        break
+                debug('query: pacing, will sleep %.3f s', dt)
+                self.clock.sleep(dt)
+            description = result['error'] if result.status is not None else None
+            port_name = getattr(port, 'port', None)
+            self.instrumentation.record(command, port_name, t2 - t1, lock_wait, reply, description)
         else:
-            reply = None
-        #parsing reply
-        if reply is not None and reply is not '':
-            #the positinonal reply \xff/0`0.000\x03\r\n is sandwiched between '\x03\r\n' and '\xff/0'
-            error_code = reply.split(b'\x03\r\n')[0].split(b'\xff/0')[1][0:1]
-            value = reply.split(b'\x03\r\n')[0].split(b'\xff/0')[1][1:]
-            dict = self.convert_error_code(error_code)
-            result = {'value':value,'error_code': error_code, 'busy':dict['busy'],'error':dict['error']}
-        else:
-            result = {'value':None,'error_code': None, 'busy':None,'error':'no device found'}
+            result = self.parse_reply(None)
         return result
 
+    def parse_reply(self, reply):
+        """
+        parses raw reply from the pump in a single scan, see syringe_pump.reply.parse_reply
+
+        Parameters
+        ----------
+        reply: bytes
+            raw reply, e.g. b"\\xff/0`0.000\\x03\\r\\n"
+
+        Returns
+        -------
+        result: Reply
+            record with status, busy, error and value. Supports dictionary access with keys 'value', 'error_code',
+            'busy' and 'error'
+
+        Examples
+        --------
+        >>> driver.parse_reply(b"\\xff/0`0.000\\x03\\r\\n")
+        {'value': b'0.000', 'error_code': b'`', 'busy': False, 'error': 'No Error'}
+        """
+        return parse_reply(reply)
+
     @property
     def waiting(self):
         """
@@ -311,13 +352,13 @@ class Driver(object):
         >>> driver._get_position()
             {'value': b'0.000', 'error_code': b'`', 'busy': False, 'error': 'No Error'}
         """
-        reply = self.query(command = b'/1?18\r')
-        debug('get_position(): reply = {!r}'.format(reply))
+        reply = self.query(command = self.header+b'?18\r')
+        debug('get_position(): reply = %r', reply)
         return reply
 
     def _set_position(self, position):
         """
-        queries set position as an atomic command: "'/1A'+str(pos)+',1R\r'"
+        queries set position as an atomic command: "/1A<position>,1R\\r"
         FIXIT - can be this executed if plunger is moving?
         Example:
         "/1A100.000,1R\\r" move absolute to 100.0 uL
@@ -336,9 +377,12 @@ class Driver(object):
         >>> ser_port._set_position(10)
         {'value': '', 'error_code': '@', 'busy': True, 'error': 'No Error'}
         """
-        pos = round(position,3)
-        reply = self.query(command = '/1A'+str(pos)+',1R\r', port = self.port)
-        debug('_set_position(): reply = {!r}'.format(reply))
+        try:
+            command = commands.encode_set_position(self.address, position, self.volume)
+        except ValueError as exception:
+            return self.invalid_operand(str(exception))
+        reply = self.query(command = command, port = self.port)
+        debug('_set_position(): reply = %r', reply)
         return reply
     _position = property(_get_position,_set_position)
 
@@ -360,14 +404,15 @@ class Driver(object):
         >>> ser_port._get_speed()
          {'value': '25.000', 'error_code': '`', 'busy': False, 'error': 'No Error'}
         """
-        reply = self.query(command = b'/1?37\r', port = self.port)
+        reply = self.query(command = self.header+b'?37\r', port = self.port)
         number = reply['value']
-        debug('get_speed(): reply = {}, and number = {}'.format(reply,number))
+        debug('get_speed(): reply = %r, and number = %r', reply, number)
         return reply
 
     def _set_speed(self,speed):
         """
-        set speed as an atomic command. can be executed if plunger is moving. If plunger is moving accepts speeds below 68.8.
+        set speed as an atomic command. can be executed if plunger is moving. If plunger is moving accepts speeds
+        below 68.8.
         Example: ''
         "/1V25.0,1F\\r" set speed to 25.0 uL/s
 
@@ -387,13 +432,17 @@ class Driver(object):
         {'value': '', 'error_code': '@', 'busy': True, 'error': 'No Error'}
 
         """
-        spd = round(speed,3)
-        reply = self.query(command = b'/1V'+bytes(str(spd), 'Latin-1')+b',1R\r')
+        try:
+            command = commands.encode_set_speed(self.address, speed, False, self.volume)
+        except ValueError as exception:
+            return self.invalid_operand(str(exception))
+        reply = self.query(command = command)
         return reply
 
     def _set_speed_on_the_fly(self,speed):
         """
-        set speed as an atomic command on the fly. If plunger is moving accepts speeds below 68.8. Speeds above are rejected but no error is issued. Example: "/1V25.0,1F"\"r" set speed to 25.0 uL/s
+        set speed as an atomic command on the fly. If plunger is moving accepts speeds below 68.8. Speeds above are
+        rejected but no error is issued. Example: "/1V25.0,1F"\"r" set speed to 25.0 uL/s
 
         Parameters
         ----------
@@ -407,9 +456,11 @@ class Driver(object):
         --------
         >>> driver._set_speed_on_the_fly(speed = 25)
         """
-        spd = round(speed,3)
-        bytes_spd = bytes(str(spd),'Latin-1')
-        reply = self.query(command = b'/1V'+bytes_spd+b',1F\r')
+        try:
+            command = commands.encode_set_speed(self.address, speed, True, self.volume)
+        except ValueError as exception:
+            return self.invalid_operand(str(exception))
+        reply = self.query(command = command)
         return reply
     _speed = property(_get_speed,_set_speed)
 
@@ -434,7 +485,8 @@ class Driver(object):
         return reply
     def set_speed(self,speed, on_the_fly = True):
         """
-        set speed as an atomic command. can be executed if plunger is moving. If plunger is moving accepts speeds below 68.8.
+        set speed as an atomic command. can be executed if plunger is moving. If plunger is moving accepts speeds
+        below 68.8.
         Example: '/1V25.0,1F\\r' set speed to 25.0 uL per s
 
         Parameters
@@ -486,26 +538,24 @@ class Driver(object):
         --------
         >>> driver.assign_volume(volume = 250)
         """
-        volumes = {}
-        volumes[50] = 'U93'
-        volumes[100] = 'U94'
-        volumes[250] = 'U90'
-        volumes[500] = 'U95'
-
+        volumes = commands.VOLUME_CODES
         if volume in volumes.keys():
-
-            reply = self.query(b"/1"+bytes(volumes[volume],'Latin-1')+b"R\r")
+            reply = self.query(self.header+volumes[volume]+b"R\r")
+            self.volume = float(volume)
         else:
-            reply = {'busy': None, 'error': "volume of {} uL is not supported. Choose from {}".format(volume,volumes.keys()), 'error_code': '!', 'value': ''}
+            reply = self.invalid_operand("volume of {} uL is not supported. Choose from {}".format(
+                volume,list(volumes.keys())))
         return reply
 
     def initialize(self, orientation = ''):
         """
         initialization command: Y for left pumps and Z for right pumps
         Z: input on left, output on right
-        Rotate valve CW to port 1; move the plunger to zero at speed 7 (default: 2.33 s per 30-mm stroke); rotate valve CW to port 2.
+        Rotate valve CW to port 1; move the plunger to zero at speed 7 (default: 2.33 s per 30-mm stroke); rotate
+        valve CW to port 2.
         Y: input on right, output on left
-        Rotate valve CCW to Input port 1; move the plunger to zero at speed 7 (default: 2.33 s per 30-mm stroke); rotate valve CCW to Output port 2.
+        Rotate valve CCW to Input port 1; move the plunger to zero at speed 7 (default: 2.33 s per 30-mm stroke);
+        rotate valve CCW to Output port 2.
 
         The initialize command cannot be sent if motor is busy.
 
@@ -527,17 +577,11 @@ class Driver(object):
         {'value': '', 'error_code': '@', 'busy': True, 'error': 'No Error'}
 
         """
-        command = b''
-        if orientation == 'Y':
-            command = b'Y7,0,0'
-        elif orientation == 'Z':
-            command = b'Z7,0,0'
-        else:
-            reply = ''
-        if command != '':
-            reply = self.query(command =b"/1"+command+b"R\r")
+        if orientation in commands.ORIENTATIONS:
+            reply = self.query(command = self.header+commands.ORIENTATIONS[orientation]+b"R\r")
         else:
-            reply = {'busy': False, 'error': 'Invalid Command, unknown orientation "{}"'.format(orientation), 'error_code': '!', 'value': ''}
+            reply = self.invalid_operand('unknown orientation "{}"'.format(orientation),
+                                         error = ErrorCode.INVALID_COMMAND)
         self._orientation = orientation
         return reply
 
@@ -547,11 +591,35 @@ class Driver(object):
         """Assigns pump id to each syringe pump according to dictionary; since
         pump ids are written to non-volatile memory, need only execute once."""
         if pid is not None:
-            reply = self.query(command =b"/1s0ZA"+str(self.pump_id).encode('Latin-1')+b"R\r")
+            reply = self.query(command =self.header+b"s0ZA"+str(self.pump_id).encode('Latin-1')+b"R\r")
         else:
             reply = None
         return reply
 
+    def get_pump_id(self):
+        """
+        reads pump id stored in the non-volatile memory by assign_pids (command "?80", reply 'ZA<id>')
+
+        Parameters
+        ----------
+
+        Returns
+        -------
+        pump_id: integer
+            pump id or None if the pump did not reply
+
+        Examples
+        --------
+        >>> driver.get_pump_id()
+        1
+        """
+        reply = self.query(command = self.header+b"?80\r")
+        value = reply['value']
+        if value is not None and value[:2] == b'ZA' and value[2:].isdigit():
+            return int(value[2:])
+        else:
+            return None
+
     def set_valve_orientation(self, orientation = ''):
         raise NotImplementedError
 
@@ -588,7 +656,9 @@ class Driver(object):
 
         """
         self.pump_id = pump_id
-        self.port = self.discover()
+        if self.port is None:
+            #drivers created by Bus.driver() already share the port of the bus
+            self.port = self.discover()
         #Initializes pump and sets it to correct orientation
         if volume is not None:
             self.assign_volume(volume = volume)
@@ -613,7 +683,7 @@ class Driver(object):
         --------
         >>> driver.abort()
         """
-        reply = self.query(command  = b'/1TR\r', port = self.port)
+        reply = self.query(command  = self.header+b'TR\r', port = self.port)
         return reply
 
     def home(self):
@@ -642,30 +712,14 @@ class Driver(object):
         --------
         >>> driver.home()
         """
-        # command = ''
-        # command += '/1' # start
-        # command += 'V'+str(speed)+',1' # at speed 'speed' in uL(,1)
-        # command += 'A'+str(position)+',1' # to position 'position' in uL (,1)
-        # command += 'R' #execute loaded command symbol
-        # command += "\r" #cariage return signalling the end of transmission
-        if self.pump_id == 1:
-            command = b''
-            command += b'/1' # start
-            command += b'Y7,0,0' # initialization command for left pumps and Z for right pumps
-            command += b'I' # move the valve to position 'i'
-            command += b'V25.0,1' # set velocity to 25. V0.100,1
-            command += b'K' + bytes(str(self.backlash),'Latin-1') # set backlash K<n>
-            command += b'A0.0,1' #move plunger to absolute position of 0.0 uL
-            command += b'R' #Execute loaded Command or Program String
-            command += b'\r' #
-            reply = self.query(command, port = self.port)
-        elif self.pump_id == 2:
-            reply = self.query("".join(["/1Z7,0,0IV25,1K",str(self.backlash),"A0,1R\r"]), port = self.port)
-        elif self.pump_id == 3:
-            reply = self.query("".join(["/1Y7,0,0IV25,1K",str(self.backlash),"A0,1R\r"]), port = self.port)
-        elif self.pump_id == 4:
-            reply = self.query("".join(["/1Z7,0,0IV25,1K",str(self.backlash),"A0,1R\r"]), port = self.port)
-        debug('homing of motor %r: reply = %r' %(self.pump_id,reply))
+        orientation = {1: 'Y', 2: 'Z', 3: 'Y', 4: 'Z'}.get(self.pump_id, self._orientation or 'Y')
+        backlash = None if isnan(self.backlash) else self.backlash #backlash is nan if it was never set
+        try:
+            command = commands.encode_home(self.address, orientation, backlash, 25.0, self.volume)
+        except ValueError as exception:
+            return self.invalid_operand(str(exception))
+        reply = self.query(command, port = self.port)
+        debug('homing of motor %r: reply = %r', self.pump_id, reply)
         self.cmd_position = 0.0
         self.speed = 25.0
         return reply
@@ -684,13 +738,63 @@ class Driver(object):
         --------
         >>> driver.busy()
         """
-        reply = self.query(command = b'/1?29R\r', port = self.port)
-        debug('busy(): reply = %r' %reply)
+        reply = self.query(command = self.header+b'?29R\r', port = self.port)
+        debug('busy(): reply = %r', reply)
         return reply
 
+    def status(self, valve = True, speed = True):
+        """
+        returns snapshot of the pump state in as few transactions as the firmware allows. Every reply carries the
+        status byte, so the position query "?18" already returns position, busy flag and error code in one
+        transaction. The valve ("?20") and speed ("?37") cannot be combined with it and are queried only if
+        requested.
+
+        Parameters
+        ----------
+        valve: boolean
+            query valve position
+        speed: boolean
+            query top speed
+
+        Returns
+        -------
+        status: Status
+            record with time, position, busy, error, error_code, valve and speed
+
+        Examples
+        --------
+        >>> driver.status(valve = False, speed = False)
+        Status(time=1571234567.89, position=25.0, busy=False, error='No Error', error_code=b'`', valve=None,
+               speed=None)
+        """
+        status = Status()
+        reply = self._get_position()
+        status.time = self.clock.time()
+        status.busy = reply['busy']
+        status.error = reply['error']
+        status.error_code = reply['error_code']
+        status.position = self.to_float(reply['value'])
+        if valve:
+            value = self.get_valve()['value']
+            if value:
+                status.valve = value.decode('Latin-1').lower()
+        if speed:
+            status.speed = self.to_float(self._get_speed()['value'])
+        return status
+
+    @staticmethod
+    def to_float(value):
+        """
+        converts reply value into float, nan if the value is missing or not a number
+        """
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return nan
+
     def get_valve(self):
-        reply = self.query(command = b'/1?20R\r', port = self.port)
-        debug('get_valve(): reply = %r' %reply)
+        reply = self.query(command = self.header+b'?20R\r', port = self.port)
+        debug('get_valve(): reply = %r', reply)
         return reply
 
     def set_valve(self,value):
@@ -711,11 +815,12 @@ class Driver(object):
         >>> self.set_valve(b'i')
         {'value': b'', 'error_code': 64, 'busy': False, 'error': None}
         """
-        if isinstance(value,str):
-            value = bytes(value,'Latin-1')
-        value = value.upper()
-        reply = self.query(command = b"".join([b"/1",value,b"R\r"]))
-        debug('set_valve(value = %r): reply = %r' %(value,reply))
+        try:
+            command = commands.encode_valve(self.address, value)
+        except ValueError as exception:
+            return self.invalid_operand(str(exception))
+        reply = self.query(command = command)
+        debug('set_valve(value = %r): reply = %r', value, reply)
         return reply
     valve = property(get_valve,set_valve)
 
@@ -724,52 +829,104 @@ class Driver(object):
     def set_backlash(self,value):
         """
         """
-        reply = self.query(command = b'/1K'+bytes(str(int(value)),'Latin-1') + b'R\r', port = self.port)
-        debug('set_backlash(): reply = %r' %reply)
+        try:
+            command = commands.encode_backlash(self.address, value)
+        except ValueError as exception:
+            return self.invalid_operand(str(exception))
+        reply = self.query(command = command, port = self.port)
+        debug('set_backlash(): reply = %r', reply)
         self._backlash = value
+        return reply
     backlash = property(get_backlash, set_backlash)
 
     def convert_error_code(self,char = b''):
         """
-        the ` is \x60 character or chr(96)
-        """
-        error_codes = {}
-        error_codes[b'`'] = {'busy':False,'error':'No Error'}
-        error_codes[b'@'] = {'busy':True,'error':'No Error'}
-        error_codes[b'a'] = {'busy':False,'error':'Initialization Error'}
-        error_codes[b'A'] = {'busy':True,'error':'Initialization Error'}
-        error_codes[b'b'] = {'busy':False,'error':'Invalid Command'}
-        error_codes[b'B'] = {'busy':True,'error':'Invalid Command'}
-        error_codes[b'c'] = {'busy':False,'error':'Invalid Operand'}
-        error_codes[b'C'] = {'busy':True,'error':'Invalid Operand'}
-        error_codes[b'i'] = {'busy':False,'error':'Plunger Overload'}
-        error_codes[b'I'] = {'busy':True,'error':'Plunger Overload'}
-        # need to be added FIXIT
-        # 7	    g 	G 	Device Not Initialized
-        # 8	    h 	H 	Invalid Valve Configuration
-        # 9	    i 	I
-        # 10	j 	J 	Valve Overload
-        # 11	k 	K 	Plunger Move Not Allowed
-        # 12	l 	L 	Extended Error Present
-        # 13	m 	M 	Nvmem Access Failure
-        # 14	n 	N 	Command Buffer Empty or Not Ready
-        error_codes[b'o'] = {'busy':False,'error':'Command Buffer Overflow'}
-        error_codes[b'O'] = {'busy':True,'error':'Command Buffer Overflow'}
-
-
-        if char in list(error_codes.keys()):
-            return error_codes[char]
-        else:
+        converts status character into busy flag and error description. The ` is \x60 character or chr(96)
+
+        Parameters
+        ----------
+        char: bytes
+            status character
+
+        Returns
+        -------
+        dictionary: dictionary
+            {'busy': bool, 'error': string}
+
+        Examples
+        --------
+        >>> driver.convert_error_code(b'@')
+        {'busy': True, 'error': 'No Error'}
+        """
+        if len(char) != 1:
             return {'busy':None,'error':None}
+        busy, error_code = STATUS_TABLE[char[0]]
+        if error_code is None:
+            return {'busy':None,'error':None}
+        return {'busy':busy,'error':error_code.description}
 
     def reset(self):
         """Performs a soft reset on pumps"""
-        reply = self.query(b"/1!R\r", port = self.port)
-        debug('reset(): reply = %r' %reply)
+        reply = self.query(self.header+b"!R\r", port = self.port)
+        debug('reset(): reply = %r', reply)
         return reply
 
     #Compund commands
 
+    def prime(self, N = 5, speed = 68.0, restore_speed = None, full = 250.0):
+        """
+        starts the prime program on the pump: valve to input, empty and fill N times with speed, restore speed (if
+        given), valve to output. The whole sequence is one command string with a [g]/[G] loop, the reply arrives as
+        soon as the program has started.
+
+        Parameters
+        ----------
+        N: integer
+            number of times to empty and fill
+        speed: float
+            speed of the program moves, uL/s
+        restore_speed: float
+            speed set at the end of the program
+        full: float
+            fill position, uL
+
+        Returns
+        -------
+        reply: Reply
+
+        Examples
+        --------
+        >>> driver.prime(N = 5, restore_speed = 25)
+        {'value': b'', 'error_code': b'@', 'busy': True, 'error': 'No Error'}
+        """
+        try:
+            command = commands.encode_prime(self.address, N, speed, restore_speed, full, self.volume)
+        except ValueError as exception:
+            return self.invalid_operand(str(exception))
+        return self.query(command = command)
+
+    def empty(self, speed = 100.0, restore_speed = None):
+        """
+        starts the empty program on the pump: valve to input, plunger to zero, restore speed (if given), valve to
+        output, see prime()
+        """
+        try:
+            command = commands.encode_empty(self.address, speed, restore_speed, self.volume)
+        except ValueError as exception:
+            return self.invalid_operand(str(exception))
+        return self.query(command = command)
+
+    def fill(self, position = 250.0, speed = 100.0, restore_speed = None):
+        """
+        starts the fill program on the pump: valve to input, plunger to zero and to position, restore speed (if
+        given), valve to output, see prime()
+        """
+        try:
+            command = commands.encode_fill(self.address, position, speed, restore_speed, self.volume)
+        except ValueError as exception:
+            return self.invalid_operand(str(exception))
+        return self.query(command = command)
+
     def move_abs(self,position, speed):
         """Move plunger of pump[pid] to absolute position.
         Plunger moves can be executed in increments or volume
@@ -778,27 +935,53 @@ class Driver(object):
         The volume in uL is internally calculated from the syringe volume (specified by a U command).
         Two arguments need to be passed: position and speed.
         """
-        position = round(position,3)
-        command = b''
-        command += b'/1' # start
-        command += b'V'+bytes(str(speed),'Latin-1')+b',1' # at speed 'speed' in uL(,1)
-        command += b'A'+bytes(str(position),'Latin-1')+b',1' # to position 'position' in uL (,1) A100.0,1
-        command += b'R' #execute loaded command symbol
-        command += b'\r' #cariage return signalling the end of transmission
+        try:
+            command = commands.encode_move_abs(self.address, position, speed, self.volume)
+        except ValueError as exception:
+            return self.invalid_operand(str(exception))
         reply = self.query(command = command)
         return reply
 
 
+    def load_move_abs(self, position, speed):
+        """
+        loads move to absolute position with speed into the command buffer of the pump without executing it. The
+        move is started by execute(), e.g. by syringe_pump.group.fire for several pumps at once.
+
+        Returns
+        -------
+        reply: Reply
+
+        Examples
+        --------
+        >>> driver.load_move_abs(position = 0, speed = 0.1)
+        {'value': b'', 'error_code': b'`', 'busy': False, 'error': 'No Error'}
+        """
+        try:
+            command = commands.encode_load_move_abs(self.address, position, speed, self.volume)
+        except ValueError as exception:
+            return self.invalid_operand(str(exception))
+        return self.query(command = command)
+
+    def execute(self):
+        """
+        executes the command string loaded into the pump (R). The pump replies with error 14 if nothing is loaded.
+        """
+        return self.query(command = commands.encode_execute(self.address))
+
     def move_rel(self,position,speed):
         """Move plunger of pump[pid] to relative position."""
+        try:
+            builder = commands.CommandBuilder(self.address, self.volume).raw(b'J2').speed(speed)
+            if position < 0:
+                builder.dispense(abs(position))
+            else:
+                builder.pickup(position)
+            command = builder.raw(b'J0').frame()
+        except ValueError as exception:
+            return self.invalid_operand(str(exception))
         self.abort()
-        current = self._get_position()
-
-        if position < 0:
-            position = abs(position)
-            reply = self.query("".join(["/1J2V",str(speed),",1D",str(position),",1J0R\r"]), port = self.port)
-        else:
-            reply = self.query("".join(["/1J2V",str(speed),",1P",str(position),",1J0R\r"]), port = self.port)
+        reply = self.query(command, port = self.port)
 
         return reply
 
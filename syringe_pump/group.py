@@ -0,0 +1,195 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Synchronized start of several pumps.
+
+Device.flow() stops the pump, sets the valve and sends the move with R, so two
+pumps started one after the other begin their flows hundreds of ms apart.
+PumpGroup prepares all pumps first (Device.prepare_flow: stop, valve to output
+and the move loaded into the pump without R, all pumps in parallel on the
+scheduler) and then fires the R commands back to back with fire(): the locks
+of all ports are taken at once, R is written to the first pump of every port,
+the replies are read, then R goes to the second pump of every port and so on.
+Pumps on different ports start within microseconds of each other, pumps that
+share one RS-485 bus one transaction apart (a pump must reply before the next
+command is written, otherwise the reply collides with the command on the
+half-duplex line).
+
+A pump starts the move when it receives the R command, which happens between
+sent (R written) and acked (reply read). The report gives the estimated start
+skew max(sent) - min(sent) and the worst case max(acked) - min(sent).
+
+The group addresses of the Centris (e.g. '_' for all pumps on the bus) would
+start several pumps with one frame, but the pumps do not reply to them, so the
+start could be neither verified nor timed; they are not used.
+
+Examples
+--------
+>>> from syringe_pump.group import PumpGroup
+>>> group = PumpGroup([pumpf, pumpa])
+>>> report = group.flow([(0, 0.02), (0, 0.01)])
+>>> report['skew'], report['skew_bound']
+(2.1e-05, 0.0161)
+"""
+
+from contextlib import ExitStack
+from logging import debug,info,warning,error
+
+from syringe_pump import commands
+
+
+def fire(drivers, clock = None):
+    """
+    sends R to every driver back to back and returns the timing report, see module docstring.
+
+    Parameters
+    ----------
+    drivers: list
+        Driver objects with a command loaded; drivers sharing a serial port are fired in the given order
+    clock: object
+        time and sleep provider, default is the clock of the first driver
+
+    Returns
+    -------
+    report: dictionary
+        'skew' (estimated start skew, s), 'skew_bound' (worst case, s), 'start' (time of the first R) and 'pumps':
+        one dictionary per driver with address, pump_id, sent and acked (s after start) and reply
+
+    Examples
+    --------
+    >>> fire([bus.driver(0), bus.driver(1), driver3])['skew']
+    0.0158
+    """
+    if clock is None:
+        clock = drivers[0].clock
+    ports = {}
+    for driver in drivers:
+        ports.setdefault(id(driver.port), []).append(driver)
+    locks = {}
+    for driver in drivers:
+        locks[id(driver.lock)] = driver.lock
+    results = {}
+    lock_wait = 0.0
+    while True:
+        #same loop as Driver.query: the pacing wait is done outside of the locks, so the other pumps on these buses
+        #are not held back
+        with ExitStack() as stack:
+            t0 = clock.time()
+            for key in sorted(locks):
+                stack.enter_context(locks[key])
+            lock_wait += clock.time() - t0
+            delay = max(driver.pacer.delay(clock.time()) for driver in drivers)
+            if delay <= 0:
+                for group in ports.values():
+                    group[0].port.flushInput()
+                    group[0].port.flushOutput()
+                _fire_rounds(ports, clock, lock_wait, results)
+                break
+        clock.sleep(delay)
+    start = min(results[id(driver)][0] for driver in drivers)
+    pumps = []
+    for driver in drivers:
+        sent, acked, result = results[id(driver)]
+        pumps.append({'address': driver.address,
+                      'pump_id': driver.pump_id,
+                      'sent': sent - start,
+                      'acked': acked - start,
+                      'reply': result})
+    return {'start': start,
+            'skew': max(pump['sent'] for pump in pumps),
+            'skew_bound': max(pump['acked'] for pump in pumps),
+            'pumps': pumps}
+
+
+def _fire_rounds(ports, clock, lock_wait, results):
+    """
+    writes R to the first driver of every port, reads the replies, then the second driver of every port and so on.
+    Called by fire() with the locks of all ports held; fills results: id(driver) -> (sent, acked, reply)
+    """
+    rounds = max(len(group) for group in ports.values())
+    for k in range(rounds):
+        batch = [group[k] for group in ports.values() if k < len(group)]
+        for driver in batch:
+            command = commands.encode_execute(driver.address)
+            t1 = clock.time()
+            driver.write(command = command, port = driver.port)
+            results[id(driver)] = [command, t1, clock.time()]
+        for driver in batch:
+            reply = driver.read(port = driver.port)
+            t2 = clock.time()
+            command, t1, sent = results[id(driver)]
+            result = driver.parse_reply(reply)
+            driver.pacer.record(driver.pacer.classify(command), t1, t2, replied = len(reply) != 0,
+                                busy = result['busy'])
+            description = result['error'] if result.status is not None else None
+            port_name = getattr(driver.port, 'port', None)
+            driver.instrumentation.record(command, port_name, t2 - t1, lock_wait, reply, description)
+            results[id(driver)] = (sent, t2, result)
+
+
+class PumpGroup(object):
+
+    def __init__(self, devices):
+        """
+        Parameters
+        ----------
+        devices: list
+            Device objects, started in this order on every port
+        """
+        self.devices = list(devices)
+        self.report = None #report of the last start, see fire()
+
+    def prepare_flow(self, moves):
+        """
+        stops all pumps, sets their valves to output and loads the moves without starting them. The pumps are
+        prepared in parallel. Raises RuntimeError if any pump fails.
+
+        Parameters
+        ----------
+        moves: list
+            (position, speed) for every device
+        """
+        sequences = [device.prepare_flow(position, speed, wait = False)
+                     for device, (position, speed) in zip(self.devices, moves)]
+        failed = []
+        for device, sequence in zip(self.devices, sequences):
+            if sequence.wait() != 'done':
+                failed.append('pump {}: {}'.format(device.pump_id, sequence.error))
+        if failed:
+            raise RuntimeError('flow could not be prepared: {}'.format(', '.join(failed)))
+
+    def start(self):
+        """
+        starts the loaded moves of all pumps back to back and returns the report of fire()
+        """
+        report = fire([device.driver for device in self.devices], clock = self.devices[0].clock)
+        for device, pump in zip(self.devices, report['pumps']):
+            device.started(report['start'] + pump['sent'], pump['reply'])
+            if pump['reply']['error'] != 'No Error':
+                warning('pump {} did not start: {}'.format(device.pump_id, pump['reply']['error']))
+        info('group start of {} pumps: skew {:.6f} s, bound {:.6f} s'.format(len(self.devices), report['skew'],
+                                                                          report['skew_bound']))
+        self.report = report
+        return report
+
+    def flow(self, moves):
+        """
+        synchronized compound "flow" command: prepare_flow(moves) and start()
+
+        Parameters
+        ----------
+        moves: list
+            (position, speed) for every device
+
+        Returns
+        -------
+        report: dictionary
+            see fire()
+
+        Examples
+        --------
+        >>> PumpGroup([pumpf, pumpa]).flow([(0, 0.02), (0, 0.01)])['skew']
+        2.1e-05
+        """
+        self.prepare_flow(moves)
+        return self.start()
@@ -0,0 +1,198 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Per-command instrumentation of the serial transactions.
+
+Driver.query records every transaction: the opcode of the command, the serial
+port, the round trip latency, the time spent waiting for the port lock and the
+outcome (reply, timeout - nothing received, bad reply - no valid status byte or
+no terminator, or the error reported in the status byte). The counters are
+kept per opcode and per port, latencies as fixed-bin histograms, so recording a
+transaction costs a few additions and no allocations.
+
+The opcode is the sequence of command letters of the command string, with the
+report number for queries and F appended for on-the-fly commands, e.g.
+b'/1V5.0,1A10.0,1R\\r' -> 'VA', b'/1?18\\r' -> '?18', b'/1V2.0,1F\\r' -> 'VF'.
+
+Examples
+--------
+>>> driver.instrumentation.snapshot()['opcodes']['?18']
+{'count': 120, 'timeouts': 0, 'bad_replies': 0, 'errors': {}, 'latency_mean': 0.0151, 'latency_max': 0.0212,
+ 'lock_wait_mean': 0.0003, 'lock_wait_max': 0.0148, 'histogram': [0, 0, 0, 0, 118, 2, 0, 0, 0, 0, 0, 0]}
+"""
+
+import re
+import json
+from bisect import bisect_left
+from functools import lru_cache
+from threading import Lock
+
+#upper edges of the latency histogram bins in seconds, the last bin collects everything slower
+LATENCY_BINS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0)
+
+_TOKEN = re.compile(rb'(\?[0-9]*|[A-Za-z!])')
+
+
+@lru_cache(maxsize = 256)
+def opcode(command):
+    """
+    returns opcode of a serial command, see module docstring
+
+    Examples
+    --------
+    >>> opcode(b'/1V5.0,1A10.0,1R\\r')
+    'VA'
+    """
+    if isinstance(command, str):
+        command = command.encode('Latin-1')
+    body = command[2:].rstrip(b'\r')
+    suffix = ''
+    if body.endswith(b'F'):
+        body, suffix = body[:-1], 'F'
+    elif body.endswith(b'R') and len(body) > 1:
+        body = body[:-1]
+    return b''.join(_TOKEN.findall(body)).decode('Latin-1') + suffix
+
+
+class CommandStats(object):
+    """
+    counters and latency histogram of one opcode or one port
+    """
+    __slots__ = ('count', 'timeouts', 'bad_replies', 'errors', 'latency_sum', 'latency_max', 'lock_wait_sum',
+                 'lock_wait_max', 'histogram')
+
+    def __init__(self):
+        self.count = 0
+        self.timeouts = 0
+        self.bad_replies = 0
+        self.errors = {} #error description -> count
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+        self.lock_wait_sum = 0.0
+        self.lock_wait_max = 0.0
+        self.histogram = [0]*(len(LATENCY_BINS) + 1)
+
+    def add(self, latency, lock_wait, outcome):
+        self.count += 1
+        self.latency_sum += latency
+        if latency > self.latency_max:
+            self.latency_max = latency
+        self.lock_wait_sum += lock_wait
+        if lock_wait > self.lock_wait_max:
+            self.lock_wait_max = lock_wait
+        self.histogram[bisect_left(LATENCY_BINS, latency)] += 1
+        if outcome is None:
+            return
+        if outcome == 'timeout':
+            self.timeouts += 1
+        elif outcome == 'bad_reply':
+            self.bad_replies += 1
+        else:
+            self.errors[outcome] = self.errors.get(outcome, 0) + 1
+
+    def as_dict(self):
+        count = self.count if self.count else 1
+        return {'count': self.count,
+                'timeouts': self.timeouts,
+                'bad_replies': self.bad_replies,
+                'errors': dict(self.errors),
+                'latency_mean': self.latency_sum/count,
+                'latency_max': self.latency_max,
+                'lock_wait_mean': self.lock_wait_sum/count,
+                'lock_wait_max': self.lock_wait_max,
+                'histogram': list(self.histogram)}
+
+
+class Instrumentation(object):
+
+    def __init__(self):
+        self.lock = Lock()
+        self.reset()
+
+    def reset(self):
+        """
+        clears all counters
+        """
+        with self.lock:
+            self.opcodes = {}
+            self.ports = {}
+
+    def record(self, command, port, latency, lock_wait, reply, error = None):
+        """
+        records one transaction.
+
+        Parameters
+        ----------
+        command: bytes
+            full serial command, e.g. b'/1?18\\r'
+        port: string
+            serial port name
+        latency: float
+            time from write to the end of the read, seconds
+        lock_wait: float
+            time spent waiting for the port lock, seconds
+        reply: bytes
+            raw reply, empty if the read timed out
+        error: string
+            error description of the status byte, None if the status byte is not valid
+
+        Examples
+        --------
+        >>> instrumentation.record(b'/1?18\\r', '/dev/ttyUSB0', 0.015, 0.0, b'\\xff/0`0.000\\x03\\r\\n',
+        ...                        'No Error')
+        """
+        if not reply:
+            outcome = 'timeout'
+        elif error is None or not reply.endswith(b'\n'):
+            outcome = 'bad_reply'
+        elif error != 'No Error':
+            outcome = error
+        else:
+            outcome = None
+        key = opcode(command)
+        with self.lock:
+            stats = self.opcodes.get(key)
+            if stats is None:
+                stats = self.opcodes[key] = CommandStats()
+            stats.add(latency, lock_wait, outcome)
+            stats = self.ports.get(port)
+            if stats is None:
+                stats = self.ports[port] = CommandStats()
+            stats.add(latency, lock_wait, outcome)
+
+    def snapshot(self):
+        """
+        returns counters as a dictionary {'bins': LATENCY_BINS, 'opcodes': {opcode: counters},
+        'ports': {port: counters}}, see CommandStats.as_dict
+        """
+        with self.lock:
+            return {'bins': list(LATENCY_BINS),
+                    'opcodes': {key: stats.as_dict() for key, stats in self.opcodes.items()},
+                    'ports': {key: stats.as_dict() for key, stats in self.ports.items()}}
+
+
+def to_json(snapshot, max_length = 16384):
+    """
+    returns snapshot (see Instrumentation.snapshot) as compact JSON of at most max_length characters. If it is too
+    long, the histograms are dropped; if it is still too long, an error object is returned. The result is always
+    valid JSON.
+
+    Examples
+    --------
+    >>> to_json(instrumentation.snapshot(), max_length = 100)
+    '{"error":"statistics of 2311 characters do not fit into 100"}'
+    """
+    text = json.dumps(snapshot, separators = (',', ':'))
+    if len(text) <= max_length:
+        return text
+    reduced = dict(snapshot)
+    for key in ('opcodes', 'ports'):
+        if key in reduced:
+            reduced[key] = {name: {field: value for field, value in stats.items() if field != 'histogram'}
+                            for name, stats in reduced[key].items()}
+    reduced.pop('bins', None)
+    reduced_text = json.dumps(reduced, separators = (',', ':'))
+    if len(reduced_text) <= max_length:
+        return reduced_text
+    message = 'statistics of {} characters do not fit into {}'.format(len(text), max_length)
+    return json.dumps({'error': message}, separators = (',', ':'))
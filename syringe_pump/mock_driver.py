@@ -4,6 +4,8 @@
 Authors: Valentyn Stadnytskyi
 Date last modified: 06/19/2019
 
+Simulator of the Cavro Centris pump firmware on a pseudo terminal (pty).
+
 ASCII communication syntax:
 “/“ indicates the start of a command sequence
 The first character after the “/“ is the pump address: [1]
@@ -11,172 +13,485 @@ n-ASCII characters define the command sequence
 “R” executes the command sequence (“F” executes on-the-fly changes)
 “CR” or carriage return terminates the command sequence
 
+The Simulator serves any number of pumps (addresses) on one pty, so the driver,
+the bus, the device and the IOC can be run and load-tested without hardware.
+Every pump is modeled by PumpModel:
+
+- plunger kinematics: moves with constant top speed, start times of the steps in
+  one command string are chained, [T] stops the plunger at the current position
+  and [V..F] changes the speed of a running move
+- valve moves [I], [O], [B] take valve_time seconds
+- initialization [Y7,0,0] / [Z7,0,0]: valve to input, plunger to zero at 2.33 s
+  per full stroke, valve to output
+- load [..] without R, execute [R], on-the-fly [..F]
+- error codes: invalid command (2), invalid operand (3), device not initialized
+  (7), command buffer empty (14), command buffer overflow (15, any command other
+  than reports, [T] and [V] while busy)
+- reports ?18 (position, uL), ?20 (valve), ?29 (busy), ?37 (top speed, uL/s),
+  ?80 (pump id), [Q] (status only)
+- serial latency: firmware response time plus the transmission time of the
+  command and the reply at the simulated baud rate
+- time: the kinematics and the reply delays use the clock passed to the
+  Simulator; with syringe_pump.clock.VirtualClock no wall time is spent
+
+Examples
+--------
+>>> from syringe_pump.mock_driver import Simulator, Driver
+>>> simulator = Simulator(pumps = {1: b'1', 2: b'2'})
+>>> simulator.open()
+>>> driver = Driver(simulator)
+>>> driver.init(pump_id = 1, speed = 25, backlash = 100, orientation = 'Y', volume = 250)
+>>> driver.move_abs(position = 100, speed = 50)
+{'value': b'', 'error_code': b'@', 'busy': True, 'error': 'No Error'}
+>>> simulator.close()
 """
 
-import sys
-from time import sleep,time
+import os
+import re
+from time import time
+from threading import Thread, Lock
 from logging import debug,info,warning,error
-import sys
-from pdb import pm
 
-from numpy import nan, inf
+from syringe_pump.driver import Driver
+from syringe_pump.commands import FULL_STROKE
+from syringe_pump.reply import ErrorCode
+from syringe_pump.clock import real_clock
 
-from driver import Driver
+#one command of a command string: letter(s) and optional numeric operands, e.g. A100.0,1 or ?18
+TOKEN = re.compile(rb'(\?|[A-Za-z!])([-0-9.,]*)')
+VOLUMES = {90: 250.0, 93: 50.0, 94: 100.0, 95: 500.0}
+KNOWN_COMMANDS = b'APDVIOBYZKUT!?QgG'
 
-#following example in https://stackoverflow.com/questions/2291772/virtual-serial-device-in-python
-import os, pty, serial
-master, slave = pty.openpty()
-s_name = os.ttyname(slave)
 
-class Device():
-    def __init__(self):
-        self.position = 0.0
-        self.cmd_position = 0.0
-        self.speed = 0.001
-        self.valve = b'i'
-        self.running = False
-        self.time_step = 0.1
-        self.busy = False
-
-
-    def run_once(self):
-        if self.position != self.cmd_position:
-            self.busy = True
-            sign = (self.cmd_position - self.position)/abs(self.cmd_position - self.position)
-            step = sign*self.speed*self.time_step
-            sleep(self.time_step)
-            if abs(self.position - self.cmd_position) <= step:
-                self.position = self.cmd_position
-            else:
-                self.position += sign*self.speed*self.time_step
-            sleep(self.time_step)
-        else:
-            self.busy = False
+class CommandError(Exception):
+    def __init__(self, code):
+        Exception.__init__(self, code)
+        self.code = code
 
-    def run(self):
-        while self.running:
-            self.run_once()
 
-    def start(self):
-        from ubcs_auxiliary.threading import new_thread
-        self.running = True
-        new_thread(self.run)
+class PumpModel(object):
 
-    def write(self):
+    def __init__(self, pump_id = 1, volume = 250.0, clock = time):
         """
-        write reply command to a serial port
+        Parameters
+        ----------
+        pump_id: integer
+            id reported by ?80
+        volume: float
+            syringe volume, uL
+        clock: callable
+            returns current time in seconds
         """
+        self.pump_id = pump_id
+        self.volume = float(volume)
+        self.clock = clock
+        self.initialized = False
+        self.error = ErrorCode.NO_ERROR
+        self.speed = 25.0 #top speed, uL/s
+        self.backlash = 0
+        self.valve_time = 0.25 #duration of a valve move, s
+        self.init_stroke_time = 2.33 #duration of a full stroke during the initialization, s
+        self.position = 0.0 #position at the end of the last finished segment
+        self.segments = [] #plunger moves [t_start, p_start, target, speed]
+        self.valve = b'i'
+        self.valve_events = [] #valve moves [t_end, valve]
+        self.ready_at = 0.0 #end time of the executed command string
+        self.loaded = b'' #command string loaded without R
 
+    # kinematics
 
-class Driver(Driver):
+    def _update(self, t):
+        """
+        folds finished plunger and valve moves into the current state
+        """
+        while self.segments:
+            t0, p0, target, speed = self.segments[0]
+            if t0 + abs(target - p0)/speed <= t:
+                self.position = target
+                self.segments.pop(0)
+            else:
+                break
+        while self.valve_events and self.valve_events[0][0] <= t:
+            self.valve = self.valve_events.pop(0)[1]
 
-    def discover(self):
-        from serial import Serial
-        port = Serial(s_name)
-        return port
+    def position_at(self, t):
+        """
+        returns plunger position at time t, uL
+        """
+        self._update(t)
+        position = self.position
+        for t0, p0, target, speed in self.segments:
+            if t < t0:
+                break
+            distance = speed*(t - t0)
+            if target >= p0:
+                position = min(target, p0 + distance)
+            else:
+                position = max(target, p0 - distance)
+        return position
 
-    @property
-    def available_ports(self):
-        return [s_name]
+    def busy(self, t):
+        return t < self.ready_at
 
-    def write(self,command, port = None):
-        """
-        serial write command. the port attribute is optional. if port left None, the self.port object will be used. this fucnction is both Python 2 and 3 compatible.
+    def final_position(self):
+        if self.segments:
+            return self.segments[-1][2]
+        return self.position
 
-        Parameters
-        ----------
-        command: strin
-            string command to be written into serial input buffer
-        port: object
-            serial port object
+    def schedule_move(self, start, target, speed):
+        """
+        schedules plunger move after the previous step and returns its end time
+        """
+        p0 = self.final_position()
+        if target == p0:
+            return start
+        self.segments.append([start, p0, target, speed])
+        return start + abs(target - p0)/speed
+
+    def schedule_valve(self, start, valve):
+        end = start + self.valve_time
+        self.valve_events.append([end, valve])
+        return end
+
+    def terminate(self, t):
+        """
+        [T]: stops the plunger at the current position, valve moves are not affected
+        """
+        self.position = self.position_at(t)
+        self.segments = []
+        #the valve move in progress is finished, the valve moves not yet started are dropped
+        self.valve_events = [event for event in self.valve_events if event[0] - self.valve_time <= t]
+        self.ready_at = self.valve_events[-1][0] if self.valve_events else t
+        self.loaded = b''
+
+    def change_speed(self, t, speed):
+        """
+        [V..F]: changes speed of the running move
+        """
+        position = self.position_at(t)
+        end = t
+        for segment in self.segments:
+            if segment[0] <= t:
+                segment[0], segment[1], segment[3] = t, position, speed
+            else:
+                segment[0] = max(segment[0], end)
+            end = segment[0] + abs(segment[2] - segment[1])/segment[3]
+        if self.segments:
+            valve_end = self.valve_events[-1][0] if self.valve_events else t
+            self.ready_at = max(end, valve_end)
+        self.speed = speed
+
+    # command language
+
+    def operand(self, text, index = 0, default = None):
+        values = text.split(b',') if text else []
+        if index < len(values) and values[index] != b'':
+            try:
+                return float(values[index])
+            except ValueError:
+                raise CommandError(ErrorCode.INVALID_OPERAND)
+        if default is None:
+            raise CommandError(ErrorCode.INVALID_OPERAND)
+        return default
+
+    def volume_operand(self, text):
+        """
+        position or volume operand: uL if the second operand is 1, increments otherwise
+        """
+        value = self.operand(text)
+        if self.operand(text, 1, 0) == 1:
+            return value
+        return value*self.volume/FULL_STROKE
+
+    def report(self, n, t):
+        if n == 18:
+            return b'%.3f' % self.position_at(t)
+        if n == 20:
+            self._update(t)
+            return self.valve
+        if n == 29:
+            return b'1' if self.busy(t) else b'0'
+        if n == 37:
+            return b'%.3f' % self.speed
+        if n == 80:
+            return b'ZA%d' % self.pump_id
+        raise CommandError(ErrorCode.INVALID_COMMAND)
+
+    def execute(self, text, t):
+        """
+        executes command string text at time t
 
         Returns
         -------
+        data: bytes
+            data block of the reply
+        """
+        start = t
+        position = self.final_position()
+        for letter, operands in self.expand_loops(TOKEN.findall(text)):
+            if letter in b'APD' and not self.initialized:
+                raise CommandError(ErrorCode.DEVICE_NOT_INITIALIZED)
+            if letter == b'A':
+                target = self.volume_operand(operands)
+            elif letter == b'P':
+                target = position + self.volume_operand(operands)
+            elif letter == b'D':
+                target = position - self.volume_operand(operands)
+            if letter in b'APD':
+                if not 0 <= round(target, 3) <= self.volume:
+                    raise CommandError(ErrorCode.INVALID_OPERAND)
+                start = self.schedule_move(start, target, self.speed)
+                position = target
+            elif letter == b'V':
+                speed = self.operand(operands)
+                if self.operand(operands, 1, 0) != 1:
+                    speed = speed*self.volume/FULL_STROKE
+                if not 0 < speed <= 200000*self.volume/FULL_STROKE:
+                    raise CommandError(ErrorCode.INVALID_OPERAND)
+                self.speed = speed
+            elif letter in b'IOB':
+                start = self.schedule_valve(start, letter.lower())
+            elif letter in b'YZ':
+                self.initialized = True
+                start = self.schedule_valve(start, b'i')
+                start = self.schedule_move(start, 0.0, self.volume/self.init_stroke_time)
+                start = self.schedule_valve(start, b'o')
+                position = 0.0
+            elif letter == b'K':
+                self.backlash = int(self.operand(operands))
+            elif letter == b'U':
+                code = int(self.operand(operands))
+                if code in VOLUMES:
+                    self.volume = VOLUMES[code]
+            elif letter == b'T':
+                self.terminate(t)
+                start = t
+                position = self.position
+            elif letter == b'!':
+                self.terminate(t)
+                self.initialized = False
+                start = t
+            elif letter == b'?':
+                return self.report(int(self.operand(operands)), t)
+            elif letter == b'Q':
+                pass
+            else:
+                raise CommandError(ErrorCode.INVALID_COMMAND)
+        self.ready_at = max(self.ready_at, start)
+        return b''
+
+    def expand_loops(self, tokens):
+        """
+        unrolls [g] ... [G<n>] loops of a command string; [G<n>] without [g] repeats everything before it. The
+        firmware reports loop errors with code 18, which does not fit into the status byte used here, so they are
+        reported as invalid command.
+        """
+        stack = [[]]
+        for letter, operands in tokens:
+            if letter == b'g':
+                if len(stack) > 20:
+                    raise CommandError(ErrorCode.INVALID_COMMAND)
+                stack.append([])
+            elif letter == b'G':
+                n = int(self.operand(operands, 0, 0))
+                if not 1 <= n <= 30000:
+                    #G0 (repeat until terminated) is not simulated
+                    raise CommandError(ErrorCode.INVALID_OPERAND)
+                if len(stack) > 1:
+                    body = stack.pop()
+                    stack[-1].extend(body*n)
+                else:
+                    stack[0] = stack[0]*n
+            else:
+                stack[-1].append((letter, operands))
+        if len(stack) != 1:
+            raise CommandError(ErrorCode.INVALID_COMMAND)
+        return stack[0]
+
+    def command(self, body, t = None):
+        """
+        processes one command body (the characters between the address and CR) and returns (status byte, data)
 
         Examples
         --------
-        >>> driver.write()
-        """
-        #command = bytes(command,encoding='Latin-1')
-        if type(command) is not bytes:
-            warning('Depreciation warning: expecting type bytes in write but received %r' % command)
-            command = command.encode('Latin-1')
-        debug('encoding: {}'.format(command))
-        if port is None:
-            port = self.port
-        if port is not None:
-            port.flushInput()
-            debug('write(): pid %r and command = %r' %(self.pump_id,command))
-            sleep(dict[command]['delay'])
-            command = dict[command]['reply']
-            port.write(command)
-            self.last_command = command
-        else:
-            error('Port is not specified')
-
-    def read(self, port = None):
-        """
-        serial read command. the port attribute is optional. if port left None, the self.port object will be used. this fucnction is both Python 2 and 3 compatible.
+        >>> pump.command(b'?18')
+        (96, b'0.000')
+        """
+        if t is None:
+            t = self.clock()
+        data = b''
+        try:
+            if body.startswith(b'?') or body.rstrip(b'R') == b'Q':
+                #reports are accepted while busy
+                data = self.execute(body.rstrip(b'R'), t)
+            elif body.endswith(b'F'):
+                self.execute_on_the_fly(body[:-1], t)
+            elif body == b'R':
+                if not self.loaded:
+                    raise CommandError(ErrorCode.COMMAND_BUFFER_EMPTY)
+                self.check_ready(self.loaded, t)
+                data = self.execute(self.loaded, t)
+                self.loaded = b''
+            elif body.endswith(b'R'):
+                self.check_ready(body[:-1], t)
+                data = self.execute(body[:-1], t)
+            else:
+                self.check_ready(body, t)
+                self.loaded = body
+            self.error = ErrorCode.NO_ERROR
+        except CommandError as exception:
+            self.error = exception.code
+        status = 0x40 | (0 if self.busy(t) else 0x20) | int(self.error)
+        return status, data
+
+    def check_ready(self, text, t):
+        """
+        raises invalid command if text is not a valid command string and command buffer overflow if the pump is
+        busy and text contains anything except terminate and speed
+        """
+        tokens = TOKEN.findall(text)
+        letters = b''.join(letter for letter, operands in tokens)
+        if b''.join(letter + operands for letter, operands in tokens) != text or letters.strip(KNOWN_COMMANDS):
+            raise CommandError(ErrorCode.INVALID_COMMAND)
+        if self.busy(t) and letters.replace(b'T', b'').replace(b'V', b''):
+            raise CommandError(ErrorCode.COMMAND_BUFFER_OVERFLOW)
+
+    def execute_on_the_fly(self, text, t):
+        """
+        [V<n>F]: changes top speed of the running move
+        """
+        for letter, operands in TOKEN.findall(text):
+            if letter != b'V':
+                raise CommandError(ErrorCode.INVALID_COMMAND)
+            speed = self.operand(operands)
+            if self.operand(operands, 1, 0) != 1:
+                speed = speed*self.volume/FULL_STROKE
+            if not 0 < speed <= 200000*self.volume/FULL_STROKE:
+                raise CommandError(ErrorCode.INVALID_OPERAND)
+            self.change_speed(t, speed)
+
 
+class Simulator(object):
+
+    def __init__(self, pumps = None, latency = 0.005, baudrate = 9600, clock = None):
+        """
         Parameters
         ----------
-        port: object
-            serial port object
+        pumps: dictionary
+            pump_id -> address character, default {1: b'1'}
+        latency: float
+            firmware response time, s
+        baudrate: integer
+            simulated baud rate used for the transmission time, 0 - no transmission time
+        clock: object
+            time and sleep provider shared with the driver, default is the system clock. With
+            syringe_pump.clock.VirtualClock the plunger moves and the reply delays take no wall time.
+        """
+        if pumps is None:
+            pumps = {1: b'1'}
+        self.clock = clock if clock is not None else real_clock
+        self.pumps = {address: PumpModel(pump_id, clock = self.clock.time) for pump_id, address in pumps.items()}
+        self.latency = latency
+        self.baudrate = baudrate
+        self.master = None
+        self.slave = None
+        self.port_name = None
+        self.running = False
+        self.commands = 0
+        self.lock = Lock()
 
-        Returns
-        -------
-        reply: string
-            returns string from serial buffer
+    def open(self):
+        """
+        opens pty pair and starts the serving thread. The device name of the pump side is self.port_name.
+        """
+        import pty
+        import tty
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.slave)
+        self.port_name = os.ttyname(self.slave)
+        self.running = True
+        self.thread = Thread(target = self.serve, name = 'Simulator', daemon = True)
+        self.thread.start()
+        return self.port_name
+
+    def close(self):
+        self.running = False
+        for fd in (self.master, self.slave):
+            if fd is not None:
+                try:
+                    os.close(fd)
+                except OSError:
+                    pass
+        self.master = self.slave = None
+
+    def transmission_time(self, n):
+        """
+        returns time to transmit n bytes (10 bits per byte)
+        """
+        if not self.baudrate:
+            return 0.0
+        return n*10.0/self.baudrate
+
+    def reply(self, frame):
+        """
+        returns reply to one command frame (without CR), None if no pump has the address
+        """
+        if len(frame) < 2 or frame[:1] != b'/':
+            return None
+        pump = self.pumps.get(frame[1:2])
+        if pump is None:
+            return None
+        with self.lock:
+            self.commands += 1
+            status, data = pump.command(frame[2:])
+        return b'\xff/0' + bytes((status,)) + data + b'\x03\r\n'
+
+    def serve(self):
+        buffer = b''
+        while self.running:
+            try:
+                data = os.read(self.master, 1024)
+            except OSError:
+                break
+            buffer += data
+            while b'\r' in buffer:
+                frame, buffer = buffer.split(b'\r', 1)
+                start = frame.find(b'/')
+                if start < 0:
+                    continue
+                frame = frame[start:]
+                reply = self.reply(frame)
+                debug('simulator: %r -> %r', frame, reply)
+                if reply is None:
+                    continue
+                delay = self.latency + self.transmission_time(len(frame) + 1 + len(reply))
+                if delay > 0:
+                    self.clock.sleep(delay)
+                try:
+                    os.write(self.master, reply)
+                except OSError:
+                    break
+
+
+class Driver(Driver):
+
+    def __init__(self, simulator = None):
+        super(Driver, self).__init__()
+        self.simulator = simulator
+        if simulator is not None:
+            self.clock = simulator.clock
+
+    def discover(self, pump_id = None):
+        """
+        opens the simulator port
+        """
+        from serial import Serial
+        return Serial(self.simulator.port_name, baudrate = 9600, timeout = 2)
+
+    @property
+    def available_ports(self):
+        return [self.simulator.port_name]
 
-        Examples
-        --------
-        >>> driver.read()
-        "ÿ/0`0\\x03\\r\\n"
-        """
-        from sys import version_info
-        if port is None:
-            port = self.port
-        if port is not None:
-            reply = os.read(master,1000)
-            self.last_reply = reply
-        else:
-            reply = ''
-        debug("read: {}".format(reply))
-        return reply
-
-driver = Driver()
-dict = {}
-#initialization commands
-dict[b"/1"+b'Y7,0,0'+b"R\r"] = {'reply':bytearray("ÿ/0@\x03\r\n".encode()),'delay':0}
-dict[b"/1"+b'Z7,0,0'+b"R\r"] = {'reply':bytearray('ÿ/0@\x03\r\n'.encode()),'delay':0}
-
-#Busy query
-dict[b"/1?29R\r"] = {}
-dict[b"/1?29R\r"]['reply'] = bytearray('ÿ/0`0\x03\r\n'.encode())
-dict[b"/1?29R\r"]['delay'] = 0
-dict[b"/1?29R\r"]['description'] = b'busy'
-
-#get position
-dict[b'/1?18\r'] = {}
-dict[b'/1?18\r']['reply'] = bytearray(b"\xff/0`0.000\x03\r\n") #
-dict[b'/1?18\r']['delay'] = 0
-dict[b'/1?18\r']['description'] = 'position'
-
-#Get Valve
-dict[b'/1?20R\r' ] = {}
-dict[b'/1?20R\r']['reply'] = b'\xff/0`o\x03\r\n'
-dict[b'/1?20R\r']['delay'] = 0.1 #
-dict[b'/1?20R\r']['description'] = 'get valve'
-
-#get ID number
-dict[b'/1?80\r' ] = {}
-dict[b'/1?80\r']['reply'] = b'\xff/0`ZA1\x03\r\n'
-dict[b'/1?80\r']['delay'] = 0.1 #
-dict[b'/1?80\r']['description'] = 'get id number'
-
-#Set Valve
-
-driver = Driver()
 
 if __name__ == "__main__":
     from tempfile import gettempdir
@@ -184,3 +499,5 @@ if __name__ == "__main__":
     import logging;
     logging.basicConfig(filename=gettempdir()+'/syringe_pump_driver.log',
                                         level=logging.DEBUG, format="%(asctime)s %(levelname)s: %(message)s")
+    simulator = Simulator(pumps = {1: b'1', 2: b'2', 3: b'3', 4: b'4'})
+    print('simulated pumps on {}'.format(simulator.open()))
@@ -0,0 +1,203 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Adaptive inter-command pacing for the Cavro Centris serial protocol.
+
+The Centris manual states that the answer to a command usually starts within
+5 ms and that a busy pump should be polled with at least 100 ms between
+commands. Instead of padding every transaction to a fixed 100 ms, the pacer
+measures the real turnaround of each command class and learns the gap that
+has to be left after it before the next command is written to the port.
+
+Command classes:
+
+- 'query' : report commands ("?18", "?29", "Q", ...)
+- 'move' : commands executed with "R" (moves, valve, set commands)
+- 'on_the_fly' : commands executed with "F" (on-the-fly speed change)
+
+The gap of a class is derived from its measured turnaround: the moving
+average of the write-to-reply time plus a safety margin, clamped to
+[min_gap, max_gap]. While the pump keeps answering the gap shrinks
+geometrically towards that target; every lost reply doubles it (up to
+max_gap). While the pump reports busy the gap never drops below busy_gap.
+"""
+
+from numpy import nan, isnan
+from threading import RLock as Lock
+
+COMMAND_CLASSES = ('query', 'move', 'on_the_fly')
+
+
+class Pacer(object):
+
+    def __init__(self, busy_gap = 0.1, min_gap = 0.005, max_gap = 1.0, decay = 0.5, alpha = 0.2, margin = 0.001):
+        """
+        Parameters
+        ----------
+        busy_gap: float
+            minimum gap in seconds after a reply that reported busy status
+        min_gap: float
+            the smallest gap in seconds the pacer will ever learn
+        max_gap: float
+            the largest gap in seconds the pacer will back off to
+        decay: float
+            factor applied to a learned gap after every answered command
+        alpha: float
+            weight of the newest sample in the turnaround moving average
+        margin: float
+            time in seconds added to the average turnaround to get the target gap
+        """
+        self.busy_gap = busy_gap
+        self.min_gap = min_gap
+        self.max_gap = max_gap
+        self.decay = decay
+        self.alpha = alpha
+        self.margin = margin
+        self.lock = Lock()
+        self.reset()
+
+    def reset(self):
+        """
+        forgets everything learned so far. All gaps restart from busy_gap.
+
+        Parameters
+        ----------
+
+        Returns
+        -------
+
+        Examples
+        --------
+        >>> pacer.reset()
+        """
+        with self.lock:
+            self.gaps = {key: self.busy_gap for key in COMMAND_CLASSES}
+            self.turnaround = {key: nan for key in COMMAND_CLASSES}
+            self.counts = {key: 0 for key in COMMAND_CLASSES}
+            self.misses = {key: 0 for key in COMMAND_CLASSES}
+            self.ready_at = 0.0
+
+    @staticmethod
+    def classify(command):
+        """
+        returns command class of a serial command: 'query', 'move' or 'on_the_fly'
+
+        Parameters
+        ----------
+        command: bytes
+            full serial command, e.g. b'/1?18\\r'
+
+        Returns
+        -------
+        command_class: string
+
+        Examples
+        --------
+        >>> Pacer.classify(b'/1V25.0,1F\\r')
+        'on_the_fly'
+        """
+        if isinstance(command, str):
+            command = command.encode('Latin-1')
+        body = command.rstrip(b'\r')
+        if body.endswith(b'F'):
+            return 'on_the_fly'
+        if b'?' in body[:3] or body[2:3] == b'Q':
+            return 'query'
+        return 'move'
+
+    def delay(self, now):
+        """
+        returns time in seconds that has to pass before the next command can be written
+
+        Parameters
+        ----------
+        now: float
+            current time in seconds
+
+        Returns
+        -------
+        dt: float
+
+        Examples
+        --------
+        >>> pacer.delay(time())
+        0.0
+        """
+        return max(0.0, self.ready_at - now)
+
+    def target_gap(self, command_class):
+        """
+        returns gap the pacer converges to while the pump answers: average turnaround of the class plus margin,
+        clamped to [min_gap, max_gap]
+        """
+        gap = self.turnaround[command_class] + self.margin
+        if isnan(gap) or gap < self.min_gap:
+            return self.min_gap
+        if gap > self.max_gap:
+            return self.max_gap
+        return gap
+
+    def record(self, command_class, t_start, t_end, replied = True, busy = None):
+        """
+        records one finished transaction and updates the learned gap of its class.
+
+        Parameters
+        ----------
+        command_class: string
+            'query', 'move' or 'on_the_fly'
+        t_start: float
+            time the command was written
+        t_end: float
+            time the reply was received (or the read timed out)
+        replied: boolean
+            False if no reply was received
+        busy: boolean
+            busy flag reported in the reply
+
+        Returns
+        -------
+
+        Examples
+        --------
+        >>> pacer.record('query', t_start = 10.000, t_end = 10.004, replied = True, busy = False)
+        """
+        with self.lock:
+            self.counts[command_class] += 1
+            gap = self.gaps[command_class]
+            if replied:
+                dt = t_end - t_start
+                average = self.turnaround[command_class]
+                if isnan(average):
+                    self.turnaround[command_class] = dt
+                else:
+                    self.turnaround[command_class] = average + self.alpha*(dt - average)
+                gap = max(self.target_gap(command_class), gap*self.decay)
+            else:
+                self.misses[command_class] += 1
+                gap = min(self.max_gap, max(gap, self.min_gap)*2)
+            self.gaps[command_class] = gap
+            if busy:
+                gap = max(gap, self.busy_gap)
+            self.ready_at = t_end + gap
+
+    def snapshot(self):
+        """
+        returns learned gaps, average turnaround times and counters in a dictionary format
+
+        Parameters
+        ----------
+
+        Returns
+        -------
+        snapshot: dictionary
+
+        Examples
+        --------
+        >>> pacer.snapshot()
+        {'query': {'gap': 0.005, 'turnaround': 0.0041, 'count': 120, 'misses': 0}, ...}
+        """
+        with self.lock:
+            return {key: {'gap': self.gaps[key],
+                          'turnaround': self.turnaround[key],
+                          'count': self.counts[key],
+                          'misses': self.misses[key]} for key in COMMAND_CLASSES}
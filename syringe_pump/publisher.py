@@ -0,0 +1,142 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Coalescing publish stage between the device thread and the IO server.
+
+The device writes PV updates with put({pv_name: value}) (the same call as on the
+io_put_queue it replaces). Only the latest value per PV is kept, so a fast poll
+loop cannot build a backlog of stale positions. flush() is called by the server
+event loop and returns the pending values that are due: a value is published if
+it differs from the last published value by more than the PV deadband and if the
+minimum interval of the PV (1/max_rate) has passed. Values held back by the rate
+limit stay pending and are returned by a later flush().
+
+The event loop is notified through a doorbell queue that receives at most one
+token per batch.
+
+Examples
+--------
+>>> from syringe_pump.publisher import Publisher
+>>> publisher = Publisher(settings = {'RBV': {'deadband': 0.001, 'max_rate': 20.0}})
+>>> publisher.put({'RBV': 1.0})
+>>> publisher.put({'RBV': 2.0})
+>>> publisher.flush(now = time())
+{'RBV': 2.0}
+>>> publisher.stats()
+{'depth': 0, 'dropped': 1, 'suppressed': 0, 'published': 1}
+"""
+
+from threading import Lock
+from numbers import Number
+
+
+class Publisher(object):
+
+    def __init__(self, doorbell = None, settings = None):
+        """
+        Parameters
+        ----------
+        doorbell: queue
+            object with put() method, receives one token (None) when the first value of a new batch arrives
+        settings: dictionary
+            pv_name -> {'deadband': float, 'max_rate': float}. PVs without settings are published on every flush
+            with no deadband.
+        """
+        self.doorbell = doorbell
+        self.settings = settings if settings is not None else {}
+        self.lock = Lock()
+        self.pending = {}
+        self.last_value = {}
+        self.last_time = {}
+        self.signaled = False
+        self.dropped = 0
+        self.suppressed = 0
+        self.published = 0
+
+    def put(self, item):
+        """
+        stores new values, replacing pending values of the same PVs.
+
+        Parameters
+        ----------
+        item: dictionary
+            pv_name -> value
+        """
+        with self.lock:
+            for pv_name, value in item.items():
+                if pv_name in self.pending:
+                    self.dropped += 1
+                self.pending[pv_name] = value
+            ring = not self.signaled
+            self.signaled = True
+        if ring and self.doorbell is not None:
+            self.doorbell.put(None)
+
+    def _changed(self, pv_name, value, deadband):
+        if pv_name not in self.last_value:
+            return True
+        last = self.last_value[pv_name]
+        if deadband and isinstance(value, Number) and isinstance(last, Number):
+            # nan != nan, a change to or from nan is always published
+            return not abs(value - last) < deadband
+        return value != last
+
+    def flush(self, now):
+        """
+        returns dictionary of pending values due for publishing and removes them from the pending values.
+
+        Parameters
+        ----------
+        now: float
+            current time
+
+        Returns
+        -------
+        values: dictionary
+            pv_name -> value
+        """
+        values = {}
+        with self.lock:
+            self.signaled = False
+            for pv_name in list(self.pending):
+                setting = self.settings.get(pv_name, {})
+                max_rate = setting.get('max_rate')
+                if max_rate and now - self.last_time.get(pv_name, -1e300) < 1.0/max_rate:
+                    continue
+                value = self.pending.pop(pv_name)
+                if self._changed(pv_name, value, setting.get('deadband')):
+                    values[pv_name] = value
+                    self.last_value[pv_name] = value
+                    self.last_time[pv_name] = now
+                else:
+                    self.suppressed += 1
+            self.published += len(values)
+        return values
+
+    def next_due(self, now):
+        """
+        returns delay in seconds until the next pending value can be published, None if there are no pending
+        values.
+        """
+        with self.lock:
+            delay = None
+            for pv_name in self.pending:
+                max_rate = self.settings.get(pv_name, {}).get('max_rate')
+                if max_rate:
+                    dt = self.last_time.get(pv_name, -1e300) + 1.0/max_rate - now
+                else:
+                    dt = 0.0
+                if delay is None or dt < delay:
+                    delay = dt
+            return delay
+
+    def stats(self):
+        """
+        returns queue depth (number of pending PVs), number of dropped stale updates, number of updates suppressed
+        by the deadband and number of published updates.
+        """
+        with self.lock:
+            return {'depth': len(self.pending),
+                    'dropped': self.dropped,
+                    'suppressed': self.suppressed,
+                    'published': self.published}
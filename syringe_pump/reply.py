@@ -0,0 +1,246 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Reply framing and parsing for the Cavro Centris DT protocol.
+
+Answer block (see section 3.2.2 of the Centris manual):
+
+    [0xFF] '/' '0' <status> <data> ETX(0x03) CR LF
+
+Status byte (section 3.6.1): bit 6 is always set, bit 5 is the ready flag
+(0 - busy, 1 - ready) and the lower four bits are the error code, e.g.
+'`' (0x60) - ready, no error; '@' (0x40) - busy, no error.
+
+parse_reply scans the reply once and fills a Reply record. The status byte is
+decoded with a precomputed 256-entry table and the data block is kept as a slice
+of the original buffer until the value is requested.
+
+Examples
+--------
+>>> from syringe_pump.reply import parse_reply
+>>> reply = parse_reply(b"\\xff/0`12.500\\x03\\r\\n")
+>>> reply.busy, reply.error, reply.value
+(False, <ErrorCode.NO_ERROR: 0>, b'12.500')
+>>> reply['error']
+'No Error'
+"""
+
+from enum import IntEnum
+
+
+class ErrorCode(IntEnum):
+    NO_ERROR = 0
+    INITIALIZATION_ERROR = 1
+    INVALID_COMMAND = 2
+    INVALID_OPERAND = 3
+    DEVICE_NOT_INITIALIZED = 7
+    INVALID_VALVE_CONFIGURATION = 8
+    PLUNGER_OVERLOAD = 9
+    VALVE_OVERLOAD = 10
+    PLUNGER_MOVE_NOT_ALLOWED = 11
+    EXTENDED_ERROR_PRESENT = 12
+    NVMEM_ACCESS_FAILURE = 13
+    COMMAND_BUFFER_EMPTY = 14
+    COMMAND_BUFFER_OVERFLOW = 15
+
+    @property
+    def description(self):
+        return ERROR_DESCRIPTIONS[self]
+
+
+ERROR_DESCRIPTIONS = {
+    ErrorCode.NO_ERROR: 'No Error',
+    ErrorCode.INITIALIZATION_ERROR: 'Initialization Error',
+    ErrorCode.INVALID_COMMAND: 'Invalid Command',
+    ErrorCode.INVALID_OPERAND: 'Invalid Operand',
+    ErrorCode.DEVICE_NOT_INITIALIZED: 'Device Not Initialized',
+    ErrorCode.INVALID_VALVE_CONFIGURATION: 'Invalid Valve Configuration',
+    ErrorCode.PLUNGER_OVERLOAD: 'Plunger Overload',
+    ErrorCode.VALVE_OVERLOAD: 'Valve Overload',
+    ErrorCode.PLUNGER_MOVE_NOT_ALLOWED: 'Plunger Move Not Allowed',
+    ErrorCode.EXTENDED_ERROR_PRESENT: 'Extended Error Present',
+    ErrorCode.NVMEM_ACCESS_FAILURE: 'Nvmem Access Failure',
+    ErrorCode.COMMAND_BUFFER_EMPTY: 'Command Buffer Empty or Not Ready',
+    ErrorCode.COMMAND_BUFFER_OVERFLOW: 'Command Buffer Overflow',
+}
+
+
+def _status_entry(byte):
+    """
+    returns (busy, error) for a status byte or (None, None) if the byte is not a valid status byte
+    """
+    if byte & 0xD0 != 0x40:
+        return (None, None)
+    try:
+        error = ErrorCode(byte & 0x0F)
+    except ValueError:
+        return (None, None)
+    return (not byte & 0x20, error)
+
+#status byte -> (busy, error)
+STATUS_TABLE = tuple(_status_entry(byte) for byte in range(256))
+
+
+class Reply(object):
+    """
+    parsed pump reply. Supports the dictionary access of the older driver versions: reply['value'],
+    reply['error_code'], reply['busy'] and reply['error'].
+    """
+    __slots__ = ('status', 'busy', 'error', '_data', '_start', '_end')
+    keys_ = ('value', 'error_code', 'busy', 'error')
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        """
+        resets the record to the 'no reply' state
+        """
+        self.status = None
+        self.busy = None
+        self.error = None
+        self._data = None
+        self._start = 0
+        self._end = 0
+
+    @property
+    def value(self):
+        """
+        data block of the reply as bytes
+        """
+        if self._data is None:
+            return None
+        return bytes(self._data[self._start:self._end])
+
+    @property
+    def value_view(self):
+        """
+        data block of the reply as memoryview of the original buffer (no copy)
+        """
+        if self._data is None:
+            return None
+        return memoryview(self._data)[self._start:self._end]
+
+    @property
+    def error_code(self):
+        """
+        status byte as one character bytes, e.g. b'`'
+        """
+        if self.status is None:
+            return None
+        return bytes((self.status,))
+
+    @property
+    def description(self):
+        """
+        error description as string
+        """
+        if self.status is None:
+            return 'no device found'
+        if self.error is None:
+            return None
+        return ERROR_DESCRIPTIONS[self.error]
+
+    def __getitem__(self, key):
+        if key == 'value':
+            return self.value
+        if key == 'error_code':
+            return self.error_code
+        if key == 'busy':
+            return self.busy
+        if key == 'error':
+            return self.description
+        raise KeyError(key)
+
+    def get(self, key, default = None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return self.keys_
+
+    def __repr__(self):
+        return repr({key: self[key] for key in self.keys_})
+
+
+def parse_reply(data, out = None):
+    """
+    parses raw pump reply in one scan.
+
+    Parameters
+    ----------
+    data: bytes or bytearray
+        raw reply, e.g. b"\\xff/0`0.000\\x03\\r\\n". The record keeps a reference to data, a bytearray should not
+        be reused while the record is in use.
+    out: Reply
+        optional record to fill in place
+
+    Returns
+    -------
+    reply: Reply
+
+    Examples
+    --------
+    >>> parse_reply(b"\\xff/0@\\x03\\r\\n")
+    {'value': b'', 'error_code': b'@', 'busy': True, 'error': 'No Error'}
+    """
+    if out is None:
+        out = Reply()
+    if not data:
+        out.clear()
+        return out
+    start = data.find(b'/0')
+    if start < 0 or start + 2 >= len(data):
+        out.clear()
+        return out
+    status = data[start + 2]
+    end = data.find(b'\x03', start + 3)
+    if end < 0:
+        end = len(data)
+    out.status = status
+    out.busy, out.error = STATUS_TABLE[status]
+    out._data = data
+    out._start = start + 3
+    out._end = end
+    return out
+
+
+def rejected_reply(error = ErrorCode.INVALID_OPERAND):
+    """
+    returns Reply for a command that the driver rejected before sending it to the pump. It looks like the reply of
+    a ready pump with the given error code (e.g. status byte b'c' for an invalid operand) and an empty data block.
+
+    Examples
+    --------
+    >>> rejected_reply()
+    {'value': b'', 'error_code': b'c', 'busy': False, 'error': 'Invalid Operand'}
+    """
+    out = Reply()
+    out.status = 0x60 | error
+    out.busy, out.error = STATUS_TABLE[out.status]
+    out._data = b''
+    return out
+
+
+class Status(object):
+    """
+    snapshot of the pump state collected by Driver.status(). Fields that were not queried are None.
+    """
+    __slots__ = ('time', 'position', 'busy', 'error', 'error_code', 'valve', 'speed')
+
+    def __init__(self):
+        self.time = None
+        self.position = None
+        self.busy = None
+        self.error = None
+        self.error_code = None
+        self.valve = None
+        self.speed = None
+
+    def as_dict(self):
+        return {key: getattr(self, key) for key in self.__slots__}
+
+    def __repr__(self):
+        return 'Status({})'.format(', '.join('{}={!r}'.format(key, getattr(self, key)) for key in self.__slots__))
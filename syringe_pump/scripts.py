@@ -19,10 +19,11 @@ def inject(pumpa, pumpf,tau = 1.0, flow = 0.01, fast_flow = 0.125, ratio = 2, N=
     1 mm of 250um ID capillary has 49 nL of fluid.
     """
     from time import sleep
+    from syringe_pump.group import PumpGroup
     flow_a = flow
     flow_f = flow*ratio
-    pumpf.flow(0,flow_f)
-    pumpa.flow(0,flow_a)
+    #both flows start back to back, so the mixing ratio is right from the start
+    PumpGroup([pumpf, pumpa]).flow([(0, flow_f), (0, flow_a)])
     sleep(5*N*0.049/(flow_f+flow_a))
     withdraw_speed = 1
     pumpa.flow(250, withdraw_speed)
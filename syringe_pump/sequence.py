@@ -0,0 +1,286 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Compound actions (prime, fill, empty, flow, create_low_pressure) as resumable
+sequences driven by one scheduler thread.
+
+A compound action is a generator of steps. Every step sends the commands of one
+stage (e.g. valve to input, plunger to zero) and yields a label; the sequence is
+resumed when the pump reports ready again. No thread is held while a pump is
+moving: one Scheduler advances the sequences of any number of pumps. The pump is
+checked when the motion model predicts the end of the move, every poll_period
+after that and immediately when the scan loop of the device sees the busy to
+ready transition, so there is no fixed 0.34 s dead time between the steps. A
+step that starts a program string on the pump yields its expected duration and
+the pump is not polled before that.
+
+A Sequence can be cancelled at any time; the step in progress is finished
+sending its commands and the remaining steps are dropped (Device.abort cancels
+the sequences of the device and stops the plunger). Progress is available from
+Sequence.as_dict() and is passed to the on_progress callback after every step.
+A sequence fails (state 'error') if the pump does not reply to the ready check
+for no_reply_timeout seconds or if the check raises an exception; the
+sequences of the other pumps on the scheduler are not affected.
+
+Examples
+--------
+>>> sequence = device.prime(N = 5, wait = False)
+>>> sequence.as_dict()
+{'name': 'prime', 'state': 'running', 'step': 1, 'steps': 1, 'label': 'prime program', 'progress': 0.0}
+>>> sequence.cancel()
+>>> sequence.wait()
+'cancelled'
+"""
+
+from threading import Condition, Event, Lock, Thread
+from logging import debug,info,warning,error
+import traceback
+
+from syringe_pump.clock import real_clock
+
+
+class Sequence(object):
+
+    def __init__(self, device, steps, name = '', total = None, on_progress = None, poll_period = 0.05,
+                 wait_ready = True, no_reply_timeout = 5.0):
+        """
+        Parameters
+        ----------
+        device: Device
+            pump, used for the ready check (device.get_busy()) and the predicted arrival (device.trajectory)
+        steps: generator
+            yields a label after sending the commands of every step, or (label, expected duration in seconds) to
+            skip the ready checks before the step can be finished
+        name: string
+        total: integer
+            expected number of steps, for the progress
+        on_progress: callable
+            called with the sequence after every step and when it finishes
+        poll_period: float
+            period of the ready check while the pump is busy, seconds
+        wait_ready: boolean
+            run the first step only when the pump is ready, otherwise right away (e.g. if the first step stops the
+            plunger)
+        no_reply_timeout: float
+            the sequence fails if the pump does not reply to the ready check for this long, seconds
+        """
+        self.device = device
+        self.steps = steps
+        self.name = name
+        self.total = total
+        self.on_progress = on_progress
+        self.poll_period = poll_period
+        self.no_reply_timeout = no_reply_timeout
+        self.no_reply_since = None #time of the first ready check without a reply
+        self.lock = Lock()
+        self.finished = Event()
+        self.state = 'running'
+        self.step = 0 #number of steps started
+        self.label = ''
+        self.error = None
+        self.cancel_requested = False
+        #the commands of the current step were sent (or the first step waits), the pump has not reported ready yet
+        self.waiting = wait_ready
+        self.next_check = 0.0
+        self.scheduler = None
+
+    @property
+    def progress(self):
+        """
+        fraction of the finished steps
+        """
+        if self.state == 'done':
+            return 1.0
+        done = self.step - 1 if self.waiting and self.step else self.step
+        if not self.total:
+            return 0.0
+        return min(1.0, done/float(self.total))
+
+    def as_dict(self):
+        return {'name': self.name,
+                'state': self.state,
+                'step': self.step,
+                'steps': self.total,
+                'label': self.label,
+                'progress': round(self.progress, 2)}
+
+    def cancel(self):
+        """
+        drops the remaining steps. Returns after the commands of the step in progress (if any) were sent, the
+        motion is not stopped.
+        """
+        with self.lock:
+            if self.finished.is_set():
+                return
+            self.cancel_requested = True
+        if self.scheduler is not None:
+            self.scheduler.wake()
+
+    def wait(self, timeout = None):
+        """
+        waits for the end of the sequence and returns its state: 'done', 'cancelled' or 'error'
+        """
+        self.finished.wait(timeout)
+        return self.state
+
+    def finish(self, state):
+        self.state = state
+        self.waiting = False
+        self.finished.set()
+        self.report()
+
+    def fail(self, exception):
+        """
+        finishes the sequence with state 'error', e.g. after an exception in the scheduler
+        """
+        if self.finished.is_set():
+            return
+        self.error = exception
+        self.finish('error')
+
+    def report(self):
+        if self.on_progress is not None:
+            try:
+                self.on_progress(self)
+            except Exception:
+                error(f'progress callback of {self.name} failed: {traceback.format_exc()}')
+
+    def advance(self, now, force = False):
+        """
+        checks the pump and runs the next step if the pump is ready. Called by the scheduler when next_check is due
+        (or force is True).
+
+        Returns
+        -------
+        finished: boolean
+        """
+        with self.lock:
+            if self.finished.is_set():
+                return True
+            if self.cancel_requested:
+                self.steps.close()
+                self.finish('cancelled')
+                return True
+            if not force and now < self.next_check:
+                return False
+            if self.waiting:
+                busy = self.device.get_busy()
+                if busy is None:
+                    if self.no_reply_since is None:
+                        self.no_reply_since = now
+                    elif now - self.no_reply_since >= self.no_reply_timeout:
+                        error(f'{self.name}: no reply from the pump for {now - self.no_reply_since:.1f} s')
+                        self.fail(RuntimeError('no reply from the pump for {:.1f} s'.format(
+                            now - self.no_reply_since)))
+                        return True
+                else:
+                    self.no_reply_since = None
+                if busy is not False:
+                    self.next_check = now + self.poll_period
+                    return False
+                self.waiting = False
+            try:
+                label = next(self.steps)
+            except StopIteration:
+                self.finish('done')
+                return True
+            except Exception as exception:
+                error(f'{self.name} failed at step {self.step + 1}: {traceback.format_exc()}')
+                self.error = exception
+                self.finish('error')
+                return True
+            duration = 0.0
+            if isinstance(label, tuple):
+                label, duration = label
+            self.step += 1
+            self.label = label
+            self.waiting = True
+            self.next_check = now + (duration if duration > self.poll_period else self.poll_period)
+            arrival = self.device.trajectory.arrival()
+            if arrival is not None and arrival > self.next_check:
+                self.next_check = arrival
+        self.report()
+        return False
+
+
+class Scheduler(object):
+
+    def __init__(self, clock = None):
+        """
+        Parameters
+        ----------
+        clock: object
+            time and sleep provider, see syringe_pump.clock
+        """
+        self.clock = clock if clock is not None else real_clock
+        self.sequences = []
+        self.condition = Condition()
+        self.woken = False
+        self.thread = None
+
+    def start(self, sequence):
+        """
+        adds sequence; its first step is run by the scheduler thread right away
+        """
+        sequence.scheduler = self
+        with self.condition:
+            self.sequences.append(sequence)
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = Thread(target = self.run, name = 'Scheduler', daemon = True)
+                self.thread.start()
+            self.woken = True
+            self.condition.notify()
+        return sequence
+
+    def wake(self):
+        """
+        checks all sequences right away, e.g. after a busy to ready transition or a cancel
+        """
+        with self.condition:
+            self.woken = True
+            self.condition.notify()
+
+    def active(self):
+        with self.condition:
+            return list(self.sequences)
+
+    def run(self):
+        while True:
+            with self.condition:
+                while len(self.sequences) == 0:
+                    self.condition.wait()
+                force = self.woken
+                self.woken = False
+                sequences = list(self.sequences)
+            for sequence in sequences:
+                try:
+                    finished = sequence.advance(self.clock.time(), force = force)
+                except Exception as exception:
+                    #e.g. the ready check of a disconnected pump; the sequences of the other pumps go on
+                    error(f'{sequence.name} failed: {traceback.format_exc()}')
+                    sequence.fail(exception)
+                    finished = True
+                if finished:
+                    with self.condition:
+                        self.sequences.remove(sequence)
+            with self.condition:
+                if self.woken or len(self.sequences) == 0:
+                    continue
+                timeout = min(sequence.next_check for sequence in self.sequences) - self.clock.time()
+                if timeout > 0:
+                    self.clock.wait(self.condition, timeout = timeout)
+
+
+_scheduler = None
+_scheduler_lock = Lock()
+
+def shared_scheduler():
+    """
+    returns Scheduler shared by all devices that use the system clock. It is created on the first call under a
+    lock, because the first compound commands can come from several device threads at once.
+    """
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = Scheduler()
+        return _scheduler
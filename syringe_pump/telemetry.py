@@ -0,0 +1,280 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Telemetry recorder for the syringe pump.
+
+Every status poll is recorded as one sample of a structured numpy array with the
+fields time, position, busy, valve, speed, error_code and latency. The ring is
+preallocated and each sample is written twice, at index i and i + length, so the
+last N samples always form one contiguous slice of the storage. As a result all
+bulk reads (last N samples, last N seconds) are views of the storage and never
+copies. Appending a sample writes the fields in place and allocates no arrays.
+
+Examples
+--------
+>>> from syringe_pump.telemetry import Telemetry
+>>> telemetry = Telemetry(length = 3600)
+>>> telemetry.append(t = time(), position = 25.0, busy = True, valve = b'o', speed = 1.0, error_code = b'@',
+...                  latency = 0.012)
+>>> telemetry.last_seconds(60)['position']
+array([25.])
+>>> telemetry.history(window = 3600, bins = 500).shape
+(1, 2)
+"""
+
+from numpy import dtype, zeros, nan, searchsorted, linspace, flatnonzero, diff, fmin, fmax, empty, r_, repeat, \
+    where
+
+TELEMETRY_DTYPE = dtype([('time', 'f8'),
+                         ('position', 'f8'),
+                         ('busy', 'i1'), #1 - busy, 0 - ready, -1 - unknown
+                         ('valve', 'S1'),
+                         ('speed', 'f8'),
+                         ('error_code', 'u1'), #status byte, 0 if there was no reply
+                         ('latency', 'f8'), #duration of the status query in seconds
+                         ])
+
+
+class Telemetry(object):
+
+    def __init__(self, length = 7200):
+        """
+        Parameters
+        ----------
+        length: integer
+            number of samples kept in the ring
+        """
+        self.length = length
+        self.data = zeros(2*length, dtype = TELEMETRY_DTYPE)
+        for name in ('time', 'position', 'speed', 'latency'):
+            self.data[name] = nan
+        self.data['busy'] = -1
+        self.pointer = -1 #index of the last written sample
+        self.g_pointer = -1 #global number of the last written sample
+        #column views, created once so that append() does not create them for every sample
+        self._time = self.data['time']
+        self._position = self.data['position']
+        self._busy = self.data['busy']
+        self._valve = self.data['valve']
+        self._speed = self.data['speed']
+        self._error_code = self.data['error_code']
+        self._latency = self.data['latency']
+
+    def append(self, t, position, busy, valve, speed, error_code, latency):
+        """
+        writes one sample in place.
+
+        Parameters
+        ----------
+        t: float
+        position: float
+        busy: boolean
+            or None if unknown
+        valve: bytes or string
+            'i', 'o', 'b' or '' if unknown
+        speed: float
+        error_code: bytes
+            status byte of the reply or None
+        latency: float
+        """
+        p = self.pointer + 1
+        if p == self.length:
+            p = 0
+        q = p + self.length
+        if busy is None:
+            busy = -1
+        if isinstance(valve, str):
+            valve = valve.encode('Latin-1')
+        error_code = error_code[0] if error_code else 0
+        self._time[p] = self._time[q] = t
+        self._position[p] = self._position[q] = position
+        self._busy[p] = self._busy[q] = busy
+        self._valve[p] = self._valve[q] = valve
+        self._speed[p] = self._speed[q] = speed
+        self._error_code[p] = self._error_code[q] = error_code
+        self._latency[p] = self._latency[q] = latency
+        self.pointer = p
+        self.g_pointer += 1
+
+    def __len__(self):
+        if self.g_pointer + 1 < self.length:
+            return self.g_pointer + 1
+        return self.length
+
+    def last_N(self, N):
+        """
+        returns view of the last N samples (fewer if fewer were recorded), oldest first.
+
+        Parameters
+        ----------
+        N: integer
+
+        Returns
+        -------
+        samples: numpy structured array
+            view of the storage
+
+        Examples
+        --------
+        >>> telemetry.last_N(2)['position']
+        array([24.5, 25. ])
+        """
+        if N > len(self):
+            N = len(self)
+        end = self.pointer + 1 + self.length
+        return self.data[end - N:end]
+
+    def since(self, g_pointer):
+        """
+        returns copy of the samples recorded after the sample with global number g_pointer and the global number of
+        the last of them. At most length - 1 samples are returned, the oldest are dropped. Safe to call from
+        another thread while append() is running: g_pointer is read once (it is incremented only after the sample
+        is written) and the samples overwritten by append() during the copy are dropped, so the result is always in
+        time order.
+
+        Parameters
+        ----------
+        g_pointer: integer
+            global number of the last sample already seen, -1 for none
+
+        Returns
+        -------
+        samples: numpy structured array
+            copy of the samples
+        last: integer
+            global number of the last returned sample
+
+        Examples
+        --------
+        >>> samples, last = telemetry.since(last)
+        """
+        last = self.g_pointer
+        N = last - g_pointer
+        if N > self.length - 1:
+            N = self.length - 1
+        if N <= 0:
+            return self.data[0:0].copy(), last
+        end = last % self.length + 1 + self.length
+        samples = self.data[end - N:end].copy()
+        #every append() since reading last (and the one in progress) overwrote the oldest sample of the window
+        overwritten = self.g_pointer - last + 1 - (self.length - N)
+        if overwritten > 0:
+            samples = samples[overwritten:]
+        return samples, last
+
+    def last_seconds(self, dt, now = None):
+        """
+        returns view of the samples recorded during the last dt seconds before now (default the last sample time).
+
+        Parameters
+        ----------
+        dt: float
+        now: float
+
+        Returns
+        -------
+        samples: numpy structured array
+            view of the storage
+        """
+        samples = self.last_N(self.length)
+        if len(samples) == 0:
+            return samples
+        if now is None:
+            now = samples['time'][-1]
+        start = searchsorted(samples['time'], now - dt, side = 'left')
+        return samples[start:]
+
+    def history(self, window = None, N = None, bins = None, field = 'position'):
+        """
+        returns (time, value) history of the last window seconds or the last N samples, decimated to at most bins
+        min/max pairs.
+
+        Parameters
+        ----------
+        window: float
+            time window in seconds, all recorded samples if None
+        N: integer
+            number of samples, used if window is None
+        bins: integer
+            number of bins for min/max decimation, no decimation if None or 0
+        field: string
+            telemetry field
+
+        Returns
+        -------
+        history: numpy array
+            shape (n, 2), columns time and value
+        """
+        if window is not None:
+            samples = self.last_seconds(window)
+        elif N is not None:
+            samples = self.last_N(N)
+        else:
+            samples = self.last_N(self.length)
+        return minmax_decimate(samples['time'], samples[field], bins)
+
+
+def minmax_decimate(t, values, bins):
+    """
+    decimates time series to the minimum and maximum value in each of bins equal time bins. Every non-empty bin
+    gives two points, the minimum and the maximum at the times they occurred, in time order, so a falling trace
+    stays falling. nan values are ignored (a bin of nan values gives its first and last sample). If there are no
+    more than 2*bins samples, the series is returned as is.
+
+    Parameters
+    ----------
+    t: numpy array
+        sample times, non-decreasing
+    values: numpy array
+    bins: integer
+
+    Returns
+    -------
+    history: numpy array
+        shape (n, 2), columns time and value
+
+    Examples
+    --------
+    >>> minmax_decimate(t = arange(10.0), values = arange(10.0), bins = 2)
+    array([[0., 0.],
+           [4., 4.],
+           [5., 5.],
+           [9., 9.]])
+    """
+    n = len(t)
+    if not bins or n <= 2*bins:
+        result = empty((n, 2))
+        result[:, 0] = t
+        result[:, 1] = values
+        return result
+    edges = linspace(t[0], t[-1], bins + 1)
+    index = searchsorted(edges, t, side = 'right') - 1
+    index[index >= bins] = bins - 1
+    starts = flatnonzero(r_[True, diff(index) != 0])
+    ends = r_[starts[1:], n] - 1
+    counts = ends - starts + 1
+    first = _first_in_bins(values == repeat(fmin.reduceat(values, starts), counts), starts, ends)
+    last = _first_in_bins(values == repeat(fmax.reduceat(values, starts), counts), starts, ends, default = ends)
+    earlier = where(first <= last, first, last)
+    later = where(first <= last, last, first)
+    result = empty((2*len(starts), 2))
+    result[0::2, 0] = t[earlier]
+    result[0::2, 1] = values[earlier]
+    result[1::2, 0] = t[later]
+    result[1::2, 1] = values[later]
+    return result
+
+
+def _first_in_bins(mask, starts, ends, default = None):
+    """
+    returns index of the first True element of mask in every bin starts[i]..ends[i], default[i] (or starts[i]) if
+    there is none
+    """
+    hits = flatnonzero(mask)
+    if default is None:
+        default = starts
+    if len(hits) == 0:
+        return default.copy()
+    position = searchsorted(hits, starts)
+    index = hits[where(position < len(hits), position, len(hits) - 1)]
+    return where((position < len(hits)) & (index <= ends), index, default)
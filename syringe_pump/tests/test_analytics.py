@@ -0,0 +1,35 @@
+from numpy import arange, array, full, r_, isnan
+
+from syringe_pump.analytics import flow_rates, windowed_rate, delivered_volume, speed_deviation, stalls, summarize
+
+
+def test_flow_rate_and_volume():
+    "Check that a dispense at 0.5 uL/s followed by an aspiration gives the rates and the volumes."
+    t = arange(10.0)
+    position = r_[10.0 - 0.5*arange(6.0), 7.5, 8.5, 9.5, 10.5]
+    rate = flow_rates(t, position)
+    assert list(rate[:5]) == [0.5]*5
+    assert list(rate[-3:]) == [-1.0]*3
+    assert windowed_rate(t[:6], position[:6]) == 0.5
+    assert delivered_volume(position) == (2.5, 3.0)
+    assert isnan(flow_rates(array([1.0, 1.0]), array([1.0, 2.0]))[0])
+    assert isnan(windowed_rate(t[:1], position[:1]))
+
+
+def test_speed_deviation_and_stall():
+    "Check that a plunger 10% slower than commanded and a plunger that stops while busy are detected."
+    t = arange(20.0)
+    position = r_[20.0 - 0.9*arange(10.0), full(10, 20.0 - 0.9*9)]
+    busy = full(20, 1)
+    speed = full(20, 1.0)
+    assert abs(speed_deviation(t[:10], position[:10], busy[:10], speed[:10]) + 0.1) < 1e-9
+    intervals = stalls(t, position, busy, speed)
+    assert intervals.tolist() == [[9.0, 19.0]]
+    #a short stop (valve move) and an idle pump are not stalls
+    assert len(stalls(t[8:11], position[8:11], busy[8:11], speed[8:11])) == 0
+    busy[10:] = 0
+    assert len(stalls(t, position, busy, speed)) == 0
+    result = summarize(t, position, full(20, 1), speed)
+    assert result['stalled'] and result['stalls'] == 1
+    assert result['flow_rate'] == 0.0
+    assert abs(result['dispensed'] - 8.1) < 1e-9
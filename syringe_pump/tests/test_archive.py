@@ -0,0 +1,70 @@
+from numpy import memmap
+
+from syringe_pump.telemetry import Telemetry
+from syringe_pump.archive import Archive, ArchiveWriter
+
+
+def fill(telemetry, start, N):
+    for i in range(start, start + N):
+        telemetry.append(t = float(i), position = 0.5*i, busy = i % 2 == 0, valve = 'o', speed = 1.0,
+                         error_code = b'`', latency = 0.01)
+
+
+def test_segments_and_range_reads(tmp_path):
+    ("Check that samples are split into segments, that range reads return memory-mapped views and that the "
+     "archive is reopened from disk.")
+    telemetry = Telemetry(length = 100)
+    archive = Archive(str(tmp_path), segment_duration = 10.0, retention = None)
+    fill(telemetry, 0, 25)
+    samples, last = telemetry.since(-1)
+    assert last == 24 and len(samples) == 25
+    archive.append(samples)
+    assert [segment.start for segment in archive.segments] == [0.0, 10.0, 20.0]
+    chunks = archive.chunks(start = 5.0, end = 12.0, fields = ('position',))
+    assert [list(chunk['position']) for chunk in chunks] == [[2.5, 3.0, 3.5, 4.0, 4.5], [5.0, 5.5]]
+    assert isinstance(chunks[0]['position'].base, memmap)
+    archive.close()
+    archive = Archive(str(tmp_path), segment_duration = 10.0, retention = None)
+    data = archive.read(start = 8.0, end = 22.0)
+    assert list(data['time']) == [float(i) for i in range(8, 22)]
+    assert list(data['busy'][:2]) == [1, 0]
+    assert len(archive.read(start = 100.0)['time']) == 0
+
+
+def test_retention(tmp_path):
+    "Check that the segments older than the retention period are deleted."
+    telemetry = Telemetry(length = 100)
+    archive = Archive(str(tmp_path), segment_duration = 10.0, retention = 15.0)
+    fill(telemetry, 0, 50)
+    archive.append(telemetry.since(-1)[0])
+    assert [segment.start for segment in archive.segments] == [30.0, 40.0]
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['30', '40']
+    assert archive.read()['time'][0] == 30.0
+
+
+def test_writer(tmp_path):
+    "Check that the writer thread archives new samples only once and flushes the rest when stopped."
+    telemetry = Telemetry(length = 10)
+    fill(telemetry, 0, 3)
+    archive = Archive(str(tmp_path), segment_duration = 100.0, retention = None)
+    writer = ArchiveWriter(telemetry, archive, period = 60.0)
+    fill(telemetry, 3, 4)
+    writer.flush()
+    fill(telemetry, 7, 15)
+    writer.stop()
+    assert writer.written == 13 and writer.lost == 6
+    data = archive.read()
+    assert list(data['time'][:4]) == [3.0, 4.0, 5.0, 6.0]
+    assert list(data['time'][4:]) == [float(i) for i in range(13, 22)]
+
+
+def test_since_returns_ordered_copy():
+    ("Check that the samples handed to the archive are a time-ordered copy that stays valid while the ring is "
+     "overwritten.")
+    telemetry = Telemetry(length = 10)
+    fill(telemetry, 0, 25)
+    samples, last = telemetry.since(-1)
+    assert last == 24 and list(samples['time']) == [float(i) for i in range(16, 25)]
+    fill(telemetry, 25, 5)
+    assert list(samples['time']) == [float(i) for i in range(16, 25)]
+    assert len(telemetry.since(last)[0]) == 5 and len(telemetry.since(29)[0]) == 0
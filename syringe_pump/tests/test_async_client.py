@@ -0,0 +1,65 @@
+import asyncio
+
+from syringe_pump.async_client import AsyncPump, AsyncPumps
+
+
+def test_done_needs_target():
+    "Check that a stale DMOV does not end the wait before the readback reaches the target."
+    pump = AsyncPump('TEST:SYRINGE1.')
+    pump.values = {'DMOV': 1, 'RBV': 100.0}
+    assert pump.done()
+    pump.target = 50.0
+    assert not pump.done()
+    pump.values['RBV'] = 50.001
+    assert pump.done()
+    pump.values['DMOV'] = 0
+    assert not pump.done()
+
+
+def test_wait_done_wakes_on_update():
+    "Check that wait_done returns on the monitor update that completes the move."
+    class Subscription(object):
+        class pv(object):
+            name = 'TEST:SYRINGE1.DMOV'
+
+    async def main():
+        pump = AsyncPump('TEST:SYRINGE1.')
+        pump.changed = asyncio.Condition()
+        pump.names = {'TEST:SYRINGE1.DMOV': 'DMOV'}
+        pump.values = {'DMOV': 0}
+        waiter = asyncio.ensure_future(pump.wait_done(timeout = 1))
+        await asyncio.sleep(0.01)
+        assert not waiter.done()
+
+        class Response(object):
+            data = [1]
+            data_type = None
+        await pump._on_update(Subscription(), Response())
+        await waiter
+
+    asyncio.run(main())
+
+
+def test_gather_fans_out():
+    "Check that AsyncPumps calls every pump concurrently with its own arguments."
+    calls = []
+
+    class Pump(object):
+        async def flow(self, position, speed):
+            calls.append((position, speed))
+            await asyncio.sleep(0.05)
+            return position
+
+    pumps = AsyncPumps(['a', 'b'])
+    pumps.pumps = {'a': Pump(), 'b': Pump()}
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        t = loop.time()
+        result = await pumps.flow({'a': (0, 0.1), 'b': (25, 0.2)})
+        return result, loop.time() - t
+
+    result, dt = asyncio.run(main())
+    assert result == {'a': 0, 'b': 25}
+    assert sorted(calls) == [(0, 0.1), (25, 0.2)]
+    assert dt < 0.09
@@ -0,0 +1,69 @@
+import asyncio
+import os
+import pty
+import threading
+import tty
+
+from syringe_pump.async_driver import AsyncDriver
+
+
+def test_query_over_pty():
+    "Check that AsyncDriver completes a query through the event loop reader callback."
+    master, slave = pty.openpty()
+    tty.setraw(slave)
+
+    def responder():
+        command = b''
+        while not command.endswith(b'\r'):
+            command += os.read(master, 100)
+        assert command == b'/1?18\r'
+        os.write(master, b'\xff/0`12.500\x03\r\n')
+
+    thread = threading.Thread(target = responder, daemon = True)
+    thread.start()
+
+    async def main():
+        driver = AsyncDriver()
+        driver.open(os.ttyname(slave))
+        try:
+            return await driver._get_position()
+        finally:
+            driver.close()
+
+    reply = asyncio.run(main())
+    thread.join(1)
+    os.close(master)
+    os.close(slave)
+    assert reply['value'] == b'12.500'
+    assert reply['busy'] is False
+
+
+def test_lost_port_fails_query():
+    ("Check that a query fails and the driver is closed when the device goes away, instead of the reader spinning"
+     " on the dead descriptor.")
+    master, slave = pty.openpty()
+    tty.setraw(slave)
+
+    def responder():
+        command = b''
+        while not command.endswith(b'\r'):
+            command += os.read(master, 100)
+        os.close(master)
+
+    thread = threading.Thread(target = responder, daemon = True)
+    thread.start()
+
+    async def main():
+        driver = AsyncDriver()
+        driver.open(os.ttyname(slave))
+        try:
+            await driver._get_position()
+        except OSError as exception:
+            return exception, driver
+        return None, driver
+
+    exception, driver = asyncio.run(main())
+    thread.join(1)
+    os.close(slave)
+    assert isinstance(exception, OSError)
+    assert driver.port is None and driver.fd is None
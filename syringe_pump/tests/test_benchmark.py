@@ -0,0 +1,18 @@
+import json
+
+from syringe_pump.benchmark import run_benchmarks, compare, QUERY_COMMANDS
+
+
+def test_benchmarks_are_machine_readable():
+    "Check that a short benchmark run against the simulator gives JSON results and compare() finds regressions."
+    results = run_benchmarks(N = 5, duration = 0.2, latency = 0.0, baudrate = 0, ioc = False)
+    results = json.loads(json.dumps(results))
+    assert set(results['query']) == set(QUERY_COMMANDS)
+    assert all(summary['n'] == 5 for summary in results['query'].values())
+    assert results['run_once']['n'] == 5
+    assert results['throughput']['4']['pumps'] == 4 and results['throughput']['4']['rate'] > 0
+    assert compare(results, results) == []
+    slower = json.loads(json.dumps(results))
+    slower['run_once']['median'] *= 2
+    slower['throughput']['1']['rate'] /= 2
+    assert len(compare(results, slower)) == 2
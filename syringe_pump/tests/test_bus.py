@@ -0,0 +1,43 @@
+import os
+import pty
+import threading
+import tty
+
+from syringe_pump.bus import Bus, address_char
+
+
+def test_address_char():
+    "Check that address switch positions map onto the ASCII address characters."
+    assert address_char(0) == b'1'
+    assert address_char(14) == b'?'
+    assert address_char('2') == b'2'
+
+
+def test_scan_shared_port():
+    "Check that one bus finds two pumps with different addresses on one port."
+    master, slave = pty.openpty()
+    tty.setraw(slave)
+    ids = {b'/1?80': b'1', b'/3?80': b'4'}
+
+    def responder():
+        buffer = b''
+        while True:
+            try:
+                buffer += os.read(master, 100)
+            except OSError:
+                return
+            while b'\r' in buffer:
+                command, buffer = buffer.split(b'\r', 1)
+                if command in ids:
+                    os.write(master, b'\xff/0`ZA' + ids[command] + b'\x03\r\n')
+
+    threading.Thread(target = responder, daemon = True).start()
+    bus = Bus()
+    bus.open(os.ttyname(slave))
+    assert bus.scan(range(4), timeout = 0.05) == {1: b'1', 4: b'3'}
+    driver = bus.get_driver(4)
+    assert driver.header == b'/3'
+    assert driver.port is bus.port and driver.lock is bus.lock
+    bus.close()
+    os.close(master)
+    os.close(slave)
@@ -0,0 +1,59 @@
+import pytest
+
+from syringe_pump import commands
+from syringe_pump.commands import CommandBuilder, format_number
+
+
+def test_format_number():
+    "Check number formatting with up to 3 decimal places."
+    assert format_number(25) == b'25.0'
+    assert format_number(0.1) == b'0.1'
+    assert format_number(100.12549) == b'100.125'
+
+
+def test_encode():
+    "Check encoded frames and the encoder cache."
+    assert commands.encode_move_abs(b'1', 100, 25) == b'/1V25.0,1A100.0,1R\r'
+    assert commands.encode_load_move_abs(b'2', 0, 0.1) == b'/2V0.1,1A0.0,1\r'
+    assert commands.encode_execute(b'2') == b'/2R\r'
+    assert commands.encode_set_speed(b'2', 0.5, True) == b'/2V0.5,1F\r'
+    assert commands.encode_home(b'1', 'Z', 100) == b'/1Z7,0,0IV25.0,1K100A0.0,1R\r'
+    assert commands.encode_home(b'1', 'Y') == b'/1Y7,0,0IV25.0,1A0.0,1R\r'
+    assert CommandBuilder(b'1').valve('i').absolute(0).frame(execute = b'') == b'/1IA0.0,1\r'
+    hits = commands.encode_move_abs.cache_info().hits
+    commands.encode_move_abs(b'1', 100, 25)
+    assert commands.encode_move_abs.cache_info().hits == hits + 1
+
+
+def test_invalid_operands():
+    "Check that bad operands are rejected before they are sent."
+    with pytest.raises(ValueError):
+        commands.encode_move_abs(b'1', 300, 25)
+    with pytest.raises(ValueError):
+        commands.encode_move_abs(b'1', float('nan'), 25)
+    with pytest.raises(ValueError):
+        commands.encode_set_speed(b'1', 0)
+    with pytest.raises(ValueError):
+        commands.encode_backlash(b'1', 5000)
+    with pytest.raises(ValueError):
+        commands.encode_valve(b'1', 'x')
+    with pytest.raises(ValueError):
+        commands.encode_home(b'1', 'X')
+
+
+def test_programs():
+    "Check the compound programs, loop nesting and the command buffer limit."
+    assert commands.encode_prime(b'1', 5, restore_speed = 25) == b'/1V68.0,1IgA0.0,1A250.0,1G5V25.0,1OR\r'
+    assert commands.encode_fill(b'1', 100) == b'/1V100.0,1IA0.0,1A100.0,1OR\r'
+    assert commands.encode_empty(b'3', restore_speed = 1) == b'/3V100.0,1IA0.0,1V1.0,1OR\r'
+    with pytest.raises(ValueError):
+        CommandBuilder(b'1').loop().absolute(0).frame()
+    with pytest.raises(ValueError):
+        CommandBuilder(b'1').absolute(0).repeat(2)
+    with pytest.raises(ValueError):
+        commands.encode_prime(b'1', 30001)
+    builder = CommandBuilder(b'1')
+    for i in range(30):
+        builder.absolute(100.125).absolute(0)
+    with pytest.raises(ValueError):
+        builder.frame()
@@ -0,0 +1,101 @@
+from time import sleep, time
+
+from syringe_pump.device import Device
+from syringe_pump.reply import Status
+from syringe_pump.telemetry import Telemetry
+
+
+class Driver(object):
+    "Pump driver replaced by a fixed idle reply, the scan loop is tested without a serial port."
+
+    def __init__(self):
+        self.polls = []
+
+    def status(self, valve = True, speed = True):
+        self.polls.append(time())
+        status = Status()
+        status.time = time()
+        status.position = 0.0
+        status.busy = False
+        status.error = 'No Error'
+        return status
+
+
+def test_wake_interrupts_idle_scan():
+    "Check that an idle device backs off to the default period and wake() starts a scan right away."
+    from circular_buffer_numpy.circular_buffer import CircularBuffer
+    device = Device()
+    device.driver = Driver()
+    device.buffers = {'position': CircularBuffer(shape = (100,2), dtype = 'float64')}
+    device.telemetry = Telemetry(length = 100)
+    device.cmd_position = 0.0
+    device.default_scan_period = 0.2
+    device.start()
+    sleep(0.5)
+    assert device.scan_period == 0.2
+    n = len(device.driver.polls)
+    t = time()
+    device.wake()
+    sleep(0.05)
+    device.stop()
+    assert len(device.driver.polls) > n
+    assert device.driver.polls[n] - t < 0.05
+    metrics = device.scan_metrics()
+    assert metrics['latency_count'] == 1
+    assert metrics['latency_max'] < 0.05
+
+
+def test_prime_on_virtual_clock():
+    "Check that a compound protocol runs against the simulator in virtual time."
+    from syringe_pump.clock import VirtualClock
+    from syringe_pump import mock_driver
+    clock = VirtualClock(start = 1000.0)
+    simulator = mock_driver.Simulator(clock = clock)
+    simulator.open()
+    device = Device(clock = clock)
+    device.init(pump_id = 1, speed = 25, backlash = 100, orientation = 'Y', volume = 250,
+                driver = mock_driver.Driver(simulator))
+    t = time()
+    start = clock.time()
+    device.prime(N = 5)
+    device.wait()
+    #nine full strokes at 68 uL/s, the plunger is at zero after init
+    assert clock.time() - start > 9*250/68.0
+    assert time() - t < 5.0
+    #one program string and a few ready checks, no command per stroke
+    assert simulator.commands < 40
+    assert device.get_position() == 250.0
+    assert device.get_valve() == b'o'
+    device.driver.port.close()
+    simulator.close()
+
+
+def test_flow_analytics_on_virtual_clock():
+    "Check that the flow analytics of the device report the rate and the volume of a move."
+    from syringe_pump.clock import VirtualClock
+    from syringe_pump import mock_driver
+    clock = VirtualClock(start = 1000.0)
+    simulator = mock_driver.Simulator(clock = clock)
+    simulator.open()
+    device = Device(clock = clock)
+    device.init(pump_id = 1, speed = 25, backlash = 100, orientation = 'Y', volume = 250,
+                driver = mock_driver.Driver(simulator))
+    device.wait()
+    device.move_abs(position = 20.0, speed = 25.0)
+    device.wait()
+    start = clock.time()
+    device.get_position()
+    device.move_abs(position = 15.0, speed = 2.0)
+    while clock.time() - start < 2.0:
+        device.get_position()
+        clock.sleep(0.2)
+    analytics = device.flow_analytics(window = 1.5)
+    assert abs(analytics['flow_rate_window'] - 2.0) < 0.05
+    assert abs(analytics['speed_deviation']) < 0.05
+    assert not analytics['stalled']
+    device.wait()
+    device.get_position()
+    dispensed, aspirated = device.delivered_volume(start = start)
+    assert abs(dispensed - 5.0) < 0.01 and aspirated == 0.0
+    device.driver.port.close()
+    simulator.close()
@@ -0,0 +1,91 @@
+from numpy import array
+from caproto import ChannelType
+
+from syringe_pump.device_client import response_value
+
+
+class Response(object):
+    def __init__(self, data, data_type):
+        self.data = data
+        self.data_type = data_type
+
+
+def test_response_value():
+    "Check that Channel Access responses are converted to scalars and strings."
+    assert response_value(Response(array([12.5]), ChannelType.TIME_DOUBLE)) == 12.5
+    assert type(response_value(Response(array([1]), ChannelType.TIME_LONG))) is int
+    assert response_value(Response(array([111, 0], dtype = 'uint8'), ChannelType.TIME_CHAR)) == 'o'
+    assert response_value(Response([b'busy'], ChannelType.TIME_STRING)) == 'busy'
+    assert len(response_value(Response(array([1.0, 2.0]), ChannelType.TIME_DOUBLE))) == 2
+
+
+class PV(object):
+    "Channel that counts the reads."
+
+    def __init__(self, value):
+        self.value = value
+        self.connected = True
+        self.reads = 0
+
+    def read(self, data_type = None):
+        self.reads += 1
+        response = Response(array([self.value]), ChannelType.TIME_DOUBLE)
+        response.metadata = None
+        return response
+
+
+def test_cache_age_and_connection():
+    ("Check that cached values are reused until max_age, always for subscribed PVs, and never for a disconnected "
+     "PV.")
+    from syringe_pump.device_client import Client
+    client = Client.__new__(Client)
+    from threading import Lock
+    client.lock = Lock()
+    client.cache = {}
+    client.subscriptions = {}
+    client.pvs = {'RBV': PV(1.5), 'VAL': PV(2.0)}
+    assert client.get('RBV') == 1.5 and client.get('RBV') == 1.5
+    assert client.pvs['RBV'].reads == 1
+    assert client.get('RBV', max_age = 0) == 1.5 and client.pvs['RBV'].reads == 2
+    client.subscriptions['VAL'] = None
+    client.store('VAL', client.pvs['VAL'].read())
+    assert client.get('VAL', max_age = 0) == 2.0 and client.pvs['VAL'].reads == 1
+    client.pvs['VAL'].connected = False
+    assert client.get('VAL') is None and client.age('VAL') is None
+
+
+def test_read_many_shares_one_deadline():
+    ("Check that a batched read through a live IOC returns the values and None for missing PVs without waiting "
+     "for every missing PV in turn.")
+    import os
+    import asyncio
+    from threading import Thread
+    from time import time
+    for key, value in (('EPICS_CAS_INTF_ADDR_LIST', '127.0.0.1'), ('EPICS_CA_ADDR_LIST', '127.0.0.1'),
+                       ('EPICS_CA_AUTO_ADDR_LIST', 'NO')):
+        os.environ.setdefault(key, value)
+    from caproto.asyncio.server import start_server
+    from caproto.threading.client import Context
+    from syringe_pump.device_io import build_pvdb
+    from syringe_pump.device_client import Client, read_many
+    pvdb, servers = build_pvdb({1: None}, prefix = 'READMANY:')
+    loop = asyncio.new_event_loop()
+    task = loop.create_task(start_server(pvdb, interfaces = ['127.0.0.1']))
+    thread = Thread(target = loop.run_until_complete, args = (task,), daemon = True)
+    thread.start()
+    ctx = Context()
+    try:
+        present = Client('READMANY:SYRINGE1.', ctx = ctx)
+        missing = Client('READMANY:SYRINGE9.', ctx = ctx)
+        t = time()
+        values = read_many([present, missing], names = ('VELO', 'VALVE', 'DMOV', 'HIST_WINDOW'), timeout = 1.0)
+        assert time() - t < 2.5
+        read = values['READMANY:SYRINGE1.']
+        assert read['VALVE'] == '' and read['DMOV'] == 1 and read['HIST_WINDOW'] == 3600.0
+        assert read['VELO'] != read['VELO'] #nan until the pump publishes a speed
+        assert set(values['READMANY:SYRINGE9.'].values()) == {None}
+        assert present.age('DMOV') is not None and missing.age('DMOV') is None
+    finally:
+        ctx.disconnect()
+        loop.call_soon_threadsafe(task.cancel)
+        thread.join(5)
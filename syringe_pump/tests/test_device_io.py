@@ -0,0 +1,62 @@
+from syringe_pump.device_io import build_pvdb
+
+
+def test_one_pvdb_for_many_pumps():
+    "Check that the PV groups of several pumps are combined with per-pump prefixes."
+    pvdb, servers = build_pvdb({1: None, 2: None, 10: None}, prefix = 'TEST:')
+    assert len(servers) == 3
+    for pump_id in (1, 2, 10):
+        for name in ('RBV', 'VAL', 'VELO', 'VALVE', 'DMOV', 'CMD', 'ACK', 'STATUS'):
+            assert f'TEST:SYRINGE{pump_id}.{name}' in pvdb
+    assert len(pvdb) == 3*len(servers[0].pvdb)
+
+
+def test_readbacks_do_not_run_putters():
+    ("Check that values published by the device bypass the putters and the control limits, and that a failing PV "
+     "does not stop the others.")
+    import asyncio
+    from math import isnan
+    pvdb, servers = build_pvdb({1: None}, prefix = 'TEST:')
+    server = servers[0]
+    calls = []
+
+    class Worker(object):
+        def submit(self, pv_name, value):
+            calls.append((pv_name, value))
+    server.device = object()
+    server.worker = Worker()
+    asyncio.run(server.publish({'VALVE': 'o', 'VELO': 100.0, 'RBV': [1.0, 2.0], 'DMOV': True}))
+    assert calls == []
+    assert server.VALVE.value == 'o'
+    assert server.VELO.value == 100.0
+    assert isnan(server.RBV.value)
+    assert server.DMOV.value == 1
+
+
+def test_doorbell_is_drained_while_rate_limited():
+    "Check that the publish loop takes the doorbell tokens rung while values wait for the rate limit."
+    import asyncio
+    from caproto.asyncio.server import AsyncioAsyncLayer
+    from syringe_pump.device_io import Server
+    pvdb, servers = build_pvdb({1: None}, prefix = 'TEST:')
+    server = servers[0]
+
+    class Device(object):
+        pass
+    server.device = Device()
+
+    async def main():
+        task = asyncio.create_task(Server.RBV.pvspec.startup(server, server.RBV, AsyncioAsyncLayer))
+        await asyncio.sleep(0.01)
+        depth = 0
+        for i in range(60):
+            server.io_put_queue.put({'RBV': float(i), 'FLOW': float(i)})
+            await asyncio.sleep(0.005)
+            depth = max(depth, server.doorbell._queue.qsize())
+        await asyncio.sleep(0.25)
+        task.cancel()
+        return depth
+    assert asyncio.run(main()) <= 1
+    assert server.RBV.value == 59.0
+    assert server.FLOW.value == 59.0
+    assert server.io_put_queue.stats()['published'] < 30
@@ -0,0 +1,71 @@
+import os
+import pty
+import threading
+import tty
+
+from syringe_pump.discovery import PortDiscovery
+
+
+def pump_pty(pump_id):
+    "opens pty that answers the pump id query like a pump with given pump id"
+    master, slave = pty.openpty()
+    tty.setraw(slave)
+
+    def responder():
+        buffer = b''
+        while True:
+            try:
+                buffer += os.read(master, 100)
+            except OSError:
+                return
+            while b'\r' in buffer:
+                command, buffer = buffer.split(b'\r', 1)
+                if command == b'/1?80':
+                    os.write(master, b'\xff/0`ZA%d\x03\r\n' % pump_id)
+
+    threading.Thread(target = responder, daemon = True).start()
+    return master, slave
+
+
+def test_find_and_cache(tmp_path):
+    "Check that discovery scans all ports concurrently and revalidates the cached port first."
+    ptys = [pump_pty(pump_id) for pump_id in (1, 2)]
+    names = [os.ttyname(slave) for master, slave in ptys] + ['/dev/does-not-exist']
+    filename = str(tmp_path / 'ports.json')
+    discovery = PortDiscovery(cache_filename = filename, timeout = 0.1)
+    assert discovery.find(2, ports = names) == names[1]
+    assert set(discovery.cache.keys()) == {'1', '2'}
+
+    discovery = PortDiscovery(cache_filename = filename, timeout = 0.1)
+    probed = []
+    probe = discovery.probe
+    discovery.probe = lambda port_name: probed.append(port_name) or probe(port_name)
+    assert discovery.find(1, ports = names) == names[0]
+    assert probed == [names[0]]
+    for master, slave in ptys:
+        os.close(master)
+        os.close(slave)
+
+
+def test_find_all(tmp_path):
+    "Check that several pumps are resolved with one probe per port and one cache write."
+    ptys = [pump_pty(pump_id) for pump_id in (1, 2)]
+    names = [os.ttyname(slave) for master, slave in ptys] + ['/dev/does-not-exist']
+    filename = str(tmp_path / 'ports.json')
+    PortDiscovery(cache_filename = filename, timeout = 0.1).find(1, ports = names[:1])
+
+    discovery = PortDiscovery(cache_filename = filename, timeout = 0.1)
+    probed = []
+    saved = []
+    probe = discovery.probe
+    discovery.probe = lambda port_name: probed.append(port_name) or probe(port_name)
+    save_cache = discovery.save_cache
+    discovery.save_cache = lambda: saved.append(True) or save_cache()
+    assert discovery.find_all([1, 2, 3], ports = names) == {1: names[0], 2: names[1], 3: None}
+    assert sorted(probed) == sorted(names)
+    assert len(saved) == 1
+    assert set(PortDiscovery(cache_filename = filename).cache.keys()) == {'1', '2'}
+    assert discovery.find_all([]) == {}
+    for master, slave in ptys:
+        os.close(master)
+        os.close(slave)
@@ -0,0 +1,58 @@
+import os
+import pty
+import threading
+import tty
+
+from serial import Serial
+
+from syringe_pump.driver import Driver
+
+
+def serve(master, replies, received):
+    buffer = b''
+    while True:
+        try:
+            buffer += os.read(master, 100)
+        except OSError:
+            return
+        while b'\r' in buffer:
+            command, buffer = buffer.split(b'\r', 1)
+            received.append(command)
+            os.write(master, b'\xff/0' + replies[command] + b'\x03\r\n')
+
+
+def test_status_one_transaction():
+    "Check that position, busy flag and error come from a single position query."
+    master, slave = pty.openpty()
+    tty.setraw(slave)
+    replies = {b'/1?18': b'@12.500', b'/1?20R': b'`O', b'/1?37': b'`25.0'}
+    received = []
+    threading.Thread(target = serve, args = (master, replies, received), daemon = True).start()
+    driver = Driver()
+    driver.port = Serial(os.ttyname(slave), timeout = 1)
+    driver.pacer.busy_gap = 0.0
+    status = driver.status(valve = False, speed = False)
+    assert received == [b'/1?18']
+    assert (status.position, status.busy, status.error) == (12.5, True, 'No Error')
+    assert status.valve is None and status.speed is None
+    status = driver.status()
+    assert (status.valve, status.speed) == ('o', 25.0)
+    driver.port.close()
+    os.close(master)
+    os.close(slave)
+
+
+def test_rejected_commands_return_replies():
+    ("Check that commands rejected before they are sent return Reply objects with an error status and are not "
+     "written to the port.")
+    from syringe_pump.reply import Reply, ErrorCode
+    driver = Driver()
+    driver.address = b'1'
+    driver.volume = 250.0
+    for reply in (driver.set_backlash(-1), driver._set_speed(1000.0), driver.assign_volume(volume = 123)):
+        assert isinstance(reply, Reply)
+        assert reply.error == ErrorCode.INVALID_OPERAND and reply['error'] == 'Invalid Operand'
+        assert reply['error_code'] == b'c'
+        assert reply.busy is False and reply['value'] == b''
+    reply = driver.initialize(orientation = 'X')
+    assert reply.error == ErrorCode.INVALID_COMMAND and reply['error'] == 'Invalid Command'
@@ -1,3 +1,52 @@
-def test_one_plus_one_is_two():
-    "Check that one and one are indeed two."
-    assert 1 + 1 == 2
+import json
+from time import time
+
+from pytest import raises
+
+
+def test_commands_example():
+    "Check that the command builder example gives the documented frames and errors."
+    from syringe_pump.commands import CommandBuilder, encode_move_abs
+    assert CommandBuilder(b'1').valve('i').speed(25).absolute(100).frame() == b'/1IV25.0,1A100.0,1R\r'
+    assert encode_move_abs(b'1', position = 100, speed = 25) == b'/1V25.0,1A100.0,1R\r'
+    with raises(ValueError, match = 'position 300 is out of range 0.0 - 250.0 uL'):
+        encode_move_abs(b'1', position = 300, speed = 25)
+
+
+def test_reply_example():
+    "Check that the reply parser example gives the documented fields."
+    from syringe_pump.reply import parse_reply, ErrorCode
+    reply = parse_reply(b"\xff/0`12.500\x03\r\n")
+    assert (reply.busy, reply.error, reply.value) == (False, ErrorCode.NO_ERROR, b'12.500')
+    assert reply['error'] == 'No Error'
+
+
+def test_telemetry_example():
+    "Check that the telemetry example records one sample and returns it as a view and as a history."
+    from syringe_pump.telemetry import Telemetry
+    telemetry = Telemetry(length = 3600)
+    telemetry.append(t = time(), position = 25.0, busy = True, valve = b'o', speed = 1.0, error_code = b'@',
+                     latency = 0.012)
+    assert list(telemetry.last_seconds(60)['position']) == [25.0]
+    assert telemetry.history(window = 3600, bins = 500).shape == (1, 2)
+
+
+def test_trajectory_example():
+    "Check that the trajectory example interpolates the position and the arrival time."
+    from syringe_pump.trajectory import Trajectory
+    trajectory = Trajectory()
+    trajectory.start(t = 0.0, position = 0.0, target = 100.0, speed = 10.0)
+    assert trajectory.position(2.5) == 25.0
+    assert trajectory.arrival() == 10.0
+
+
+def test_benchmark_example():
+    ("Check that a benchmark run with the IOC gives JSON results with enough put -> RBV samples for its "
+     "percentiles.")
+    from syringe_pump.benchmark import run_benchmarks, compare, PUT_TO_RBV_MIN
+    results = json.loads(json.dumps(run_benchmarks(N = 5, duration = 0.1, latency = 0.0, baudrate = 0)))
+    for name in ('put_to_write', 'put_to_rbv'):
+        summary = results['put_to_rbv'][name]
+        assert summary['n'] == PUT_TO_RBV_MIN
+        assert summary['min'] <= summary['median'] <= summary['p95'] <= summary['max']
+    assert compare(results, results) == []
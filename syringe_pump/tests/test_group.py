@@ -0,0 +1,106 @@
+from syringe_pump.device import Device
+from syringe_pump.bus import Bus
+from syringe_pump.group import PumpGroup
+from syringe_pump import mock_driver
+
+
+def test_synchronized_flow():
+    ("Check that the pumps on two ports and on one shared bus start their loaded flows back to back and that the "
+     "reported skew matches the simulated starts.")
+    single = mock_driver.Simulator()
+    shared = mock_driver.Simulator(pumps = {2: b'2', 3: b'3'})
+    for simulator in (single, shared):
+        simulator.open()
+        for model in simulator.pumps.values():
+            model.valve_time = 0.01
+            model.init_stroke_time = 0.01
+    bus = Bus()
+    bus.open(shared.port_name)
+    devices = []
+    for pump_id, driver in ((1, mock_driver.Driver(single)), (2, bus.driver(b'2')), (3, bus.driver(b'3'))):
+        device = Device()
+        device.init(pump_id = pump_id, speed = 25, backlash = 100, orientation = 'Y', volume = 250,
+                    driver = driver)
+        device.wait(dt = 0.01)
+        device.move_abs(position = 10.0, speed = 200.0)
+        devices.append(device)
+    for device in devices:
+        device.wait(dt = 0.01)
+    group = PumpGroup(devices)
+    group.prepare_flow([(0.0, 2.0), (0.0, 1.0), (5.0, 1.0)])
+    #nothing moves before R
+    assert [device.get_busy() for device in devices] == [False]*3
+    report = group.start()
+    assert [pump['reply']['error'] for pump in report['pumps']] == ['No Error']*3
+    assert [device.loaded for device in devices] == [None]*3
+    assert [device.speed for device in devices] == [2.0, 1.0, 1.0]
+    #every pump started between its R and its reply; the pumps on different ports together, the second pump on the
+    #bus one transaction later
+    models = [single.pumps[b'1'], shared.pumps[b'2'], shared.pumps[b'3']]
+    starts = [model.segments[-1][0] - report['start'] for model in models]
+    for pump, started in zip(report['pumps'], starts):
+        assert pump['sent'] - 0.001 <= started <= pump['acked']
+    sent = [pump['sent'] for pump in report['pumps']]
+    assert sent[1] < 0.01
+    assert report['pumps'][1]['acked'] <= sent[2] == report['skew'] <= report['skew_bound'] < 0.1
+    assert devices[0].get_busy() and devices[2].get_busy()
+    bus.close()
+    devices[0].driver.port.close()
+    single.close()
+    shared.close()
+
+
+def test_pacing_wait_outside_of_the_locks():
+    ("Check that fire() waits out the pacing gap without holding the port locks and flushes the ports under the "
+     "locks before writing R.")
+    from threading import Lock
+    from syringe_pump.group import fire
+    from syringe_pump.reply import parse_reply
+    from syringe_pump.clock import VirtualClock
+    clock = VirtualClock(start = 0.0)
+    lock = Lock()
+    log = []
+
+    class Port(object):
+        port = 'stub'
+        def flushInput(self):
+            log.append(('flush', lock.locked()))
+        def flushOutput(self):
+            pass
+
+    class Pacer(object):
+        def delay(self, t):
+            return 0.05 - t
+        def classify(self, command):
+            return 'move'
+        def record(self, *args, **kwargs):
+            pass
+
+    class Instrumentation(object):
+        def record(self, *args):
+            pass
+
+    class Driver(object):
+        address = b'1'
+        pump_id = 1
+        port = Port()
+        pacer = Pacer()
+        instrumentation = Instrumentation()
+        def parse_reply(self, reply):
+            return parse_reply(reply)
+        def __init__(self):
+            self.lock = lock
+        def write(self, command, port):
+            log.append(('write', command, clock.time()))
+        def read(self, port):
+            return b'\xff/0@\x03\r\n'
+
+    sleep = clock.sleep
+    def paced_sleep(dt):
+        log.append(('sleep', lock.locked()))
+        sleep(dt)
+    clock.sleep = paced_sleep
+    report = fire([Driver()], clock = clock)
+    assert log[0] == ('sleep', False)
+    assert log[-2:] == [('flush', True), ('write', b'/1R\r', 0.05)]
+    assert report['pumps'][0]['reply']['busy'] is True
@@ -0,0 +1,60 @@
+from syringe_pump.instrumentation import Instrumentation, opcode, LATENCY_BINS
+from syringe_pump.bus import Bus
+from syringe_pump.mock_driver import Simulator
+
+
+def test_opcode():
+    "Check that commands are reduced to their command letters."
+    assert opcode(b'/1V5.0,1A10.0,1R\r') == 'VA'
+    assert opcode(b'/1?18\r') == '?18'
+    assert opcode(b'/1V2.0,1F\r') == 'VF'
+    assert opcode(b'/3TR\r') == 'T'
+    assert opcode(b'/1R\r') == 'R'
+
+
+def test_record_outcomes():
+    "Check that timeouts, bad replies and error codes are counted per opcode and per port."
+    instrumentation = Instrumentation()
+    instrumentation.record(b'/1?18\r', 'A', 0.015, 0.001, b'\xff/0`0.000\x03\r\n', 'No Error')
+    instrumentation.record(b'/1?18\r', 'A', 2.5, 0.0, b'', None)
+    instrumentation.record(b'/1A10,1R\r', 'A', 0.004, 0.0, b'\xff/0O\x03\r\n', 'Command Buffer Overflow')
+    instrumentation.record(b'/1A10,1R\r', 'B', 0.004, 0.0, b'\xff/0', None)
+    stats = instrumentation.snapshot()
+    query = stats['opcodes']['?18']
+    assert query['count'] == 2 and query['timeouts'] == 1 and query['latency_max'] == 2.5
+    assert query['histogram'][LATENCY_BINS.index(0.02)] == 1 and query['histogram'][-1] == 1
+    move = stats['opcodes']['A']
+    assert move['errors'] == {'Command Buffer Overflow': 1} and move['bad_replies'] == 1
+    assert stats['ports']['A']['count'] == 3 and stats['ports']['B']['count'] == 1
+
+
+def test_driver_records_transactions():
+    "Check that Driver.query records the transactions of all pumps on a bus against the simulator."
+    simulator = Simulator(pumps = {1: b'1'}, latency = 0.001, baudrate = 0)
+    simulator.open()
+    bus = Bus()
+    bus.open(simulator.port_name, timeout = 0.05)
+    driver = bus.driver(b'1')
+    driver.query(b'/1?18\r')
+    driver.query(b'/1A10,1R\r')
+    bus.driver(b'2').query(b'/2?18\r')
+    stats = bus.instrumentation.snapshot()
+    assert stats['opcodes']['?18']['count'] == 2 and stats['opcodes']['?18']['timeouts'] == 1
+    assert stats['opcodes']['A']['errors'] == {'Device Not Initialized': 1}
+    assert stats['ports'][simulator.port_name]['count'] == 3
+    bus.close()
+    simulator.close()
+
+
+def test_json_fits():
+    "Check that a snapshot too large for the STATS PV stays valid JSON."
+    import json
+    from syringe_pump.instrumentation import to_json
+    instrumentation = Instrumentation()
+    for i in range(50):
+        instrumentation.record(b'/1?' + str(i).encode() + b'\r', 'A', 0.015, 0.0, b'\xff/0`0\x03\r\n', 'No Error')
+    snapshot = instrumentation.snapshot()
+    assert json.loads(to_json(snapshot)) == snapshot
+    reduced = json.loads(to_json(snapshot, max_length = 8000))
+    assert reduced['opcodes']['?3']['count'] == 1 and 'histogram' not in reduced['opcodes']['?3']
+    assert 'error' in json.loads(to_json(snapshot, max_length = 100))
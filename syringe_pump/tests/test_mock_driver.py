@@ -0,0 +1,58 @@
+from time import sleep
+
+from syringe_pump.bus import Bus
+from syringe_pump.mock_driver import PumpModel, Simulator, Driver
+
+
+def test_pump_model_commands():
+    "Check kinematics, load/execute and error codes of the simulated firmware against explicit times."
+    pump = PumpModel(pump_id = 3)
+    assert pump.command(b'?80', 0.0) == (0x60, b'ZA3')
+    assert pump.command(b'A10,1R', 0.0) == (0x67, b'')  # device not initialized
+    assert pump.command(b'Y7,0,0R', 0.0) == (0x40, b'')
+    assert pump.command(b'?20R', 1.0) == (0x60, b'o')
+    assert pump.command(b'V10,1A100,1R', 1.0) == (0x40, b'')
+    assert pump.command(b'IR', 2.0) == (0x4F, b'')  # command buffer overflow
+    assert pump.command(b'?18', 3.0) == (0x40, b'20.000')
+    assert pump.command(b'V5,1F', 3.0)[0] == 0x40
+    assert pump.command(b'?18', 5.0)[1] == b'30.000'
+    assert pump.command(b'TR', 5.0) == (0x60, b'')
+    assert pump.command(b'D10,1', 6.0) == (0x60, b'')  # loaded, not executed
+    assert pump.command(b'?18', 6.0)[1] == b'30.000'
+    assert pump.command(b'R', 6.0) == (0x40, b'')
+    assert pump.command(b'?18', 10.0) == (0x60, b'20.000')
+    assert pump.command(b'R', 10.0) == (0x6E, b'')  # command buffer empty
+    assert pump.command(b'A300,1R', 10.0) == (0x63, b'')  # invalid operand
+    assert pump.command(b'XR', 10.0) == (0x62, b'')  # invalid command
+    assert pump.command(b'V50,1IgA0,1A100,1G2OR', 10.0) == (0x40, b'')  # program with a loop
+    #valve until 10.25, 20 -> 0 until 10.65, then 0 -> 100 -> 0 -> 100 in 2 s strokes, valve until 16.9
+    assert pump.command(b'?18', 11.65)[1] == b'50.000'
+    assert pump.command(b'?18', 13.15)[1] == b'75.000'
+    assert pump.command(b'?18', 15.15)[1] == b'25.000'
+    assert pump.command(b'?20', 16.8) == (0x40, b'i')
+    assert pump.command(b'?20', 17.0) == (0x60, b'o')
+    assert pump.command(b'gA0,1R', 20.0) == (0x62, b'')  # loop not closed
+
+
+def test_simulator_over_pty():
+    "Check that the driver and the bus work against several simulated pumps on one pty."
+    simulator = Simulator(pumps = {1: b'1', 2: b'2'}, latency = 0.001, baudrate = 0)
+    simulator.open()
+    for model in simulator.pumps.values():
+        model.valve_time = 0.01
+        model.init_stroke_time = 0.01
+    driver = Driver(simulator)
+    driver.pacer.busy_gap = 0.01
+    driver.init(pump_id = 1, speed = 25, backlash = 100, orientation = 'Y', volume = 250)
+    sleep(0.05)
+    reply = driver.move_abs(position = 10, speed = 100)
+    assert reply['busy'] is True and reply['error'] == 'No Error'
+    sleep(0.15)
+    status = driver.status()
+    assert status.position == 10.0 and status.busy is False and status.valve == 'o'
+    driver.port.close()
+    bus = Bus()
+    bus.open(simulator.port_name)
+    assert bus.scan(range(4), timeout = 0.05) == {1: b'1', 2: b'2'}
+    bus.close()
+    simulator.close()
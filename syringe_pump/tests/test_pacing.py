@@ -0,0 +1,33 @@
+from syringe_pump.pacing import Pacer
+
+
+def test_classify():
+    "Check that commands are sorted into query, move and on-the-fly classes."
+    assert Pacer.classify(b'/1?18\r') == 'query'
+    assert Pacer.classify(b'/1?29R\r') == 'query'
+    assert Pacer.classify(b'/1V25.0,1A10.0,1R\r') == 'move'
+    assert Pacer.classify(b'/1V25.0,1F\r') == 'on_the_fly'
+
+
+def test_gap_learning():
+    "Check that the gap shrinks on answered commands, backs off on lost replies and respects busy."
+    pacer = Pacer(busy_gap = 0.1, min_gap = 0.005, max_gap = 1.0, decay = 0.5)
+    for i in range(10):
+        pacer.record('query', t_start = i, t_end = i + 0.004, replied = True, busy = False)
+    #turnaround 4 ms plus 1 ms margin
+    assert abs(pacer.gaps['query'] - 0.005) < 1e-9
+    assert abs(pacer.delay(9.004) - 0.005) < 1e-9
+    pacer.record('query', t_start = 20.0, t_end = 20.004, replied = True, busy = True)
+    assert abs(pacer.delay(20.004) - 0.1) < 1e-9
+    pacer.record('query', t_start = 30.0, t_end = 32.0, replied = False)
+    assert abs(pacer.gaps['query'] - 0.01) < 1e-9
+    assert pacer.snapshot()['query']['misses'] == 1
+
+
+def test_gap_follows_turnaround():
+    "Check that the gap converges to the measured turnaround plus the margin of a slow pump."
+    pacer = Pacer(busy_gap = 0.1, min_gap = 0.005, max_gap = 1.0, decay = 0.5, margin = 0.002)
+    for i in range(20):
+        pacer.record('move', t_start = i, t_end = i + 0.030, replied = True, busy = False)
+    assert abs(pacer.gaps['move'] - 0.032) < 1e-9
+    assert pacer.gaps['query'] == 0.1
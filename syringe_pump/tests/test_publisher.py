@@ -0,0 +1,34 @@
+from queue import Queue
+
+from syringe_pump.publisher import Publisher
+
+
+def test_coalescing_and_doorbell():
+    "Check that only the latest value per PV is published and the doorbell rings once per batch."
+    doorbell = Queue()
+    publisher = Publisher(doorbell = doorbell)
+    for i in range(5):
+        publisher.put({'RBV': float(i)})
+    publisher.put({'VALVE': 'o'})
+    assert doorbell.qsize() == 1
+    assert publisher.flush(now = 0.0) == {'RBV': 4.0, 'VALVE': 'o'}
+    assert publisher.stats() == {'depth': 0, 'dropped': 4, 'suppressed': 0, 'published': 2}
+    publisher.put({'RBV': 5.0})
+    assert doorbell.qsize() == 2
+
+
+def test_deadband_and_rate_limit():
+    "Check that small changes are suppressed and fast updates wait for the minimum interval."
+    publisher = Publisher(settings = {'RBV': {'deadband': 0.01, 'max_rate': 10.0}})
+    publisher.put({'RBV': 1.0})
+    assert publisher.flush(now = 0.0) == {'RBV': 1.0}
+    publisher.put({'RBV': 1.005})
+    assert publisher.flush(now = 1.0) == {}
+    assert publisher.stats()['suppressed'] == 1
+    publisher.put({'RBV': 2.0})
+    assert publisher.flush(now = 1.05) == {'RBV': 2.0}
+    publisher.put({'RBV': 3.0})
+    assert publisher.flush(now = 1.1) == {}
+    assert abs(publisher.next_due(now = 1.1) - 0.05) < 1e-9
+    assert publisher.flush(now = 1.16) == {'RBV': 3.0}
+    assert publisher.next_due(now = 1.16) is None
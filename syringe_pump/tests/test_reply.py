@@ -0,0 +1,35 @@
+from syringe_pump.reply import parse_reply, Reply, ErrorCode, STATUS_TABLE
+
+
+def test_status_table():
+    "Check the status byte table against the Centris manual."
+    assert len(STATUS_TABLE) == 256
+    assert STATUS_TABLE[ord('`')] == (False, ErrorCode.NO_ERROR)
+    assert STATUS_TABLE[ord('@')] == (True, ErrorCode.NO_ERROR)
+    assert STATUS_TABLE[ord('i')] == (False, ErrorCode.PLUNGER_OVERLOAD)
+    assert STATUS_TABLE[ord('O')] == (True, ErrorCode.COMMAND_BUFFER_OVERFLOW)
+    assert STATUS_TABLE[ord('0')] == (None, None)
+
+
+def test_parse_reply():
+    "Check value slicing, legacy dictionary access and in-place parsing."
+    reply = parse_reply(b'\xff/0`12.500\x03\r\n')
+    assert reply.value == b'12.500'
+    assert bytes(reply.value_view) == b'12.500'
+    assert reply['error_code'] == b'`'
+    assert reply['busy'] is False
+    assert reply['error'] == 'No Error'
+    record = Reply()
+    assert parse_reply(b'\xff/0C\x03\r\n', out = record) is record
+    assert record.busy is True and record.error == ErrorCode.INVALID_OPERAND
+    assert record.value == b''
+    assert parse_reply(b'', out = record)['error'] == 'no device found'
+    assert record.value is None
+
+
+def test_rejected_reply():
+    "Check that a rejected command gives the reply of a ready pump with the error code."
+    from syringe_pump.reply import rejected_reply
+    reply = rejected_reply()
+    assert (reply.status, reply.busy, reply.error, reply.value) == (0x63, False, ErrorCode.INVALID_OPERAND, b'')
+    assert rejected_reply(ErrorCode.INVALID_COMMAND)['error'] == 'Invalid Command'
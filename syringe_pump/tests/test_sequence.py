@@ -0,0 +1,117 @@
+from syringe_pump.sequence import Sequence, Scheduler
+from syringe_pump.trajectory import Trajectory
+
+
+class Pump(object):
+    "Pump with a busy flag set by the test."
+
+    def __init__(self):
+        self.busy = False
+        self.trajectory = Trajectory()
+
+    def get_busy(self):
+        return self.busy
+
+
+def test_sequence_steps_on_ready_and_cancels():
+    ("Check that a sequence runs the next step only when the pump is ready and drops the remaining steps when "
+     "cancelled.")
+    pump = Pump()
+    log = []
+
+    def steps():
+        for i in range(3):
+            log.append(i)
+            yield 'step {}'.format(i)
+    progress = []
+    sequence = Sequence(pump, steps(), name = 'test', total = 3,
+                        on_progress = lambda sequence: progress.append(sequence.label))
+    assert sequence.advance(0.0) is False and log == [0]
+    pump.busy = True
+    assert sequence.advance(1.0) is False and log == [0]
+    pump.busy = False
+    assert sequence.advance(1.01) is False and log == [0]  # next check is poll_period after the busy reply
+    assert sequence.advance(2.0) is False and log == [0, 1]
+    assert sequence.as_dict() == {'name': 'test', 'state': 'running', 'step': 2, 'steps': 3, 'label': 'step 1',
+                                  'progress': 0.33}
+    sequence.cancel()
+    assert sequence.advance(2.0) is True and log == [0, 1]
+    assert sequence.wait(0) == 'cancelled'
+    assert progress == ['step 0', 'step 1', 'step 1']
+
+
+def test_concurrent_sequences_on_one_scheduler():
+    "Check that the compound actions of two pumps run concurrently on one scheduler thread against the simulator."
+    from syringe_pump.clock import VirtualClock
+    from syringe_pump.bus import Bus
+    from syringe_pump.device import Device
+    from syringe_pump.mock_driver import Simulator
+    clock = VirtualClock(start = 1000.0)
+    simulator = Simulator(pumps = {1: b'1', 2: b'2'}, clock = clock)
+    simulator.open()
+    bus = Bus()
+    bus.open(simulator.port_name)
+    scheduler = Scheduler(clock = clock)
+    devices = []
+    for pump_id in (1, 2):
+        device = Device(clock = clock)
+        device.init(pump_id = pump_id, speed = 25, backlash = 100, orientation = 'Y', volume = 250,
+                    driver = bus.driver(pump_id - 1))
+        device.scheduler = scheduler
+        devices.append(device)
+    fill = devices[0].fill(volume = 100.0, wait = False)
+    prime = devices[1].prime(N = 2, wait = False)
+    assert fill.wait(10) == 'done' and prime.wait(10) == 'done'
+    assert devices[0].get_position() == 100.0 and devices[1].get_position() == 250.0
+    assert devices[0].sequences == [] and devices[1].sequences == []
+    bus.close()
+    simulator.close()
+
+
+def test_silent_pump_fails_sequence():
+    ("Check that a sequence fails after the no-reply timeout and that an exception in one ready check does not "
+     "stop the scheduler.")
+    from syringe_pump.clock import VirtualClock
+    pump = Pump()
+    pump.busy = None
+
+    def steps():
+        yield 'step'
+        yield 'never'
+    sequence = Sequence(pump, steps(), name = 'silent', wait_ready = False, no_reply_timeout = 1.0)
+    assert sequence.advance(0.0) is False
+    assert sequence.advance(0.5) is False
+    assert sequence.advance(1.6) is True
+    assert sequence.wait(0) == 'error' and 'no reply' in str(sequence.error)
+
+    class Broken(Pump):
+        def get_busy(self):
+            raise OSError('port closed')
+    scheduler = Scheduler(clock = VirtualClock(start = 0.0))
+    broken = scheduler.start(Sequence(Broken(), steps(), name = 'broken'))
+    healthy = scheduler.start(Sequence(Pump(), steps(), name = 'healthy'))
+    assert broken.wait(5) == 'error' and isinstance(broken.error, OSError)
+    assert healthy.wait(5) == 'done'
+
+
+def test_shared_scheduler_is_created_once(monkeypatch):
+    "Check that threads asking for the shared scheduler at the same time get one scheduler."
+    from threading import Thread
+    from time import sleep
+    from syringe_pump import sequence
+    created = []
+
+    class SlowScheduler(object):
+        def __init__(self):
+            sleep(0.01)
+            created.append(self)
+    monkeypatch.setattr(sequence, 'Scheduler', SlowScheduler)
+    monkeypatch.setattr(sequence, '_scheduler', None)
+    schedulers = []
+    threads = [Thread(target = lambda: schedulers.append(sequence.shared_scheduler())) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(created) == 1
+    assert all(scheduler is created[0] for scheduler in schedulers) and len(schedulers) == 8
@@ -0,0 +1,55 @@
+from syringe_pump.telemetry import Telemetry
+
+
+def test_wraparound_returns_views():
+    "Check that the last samples are returned in order as views of the storage after the ring wraps around."
+    telemetry = Telemetry(length = 4)
+    for i in range(6):
+        telemetry.append(t = float(i), position = 10.0*i, busy = i % 2 == 0, valve = 'o', speed = 1.0,
+                         error_code = b'`', latency = 0.01)
+    samples = telemetry.last_N(10)
+    assert list(samples['time']) == [2.0, 3.0, 4.0, 5.0]
+    assert list(samples['busy']) == [1, 0, 1, 0]
+    assert samples['error_code'][0] == ord('`')
+    assert samples.base is telemetry.data
+    recent = telemetry.last_seconds(1.5)
+    assert list(recent['position']) == [40.0, 50.0]
+    assert recent.base is telemetry.data
+
+
+def test_unknown_values():
+    "Check that a sample without a reply is recorded with unknown busy flag and zero status byte."
+    telemetry = Telemetry(length = 4)
+    assert len(telemetry.last_N(3)) == 0
+    telemetry.append(t = 1.0, position = float('nan'), busy = None, valve = '', speed = 1.0, error_code = None,
+                     latency = 2.0)
+    assert telemetry.last_N(1)['busy'][0] == -1
+    assert telemetry.last_N(1)['error_code'][0] == 0
+
+
+def test_minmax_history():
+    "Check that the history keeps the extremes of every bin."
+    telemetry = Telemetry(length = 100)
+    for i in range(40):
+        telemetry.append(t = float(i), position = float(i % 10), busy = False, valve = 'o', speed = 1.0,
+                         error_code = b'`', latency = 0.01)
+    history = telemetry.history(window = 19.5, bins = 2)
+    assert history.shape == (4, 2)
+    assert list(history[:, 1]) == [0.0, 9.0, 0.0, 9.0]
+    assert history[0, 0] == 20.0 and history[-1, 0] == 39.0
+    assert telemetry.history(N = 5).shape == (5, 2)
+
+
+def test_minmax_keeps_direction():
+    "Check that a falling trace is decimated to falling points at the times of the extremes."
+    from numpy import arange, nan
+    from syringe_pump.telemetry import minmax_decimate
+    t = arange(20.0)
+    history = minmax_decimate(t, 100.0 - 5*t, bins = 4)
+    assert history.tolist() == [[0, 100], [4, 80], [5, 75], [9, 55], [10, 50], [14, 30], [15, 25], [19, 5]]
+    values = 100.0 - 5*t
+    values[5:10] = nan
+    values[12] = 200.0
+    history = minmax_decimate(t, values, bins = 4)
+    assert history[2:4, 0].tolist() == [5.0, 9.0]
+    assert history[4:6].tolist() == [[12, 200], [14, 30]]
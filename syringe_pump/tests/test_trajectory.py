@@ -0,0 +1,25 @@
+from syringe_pump.trajectory import Trajectory
+
+
+def test_constant_speed_move():
+    "Check that the model moves with constant speed and stops at the target."
+    trajectory = Trajectory()
+    trajectory.start(t = 10.0, position = 100.0, target = 50.0, speed = 5.0)
+    assert trajectory.position(12.0) == 90.0
+    assert trajectory.arrival() == 20.0
+    assert trajectory.moving(19.0)
+    assert trajectory.position(30.0) == 50.0
+    assert not trajectory.moving(30.0)
+
+
+def test_speed_change_and_correction():
+    "Check that speed changes re-anchor the model and polls remove the drift."
+    trajectory = Trajectory()
+    trajectory.start(t = 0.0, position = 0.0, target = 100.0, speed = 10.0)
+    trajectory.change_speed(t = 2.0, speed = 5.0)
+    assert trajectory.position(4.0) == 30.0
+    trajectory.correct(t = 4.0, position = 28.0, busy = True)
+    assert trajectory.position(6.0) == 38.0
+    trajectory.correct(t = 7.0, position = 40.0, busy = False)
+    assert trajectory.position(8.0) == 40.0
+    assert trajectory.arrival() is None
@@ -0,0 +1,55 @@
+from threading import Event
+from queue import Full
+from time import time, sleep
+
+import pytest
+
+from syringe_pump.worker import DeviceWorker
+
+
+class Device(object):
+    "Device that records requests and blocks on the first one until released."
+
+    def __init__(self):
+        self.executed = []
+        self.written = []
+        self.release = Event()
+
+    def ioexecute(self, pv_name, value):
+        self.release.wait(2)
+        self.executed.append((pv_name, value))
+
+    def iowrite(self, pv_name, value):
+        self.written.append((pv_name, value))
+
+    def abort(self):
+        self.executed.append(('abort', None))
+
+
+def wait_for(condition, timeout = 2.0):
+    "Poll condition until it is true or timeout seconds have passed, return its last value."
+    deadline = time() + timeout
+    while not condition() and time() < deadline:
+        sleep(0.001)
+    return condition()
+
+
+def test_ordered_bounded_cancellable():
+    "Check that requests run in order, the queue is bounded and pending requests can be cancelled."
+    device = Device()
+    worker = DeviceWorker(device, maxsize = 2)
+    worker.submit('VAL', 1.0)
+    assert wait_for(lambda: worker.current is not None)
+    worker.submit('VELO', 2.0)
+    job_id = worker.submit('VAL', 3.0)
+    with pytest.raises(Full):
+        worker.submit('VAL', 4.0)
+    assert worker.cancel(job_id) == 1
+    device.release.set()
+    assert wait_for(lambda: not worker.pending())
+    worker.stop()
+    worker.thread.join(2)
+    assert device.executed == [('VAL', 1.0), ('VELO', 2.0)]
+    assert ('ACK', "3 VAL=3.0: cancelled") in device.written
+    assert ('ACK', "2 VELO=2.0: done") in device.written
+    assert device.written[-1] == ('STATUS', 'idle')
@@ -0,0 +1,145 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Plunger motion model.
+
+The pump moves the plunger with constant top speed towards the commanded
+position, so between two position polls the position can be estimated from the
+start time, start position, target and speed of the move. Speed changes on the
+fly re-anchor the model at the estimated position. The acceleration ramps of the
+pump are short compared to the moves used in practice and are not modeled; the
+drift they cause is removed by correct() every time a real position reading
+arrives.
+
+Examples
+--------
+>>> from syringe_pump.trajectory import Trajectory
+>>> trajectory = Trajectory()
+>>> trajectory.start(t = 0.0, position = 0.0, target = 100.0, speed = 10.0)
+>>> trajectory.position(2.5)
+25.0
+>>> trajectory.arrival()
+10.0
+"""
+
+from threading import Lock
+
+
+class Trajectory(object):
+
+    def __init__(self):
+        self.lock = Lock()
+        self.t0 = 0.0 #time of the anchor point
+        self.position0 = 0.0 #position at the anchor point
+        self.target = 0.0
+        self.speed = 0.0
+        self.active = False
+
+    def start(self, t, position, target, speed):
+        """
+        starts new move at time t from position towards target with speed.
+
+        Parameters
+        ----------
+        t: float
+            start time of the move
+        position: float
+            position at the start of the move, uL
+        target: float
+            commanded position, uL
+        speed: float
+            top speed, uL/s
+        """
+        with self.lock:
+            self.t0 = t
+            self.position0 = position
+            self.target = target
+            self.speed = abs(speed)
+            self.active = position != target and self.speed > 0
+
+    def change_speed(self, t, speed):
+        """
+        changes speed of the current move at time t (speed change on the fly)
+        """
+        with self.lock:
+            if self.active:
+                self.position0 = self._position(t)
+                self.t0 = t
+            self.speed = abs(speed)
+
+    def stop(self, t, position = None):
+        """
+        stops the model at time t at the given position or at the estimated position
+        """
+        with self.lock:
+            if position is None:
+                position = self._position(t)
+            self.t0 = t
+            self.position0 = position
+            self.active = False
+
+    def correct(self, t, position, busy):
+        """
+        corrects the model with the position measured at time t. If the pump is not busy anymore, the move is over.
+
+        Parameters
+        ----------
+        t: float
+            time of the measurement
+        position: float
+            measured position, uL. nan is ignored.
+        busy: boolean
+            busy flag of the pump
+        """
+        if position != position:
+            return
+        with self.lock:
+            self.t0 = t
+            self.position0 = position
+            if not busy:
+                self.active = False
+
+    def _position(self, t):
+        if not self.active:
+            return self.position0
+        distance = self.speed*(t - self.t0)
+        if self.target >= self.position0:
+            return min(self.target, self.position0 + distance)
+        else:
+            return max(self.target, self.position0 - distance)
+
+    def position(self, t):
+        """
+        returns estimated position at time t
+
+        Parameters
+        ----------
+        t: float
+
+        Returns
+        -------
+        position: float
+
+        Examples
+        --------
+        >>> trajectory.position(time())
+        25.0
+        """
+        with self.lock:
+            return self._position(t)
+
+    def moving(self, t):
+        """
+        returns True if the model predicts motion at time t
+        """
+        with self.lock:
+            return self.active and self._position(t) != self.target
+
+    def arrival(self):
+        """
+        returns predicted arrival time of the current move, None if there is no move
+        """
+        with self.lock:
+            if not self.active:
+                return None
+            return self.t0 + abs(self.target - self.position0)/self.speed
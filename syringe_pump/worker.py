@@ -0,0 +1,143 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Per-device worker for requests that arrive from PV putters.
+
+The IO server must not call the device directly from the event loop: a move is
+two serial transactions and a compound command such as prime or fill can take
+tens of seconds. The putters submit the request to the worker of their device
+and return immediately. The worker executes the requests one by one in the
+order of arrival in its own thread and reports the progress with the ACK and
+STATUS PVs (via device.iowrite). Pending requests can be cancelled; the number of
+pending requests is bounded.
+
+Examples
+--------
+>>> from syringe_pump.worker import DeviceWorker
+>>> worker = DeviceWorker(device)
+>>> worker.submit('VAL', 25.0)
+1
+>>> worker.pending()
+[(1, 'VAL', 25.0)]
+"""
+
+from collections import deque
+from queue import Full
+from threading import Condition, Thread
+from logging import debug,info,warning,error
+
+
+class DeviceWorker(object):
+
+    def __init__(self, device, maxsize = 16):
+        """
+        Parameters
+        ----------
+        device: Device
+            device that executes requests with device.ioexecute(pv_name, value)
+        maxsize: integer
+            maximum number of pending requests
+        """
+        self.device = device
+        self.maxsize = maxsize
+        self.jobs = deque()
+        self.condition = Condition()
+        self.current = None
+        self.last_id = 0
+        self.running = True
+        self.thread = Thread(target = self.run, name = 'DeviceWorker', daemon = True)
+        self.thread.start()
+
+    def acknowledge(self, job, text):
+        job_id, pv_name, value = job
+        self.device.iowrite(pv_name = 'ACK', value = '{} {}={!r}: {}'.format(job_id, pv_name, value, text))
+
+    def submit(self, pv_name, value):
+        """
+        queues request for execution and returns its id. Raises queue.Full if there are maxsize pending requests.
+
+        Parameters
+        ----------
+        pv_name: string
+        value: object
+
+        Returns
+        -------
+        job_id: integer
+        """
+        with self.condition:
+            if len(self.jobs) >= self.maxsize:
+                raise Full('{} requests are pending, {}={!r} is rejected'.format(len(self.jobs), pv_name, value))
+            self.last_id += 1
+            job = (self.last_id, pv_name, value)
+            self.jobs.append(job)
+            self.condition.notify()
+        self.acknowledge(job, 'queued')
+        return job[0]
+
+    def pending(self):
+        """
+        returns list of pending requests (job_id, pv_name, value) in execution order
+        """
+        with self.condition:
+            return list(self.jobs)
+
+    def cancel(self, job_id = None):
+        """
+        removes pending request job_id, or all pending requests if job_id is None. The request being executed is
+        not affected.
+
+        Returns
+        -------
+        cancelled: integer
+            number of removed requests
+        """
+        with self.condition:
+            if job_id is None:
+                cancelled = list(self.jobs)
+            else:
+                cancelled = [job for job in self.jobs if job[0] == job_id]
+            for job in cancelled:
+                self.jobs.remove(job)
+        for job in cancelled:
+            self.acknowledge(job, 'cancelled')
+        return len(cancelled)
+
+    def abort(self):
+        """
+        cancels all pending requests and aborts the pump motion. Runs in the thread of the caller, not in the
+        worker thread.
+        """
+        self.cancel()
+        self.device.abort()
+
+    def stop(self):
+        """
+        stops the worker thread after the current request
+        """
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.running and len(self.jobs) == 0:
+                    self.condition.wait()
+                if not self.running:
+                    break
+                job = self.jobs.popleft()
+                self.current = job
+            self.device.iowrite(pv_name = 'STATUS', value = 'busy')
+            try:
+                self.device.ioexecute(pv_name = job[1], value = job[2])
+            except Exception as exception:
+                error('request {} failed: {!r}'.format(job, exception))
+                self.acknowledge(job, 'error: {}'.format(exception))
+            else:
+                self.acknowledge(job, 'done')
+            with self.condition:
+                self.current = None
+                idle = len(self.jobs) == 0
+            if idle:
+                self.device.iowrite(pv_name = 'STATUS', value = 'idle')